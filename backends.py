@@ -0,0 +1,138 @@
+import os
+import threading
+from os import path
+from sqlite3 import Connection, IntegrityError
+
+from database import PragmaProfile, connect, transaction
+from migrations import GROUP_MIGRATIONS, create_schema, migrate
+
+
+class StorageBackend:
+    # when set, poll routes are read from the groups' own polls table instead of a separate polls.db
+    polls_in_groups = False
+
+    def __init__(self, data_path: str, profile: PragmaProfile | None = None):
+        self.data_path = data_path
+        self.profile = profile or {}
+
+    def open_group(self, tg_chat_id: int) -> Connection:
+        raise NotImplementedError
+
+    def create_group(self, tg_chat_id: int, description: str) -> Connection:
+        raise NotImplementedError
+
+    def release(self, connection: Connection) -> None:
+        raise NotImplementedError
+
+    def list_groups(self) -> list[int]:
+        raise NotImplementedError
+
+    def open_polls(self) -> Connection:
+        return connect(path.join(self.data_path, 'polls.db'), self.profile, check_same_thread=False)
+
+    def close(self) -> None:
+        pass
+
+
+class FileBackend(StorageBackend):
+    def open_group(self, tg_chat_id: int) -> Connection:
+        db_path = path.abspath(self.group_path(tg_chat_id))
+        if not os.access(db_path, os.R_OK):
+            raise ValueError(f'Group does not exist.')
+
+        return connect(db_path, self.profile)
+
+    def create_group(self, tg_chat_id: int, description: str) -> Connection:
+        db_path = self.group_path(tg_chat_id)
+
+        if path.exists(db_path):
+            raise ValueError(f'Path \'{db_path}\' already exists')
+
+        connection = connect(db_path, self.profile)
+        create_schema(connection)
+        connection.execute('INSERT INTO group_info (id, tg_id, description) VALUES (0, ?, ?)',
+                           (tg_chat_id, description))
+        connection.commit()
+
+        return connection
+
+    def release(self, connection: Connection) -> None:
+        connection.close()
+
+    def list_groups(self) -> list[int]:
+        groups = []
+        for name in os.listdir(self.data_path):
+            stem, extension = path.splitext(name)
+            if extension == '.db' and stem.lstrip('-').isdigit():
+                groups.append(int(stem))
+
+        return sorted(groups)
+
+    def group_path(self, tg_chat_id: int) -> str:
+        return path.join(self.data_path, f'{tg_chat_id}.db')
+
+
+class MultiTenantBackend(StorageBackend):
+    polls_in_groups = True
+
+    def __init__(self, data_path: str, profile: PragmaProfile | None = None, filename: str = 'groups.db'):
+        super().__init__(data_path, profile)
+        self.db_path = path.join(data_path, filename)
+
+        self._local = threading.local()
+        self._connections: list[Connection] = []
+        self._lock = threading.Lock()
+
+        connection = self.connection()
+        create_schema(connection)
+        connection.commit()
+        migrate(connection, GROUP_MIGRATIONS)
+
+    def open_group(self, tg_chat_id: int) -> Connection:
+        connection = self.connection()
+        exists = connection.execute('SELECT 1 FROM group_info WHERE tg_id = ?', (tg_chat_id,)).fetchone()
+        if exists is None:
+            raise ValueError(f'Group does not exist.')
+
+        return connection
+
+    def create_group(self, tg_chat_id: int, description: str) -> Connection:
+        connection = self.connection()
+        try:
+            with transaction(connection):
+                connection.execute('INSERT INTO group_info (tg_id, description) VALUES (?, ?)',
+                                   (tg_chat_id, description))
+        except IntegrityError:
+            raise ValueError(f'Group \'{tg_chat_id}\' already exists')
+
+        return connection
+
+    def release(self, connection: Connection) -> None:
+        pass
+
+    def list_groups(self) -> list[int]:
+        return [row[0] for row in self.connection().execute('SELECT tg_id FROM group_info ORDER BY tg_id')]
+
+    def open_polls(self) -> Connection:
+        connection = connect(self.db_path, self.profile, check_same_thread=False)
+        with self._lock:
+            self._connections.append(connection)
+
+        return connection
+
+    def close(self) -> None:
+        with self._lock:
+            connections, self._connections = self._connections, []
+
+        for connection in connections:
+            connection.close()
+
+    def connection(self) -> Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = connect(self.db_path, self.profile, check_same_thread=False)
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+
+        return connection
@@ -0,0 +1,253 @@
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import tarfile
+import tempfile
+import time
+from logging import info, warning
+from os import path
+
+from tasks import cancel_task
+
+MANIFEST = 'manifest.json'
+MIRROR = 'current'
+SNAPSHOT_PREFIX = 'snapshot-'
+SNAPSHOT_SUFFIX = '.tar.gz'
+
+
+def copy_database(
+        source_path: str,
+        target_path: str,
+        pages: int = 64,
+        pause: float = 0.005,
+        max_restarts: int = 5,
+) -> None:
+    restarts = 0
+    remaining_before = None
+
+    def progress(_: int, remaining: int, __: int) -> None:
+        nonlocal restarts, remaining_before
+        if remaining_before is not None and remaining > remaining_before:
+            restarts += 1
+            if restarts > max_restarts:
+                raise _TooManyRestarts()
+        remaining_before = remaining
+        time.sleep(pause)
+
+    tmp_path = f'{target_path}.tmp'
+    source = sqlite3.connect(f'file:{source_path}?mode=ro', uri=True)
+    try:
+        target = sqlite3.connect(tmp_path)
+        try:
+            try:
+                source.backup(target, pages=pages, progress=progress)
+            except _TooManyRestarts:
+                source.backup(target)
+
+            if target.execute('PRAGMA quick_check').fetchone()[0] != 'ok':
+                raise sqlite3.DatabaseError(f'Backup of {source_path} failed its integrity check')
+        finally:
+            target.close()
+    except BaseException:
+        if path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    finally:
+        source.close()
+
+    os.replace(tmp_path, target_path)
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+class Backup:
+    def __init__(
+            self,
+            data_path: str,
+            backup_path: str,
+            pages: int = 64,
+            pause: float = 0.005,
+            keep: int = 24,
+    ):
+        self.data_path = data_path
+        self.backup_path = backup_path
+        self.pages = pages
+        self.pause = pause
+        self.keep = keep
+
+    def run(self) -> tuple[str, int, int]:
+        mirror = path.join(self.backup_path, MIRROR)
+        os.makedirs(mirror, exist_ok=True)
+
+        manifest = self._load_manifest()
+        databases = {name: _signature(path.join(self.data_path, name)) for name in self._databases()}
+
+        copied = 0
+        for name, signature in databases.items():
+            if manifest.get(name) == signature and path.exists(path.join(mirror, name)):
+                continue
+
+            copy_database(path.join(self.data_path, name), path.join(mirror, name), self.pages, self.pause)
+            manifest[name] = signature
+            copied += 1
+
+        for name in set(manifest) - set(databases):
+            del manifest[name]
+            if path.exists(path.join(mirror, name)):
+                os.remove(path.join(mirror, name))
+
+        self._save_manifest(manifest)
+        snapshot = self._snapshot(mirror, sorted(databases))
+        self._prune()
+
+        return snapshot, copied, len(databases) - copied
+
+    def _databases(self) -> list[str]:
+        return sorted(name for name in os.listdir(self.data_path) if name.endswith('.db'))
+
+    def _snapshot(self, mirror: str, names: list[str]) -> str:
+        snapshot = path.join(self.backup_path, f'{SNAPSHOT_PREFIX}{time.strftime("%Y%m%dT%H%M%S")}{SNAPSHOT_SUFFIX}')
+        tmp_path = f'{snapshot}.tmp'
+        with tarfile.open(tmp_path, 'w:gz') as archive:
+            for name in names:
+                archive.add(path.join(mirror, name), arcname=name)
+        os.replace(tmp_path, snapshot)
+
+        return snapshot
+
+    def _prune(self) -> None:
+        snapshots = snapshots_in(self.backup_path)
+        for snapshot in snapshots[:max(0, len(snapshots) - self.keep)]:
+            os.remove(snapshot)
+
+    def _load_manifest(self) -> dict[str, list[int]]:
+        try:
+            with open(path.join(self.backup_path, MANIFEST), encoding='utf-8') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+
+    def _save_manifest(self, manifest: dict[str, list[int]]) -> None:
+        manifest_path = path.join(self.backup_path, MANIFEST)
+        with open(f'{manifest_path}.tmp', 'w', encoding='utf-8') as file:
+            json.dump(manifest, file)
+        os.replace(f'{manifest_path}.tmp', manifest_path)
+
+
+def _signature(db_path: str) -> list[int]:
+    signature = []
+    for file_path in (db_path, f'{db_path}-wal'):
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            signature += [0, 0]
+        else:
+            signature += [stat.st_mtime_ns, stat.st_size]
+
+    return signature
+
+
+def snapshots_in(backup_path: str) -> list[str]:
+    return sorted(
+        path.join(backup_path, name) for name in os.listdir(backup_path)
+        if name.startswith(SNAPSHOT_PREFIX) and name.endswith(SNAPSHOT_SUFFIX)
+    )
+
+
+def restore(snapshot: str, data_path: str, force: bool = False) -> list[str]:
+    os.makedirs(data_path, exist_ok=True)
+    if not force and any(name.endswith('.db') for name in os.listdir(data_path)):
+        raise ValueError(f'{data_path} already holds databases, pass force to overwrite them')
+
+    with tempfile.TemporaryDirectory(dir=data_path) as staging:
+        with tarfile.open(snapshot, 'r:gz') as archive:
+            members = [m for m in archive.getmembers() if m.isfile() and m.name.endswith('.db')]
+            for member in members:
+                if path.basename(member.name) != member.name:
+                    raise ValueError(f'Unexpected entry {member.name} in {snapshot}')
+            archive.extractall(staging, members)
+
+        names = sorted(member.name for member in members)
+        for name in names:
+            connection = sqlite3.connect(path.join(staging, name))
+            try:
+                if connection.execute('PRAGMA quick_check').fetchone()[0] != 'ok':
+                    raise sqlite3.DatabaseError(f'{name} in {snapshot} failed its integrity check')
+            finally:
+                connection.close()
+
+        for name in names:
+            for suffix in ('-wal', '-shm'):
+                if path.exists(path.join(data_path, name + suffix)):
+                    os.remove(path.join(data_path, name + suffix))
+            os.replace(path.join(staging, name), path.join(data_path, name))
+
+    return names
+
+
+class PeriodicBackup:
+    def __init__(self, backup: Backup, interval: float = 3600):
+        self.backup = backup
+        self.interval = interval
+
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        await cancel_task(self._task)
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                snapshot, copied, unchanged = await asyncio.to_thread(self.backup.run)
+            except (OSError, sqlite3.Error) as e:
+                warning(f'Backup failed: {e}')
+            else:
+                info(f'Backup {snapshot}: {copied} databases copied, {unchanged} unchanged')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Back up or restore the bot databases.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    backup_parser = commands.add_parser('backup', help='copy changed databases and write a snapshot')
+    backup_parser.add_argument('data_path')
+    backup_parser.add_argument('backup_path')
+    backup_parser.add_argument('--pages', type=int, default=64, help='pages copied per backup step')
+    backup_parser.add_argument('--pause', type=float, default=0.005, help='seconds to yield between steps')
+    backup_parser.add_argument('--keep', type=int, default=24, help='number of snapshots to keep')
+
+    restore_parser = commands.add_parser('restore', help='rebuild data_path from a snapshot, with the bot stopped')
+    restore_parser.add_argument('snapshot', help='snapshot file, or a backup directory to use its latest snapshot')
+    restore_parser.add_argument('data_path')
+    restore_parser.add_argument('--force', action='store_true', help='overwrite existing databases')
+
+    args = parser.parse_args()
+
+    if args.command == 'backup':
+        os.makedirs(args.backup_path, exist_ok=True)
+        snapshot, copied, unchanged = Backup(
+            args.data_path, args.backup_path, args.pages, args.pause, args.keep).run()
+        print(f'Wrote {snapshot}: {copied} databases copied, {unchanged} unchanged')
+    else:
+        snapshot = args.snapshot
+        if path.isdir(snapshot):
+            snapshots = snapshots_in(snapshot)
+            if not snapshots:
+                parser.error(f'No snapshots in {snapshot}')
+            snapshot = snapshots[-1]
+        names = restore(snapshot, args.data_path, args.force)
+        print(f'Restored {len(names)} databases from {snapshot}')
+
+
+if __name__ == '__main__':
+    main()
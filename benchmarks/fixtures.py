@@ -0,0 +1,66 @@
+import random
+import tempfile
+from contextlib import contextmanager
+from typing import Iterator
+
+from backends import FileBackend, StorageBackend
+from group import Group
+from poll import Poll
+
+
+@contextmanager
+def use_temp_data_path(backend: type[StorageBackend] = FileBackend) -> Iterator[str]:
+    with tempfile.TemporaryDirectory(prefix='druntoken-bench-') as data_path:
+        Group.backend = Poll.backend = backend(data_path)
+        try:
+            yield data_path
+        finally:
+            Group.backend.close()
+
+
+def populate_poll(group: Group, tg_poll_id: int, bets: int, options: int = 4, seed: int = 0) -> None:
+    rng = random.Random(seed)
+    connection = group.connection
+    group_id = group.group_id
+
+    cursor = connection.execute(
+        'INSERT INTO polls (group_id, tg_poll_id, tg_message_id, text) VALUES (?, ?, ?, ?)',
+        (group_id, tg_poll_id, tg_poll_id, f'Poll {tg_poll_id}')
+    )
+    poll_id = cursor.lastrowid
+    connection.executemany(
+        'INSERT INTO poll_options (poll_id, text, tg_index, rating) VALUES (?, ?, ?, ?)',
+        [(poll_id, f'Option {i}', i, 1) for i in range(options)]
+    )
+    option_ids = [
+        row[0] for row in connection.execute(
+            'SELECT id FROM poll_options WHERE poll_id = ? ORDER BY tg_index', (poll_id,))
+    ]
+
+    amounts = [rng.randint(1, 1000) for _ in range(bets)]
+    first_tg_id = connection.execute(
+        'SELECT COALESCE(MAX(tg_id), 0) + 1 FROM members WHERE group_id = ?', (group_id,)).fetchone()[0]
+    connection.executemany(
+        'INSERT INTO members (group_id, tg_id, name, tokens) VALUES (?, ?, ?, ?)',
+        [(group_id, first_tg_id + i, f'Member {first_tg_id + i}', 10000 - amount) for i, amount in enumerate(amounts)]
+    )
+    member_ids = [
+        row[0] for row in connection.execute(
+            'SELECT id FROM members WHERE group_id = ? AND tg_id >= ? ORDER BY id', (group_id, first_tg_id))
+    ]
+    connection.executemany(
+        'INSERT INTO bets (member_id, amount, poll_id, poll_option_id) VALUES (?, ?, ?, ?)',
+        [(member_id, amount, poll_id, rng.choice(option_ids)) for member_id, amount in zip(member_ids, amounts)]
+    )
+    connection.executemany(
+        'INSERT INTO ledger (group_id, member_id, poll_id, kind, amount, created_at) VALUES (?, ?, ?, ?, ?, 0)',
+        [
+            entry
+            for member_id, amount in zip(member_ids, amounts)
+            for entry in (
+                (group_id, member_id, None, 'grant', 10000),
+                (group_id, member_id, poll_id, 'reserve', -amount),
+            )
+        ]
+    )
+    connection.commit()
@@ -0,0 +1,65 @@
+import random
+import time
+
+from benchmarks.fixtures import populate_poll, use_temp_data_path
+from group import Group
+
+POLLS = 100
+BETS_PER_POLL = 1000
+LOOKUPS = 2000
+
+QUERIES = {
+    'members.tg_id': 'SELECT * FROM members WHERE group_id = 0 AND tg_id = ?',
+    'polls.tg_message_id': 'SELECT id FROM polls WHERE group_id = 0 AND tg_message_id = ?',
+    'polls.tg_poll_id': 'SELECT id FROM polls WHERE group_id = 0 AND tg_poll_id = ?',
+    'bets(member_id, poll_id)': 'SELECT id FROM bets WHERE member_id = ? AND poll_id = ?',
+    'poll_options(poll_id, tg_index)': 'SELECT id FROM poll_options WHERE poll_id = ? AND tg_index = ?',
+}
+
+
+def measure(connection, rng: random.Random) -> dict[str, float]:
+    members = connection.execute('SELECT MAX(tg_id) FROM members').fetchone()[0]
+    params = {
+        'members.tg_id': lambda: (rng.randint(1, members),),
+        'polls.tg_message_id': lambda: (rng.randint(1, POLLS),),
+        'polls.tg_poll_id': lambda: (rng.randint(1, POLLS),),
+        'bets(member_id, poll_id)': lambda: (rng.randint(1, members), rng.randint(1, POLLS)),
+        'poll_options(poll_id, tg_index)': lambda: (rng.randint(1, POLLS), rng.randint(0, 3)),
+    }
+
+    results = {}
+    for name, query in QUERIES.items():
+        args = [params[name]() for _ in range(LOOKUPS)]
+        start = time.perf_counter()
+        for arg in args:
+            connection.execute(query, arg).fetchone()
+        results[name] = (time.perf_counter() - start) / LOOKUPS
+
+    return results
+
+
+def main() -> None:
+    with use_temp_data_path():
+        group = Group.create_group(1, '')
+        connection = group.connection
+        for tg_poll_id in range(1, POLLS + 1):
+            populate_poll(group, tg_poll_id, BETS_PER_POLL, seed=tg_poll_id)
+
+        after = measure(connection, random.Random(0))
+
+        indexes = connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL").fetchall()
+        for name, in indexes:
+            connection.execute(f'DROP INDEX {name}')
+        before = measure(connection, random.Random(0))
+
+        print(f'Average lookup cost on a {POLLS * BETS_PER_POLL}-bet database, without and with migrated indexes')
+        for name in QUERIES:
+            print(f'{name:>32}: before={before[name] * 1e6:9.1f}us after={after[name] * 1e6:7.1f}us '
+                  f'({before[name] / after[name]:.0f}x)')
+
+        group.close()
+
+
+if __name__ == '__main__':
+    main()
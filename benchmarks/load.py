@@ -0,0 +1,269 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+from logging import error
+from types import SimpleNamespace
+
+TEMP_DATA_PATH = None if 'DATA_PATH' in os.environ else tempfile.mkdtemp(prefix='druntoken-load-')
+if TEMP_DATA_PATH is not None:
+    os.environ['DATA_PATH'] = TEMP_DATA_PATH
+os.environ.setdefault('BOT_TOKEN', '0:load')
+os.environ.setdefault('OPENAI_API_KEY', 'load')
+
+from telegram import Message, Update  # noqa: E402
+from telegram.ext import Application, CallbackContext  # noqa: E402
+from telegram.request import BaseRequest, RequestData  # noqa: E402
+
+import main as bot  # noqa: E402
+from group import Group  # noqa: E402
+
+
+class StubCompletions:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+
+    async def create(self, messages: list[dict], stream: bool = False, **_):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if stream:
+            return StubStream(['Risposta ', 'generata'])
+
+        content = json.dumps({
+            'text': 'Sondaggio di carico',
+            'options': [{'text': f'Opzione {i}', 'rating': 1} for i in range(4)],
+        }) if 'sondaggio per un gruppo' in messages[0]['content'] else 'Risposta generata'
+
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=SimpleNamespace(prompt_tokens=0, completion_tokens=0, total_tokens=0),
+        )
+
+
+class StubStream:
+    def __init__(self, contents: list[str]):
+        self.chunks = [
+            SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))], usage=None)
+            for content in contents
+        ]
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield chunk
+
+    async def close(self) -> None:
+        pass
+
+
+class StubOpenAI:
+    def __init__(self, latency: float):
+        self.chat = SimpleNamespace(completions=StubCompletions(latency))
+
+    async def close(self) -> None:
+        pass
+
+
+BOT_ID = 0
+
+
+class FakeTelegram(BaseRequest):
+    def __init__(self):
+        self.next_id = 1
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(self, url: str, method: str, request_data: RequestData | None = None,
+                         **_) -> tuple[int, bytes]:
+        endpoint = url.rsplit('/', 1)[-1]
+        parameters = request_data.parameters if request_data is not None else {}
+
+        if endpoint == 'getMe':
+            result = {**user(BOT_ID), 'username': 'load_bot'}
+        elif endpoint == 'sendPoll':
+            result = self.message(parameters['chat_id'], BOT_ID)
+            result['poll'] = {
+                'id': str(result['message_id']),
+                'question': parameters['question'],
+                'options': [{'text': option, 'voter_count': 0} for option in parameters['options']],
+                'total_voter_count': 0,
+                'is_closed': False,
+                'is_anonymous': False,
+                'type': 'regular',
+                'allows_multiple_answers': False,
+            }
+        elif 'chat_id' in parameters:
+            result = self.message(parameters['chat_id'], BOT_ID, parameters.get('text'))
+        else:
+            result = True
+
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+    def message(self, tg_chat_id: int, tg_user_id: int, text: str | None = None) -> dict:
+        self.next_id += 1
+        message = {
+            'message_id': self.next_id,
+            'date': int(time.time()),
+            'chat': {'id': tg_chat_id, 'type': 'supergroup', 'title': 'Carico'},
+            'from': user(tg_user_id),
+        }
+        if text is not None:
+            message['text'] = text
+
+        return message
+
+
+def user(tg_user_id: int) -> dict:
+    return {'id': tg_user_id, 'is_bot': tg_user_id == BOT_ID, 'first_name': f'Member {tg_user_id}'}
+
+
+def command(telegram: FakeTelegram, tg_chat_id: int, tg_user_id: int, text: str,
+            reply_to: Message | None = None) -> dict:
+    message = telegram.message(tg_chat_id, tg_user_id, text)
+    message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    if reply_to is not None:
+        message['reply_to_message'] = reply_to.to_dict()
+
+    return {'message': message}
+
+
+def poll_answer(tg_poll_id: int, tg_user_id: int, tg_index: int) -> dict:
+    return {'poll_answer': {'poll_id': str(tg_poll_id), 'user': user(tg_user_id), 'option_ids': [tg_index]}}
+
+
+class Recorder:
+    def __init__(self, app: Application):
+        self.app = app
+        self.latencies: dict[str, list[float]] = {}
+        self.errors: dict[str, int] = {}
+
+        self._next_update_id = 0
+        self._handlers: dict[int, str] = {}
+        app.add_error_handler(self.failed)
+
+    async def send(self, name: str, data: dict) -> None:
+        self._next_update_id += 1
+        update = Update.de_json({'update_id': self._next_update_id, **data}, self.app.bot)
+        self._handlers[update.update_id] = name
+
+        # the same path the application's update fetcher takes, ordering and instrumentation included
+        start = time.perf_counter()
+        try:
+            await self.app.update_processor.process_update(update, self.app.process_update(update))
+        finally:
+            self.latencies.setdefault(name, []).append(time.perf_counter() - start)
+            del self._handlers[update.update_id]
+
+    async def failed(self, update: object, context: CallbackContext) -> None:
+        name = self._handlers.get(update.update_id, 'unknown') if isinstance(update, Update) else 'unknown'
+        self.errors[name] = self.errors.get(name, 0) + 1
+        if self.errors[name] == 1:
+            error(f'{name} handler failed', exc_info=context.error)
+
+    def report(self, elapsed: float) -> dict:
+        handlers = {}
+        for name, samples in sorted(self.latencies.items()):
+            quantiles = statistics.quantiles(samples, n=100) if len(samples) > 1 else samples * 99
+            handlers[name] = {
+                'count': len(samples),
+                'errors': self.errors.get(name, 0),
+                'throughput': len(samples) / elapsed,
+                'p50_ms': quantiles[49] * 1000,
+                'p95_ms': quantiles[94] * 1000,
+                'p99_ms': quantiles[98] * 1000,
+            }
+
+        return handlers
+
+
+async def drive_group(tg_chat_id: int, members: int, rounds: int, rng: random.Random,
+                      recorder: Recorder, telegram: FakeTelegram) -> None:
+    for _ in range(rounds):
+        poll = await recorder.app.bot.send_poll(tg_chat_id, 'Sondaggio', [f'Opzione {i}' for i in range(4)])
+        tg_poll_id = int(poll.poll.id)
+        await bot.storage.group(tg_chat_id).store_poll(
+            {'text': 'Sondaggio', 'options': [{'text': f'Opzione {i}', 'rating': 1} for i in range(4)]},
+            tg_poll_id, poll.id)
+        await bot.storage.polls.store(tg_poll_id, tg_chat_id)
+
+        for tg_user_id in range(1, members + 1):
+            await recorder.send('bet', command(
+                telegram, tg_chat_id, tg_user_id, f'/bet {rng.randint(1, 100)}', reply_to=poll))
+            await recorder.send('select_option', poll_answer(tg_poll_id, tg_user_id, rng.randrange(4)))
+            if rng.random() < 0.3:
+                await recorder.send('tokens', command(telegram, tg_chat_id, tg_user_id, '/tokens'))
+
+        await recorder.send('close', command(telegram, tg_chat_id, 1, f'/close {rng.randrange(4)}', reply_to=poll))
+
+
+async def run(args: argparse.Namespace) -> dict:
+    bot.configure()
+    bot.llm.client = StubOpenAI(args.llm_latency)
+
+    for i in range(args.groups):
+        group = Group.create_group(-1000 - i, '')
+        for tg_user_id in range(1, args.members + 1):
+            group.add_member(tg_user_id, f'Member {tg_user_id}')
+        group.close()
+
+    telegram = FakeTelegram()
+    app = bot.build_application(updater=False, request=telegram)
+    recorder = Recorder(app)
+    rng = random.Random(args.seed)
+
+    await app.initialize()
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        drive_group(-1000 - i, args.members, args.rounds, random.Random(rng.random()), recorder, telegram)
+        for i in range(args.groups)
+    ))
+    elapsed = time.perf_counter() - start
+
+    await bot.streams.stop()
+    await app.shutdown()
+    bot.storage.close()
+
+    return {
+        'config': vars(args),
+        'elapsed_s': elapsed,
+        'handlers': recorder.report(elapsed),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Drive the bot application with a synthetic betting workload.')
+    parser.add_argument('--groups', type=int, default=20)
+    parser.add_argument('--members', type=int, default=25)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--llm-latency', type=float, default=0.5, help='stub chat completion latency in seconds')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='bench_output.json')
+    args = parser.parse_args()
+
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        if TEMP_DATA_PATH is not None:
+            shutil.rmtree(TEMP_DATA_PATH, ignore_errors=True)
+
+    print(f'{"handler":>14} {"count":>7} {"errors":>6} {"req/s":>9} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8}')
+    for name, stats in results['handlers'].items():
+        print(f'{name:>14} {stats["count"]:>7} {stats["errors"]:>6} {stats["throughput"]:>9.1f} '
+              f'{stats["p50_ms"]:>8.2f} {stats["p95_ms"]:>8.2f} {stats["p99_ms"]:>8.2f}')
+
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(results, file, indent=2)
+    print(f'Results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
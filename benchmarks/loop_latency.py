@@ -0,0 +1,67 @@
+import asyncio
+import statistics
+import time
+
+from benchmarks.fixtures import populate_poll, use_temp_data_path
+from group import Group
+from storage import Storage
+
+BETS = 100_000
+TICK = 0.005
+
+
+async def measure_ticks(stop: asyncio.Event) -> list[float]:
+    lags = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - start - TICK)
+
+    return lags
+
+
+async def run(settle) -> list[float]:
+    stop = asyncio.Event()
+    ticker = asyncio.create_task(measure_ticks(stop))
+    await asyncio.sleep(0.05)
+    await settle()
+    await asyncio.sleep(0.05)
+    stop.set()
+
+    return await ticker
+
+
+def report(name: str, lags: list[float]) -> None:
+    lags = sorted(lags)
+    print(f'{name:>10}: ticks={len(lags):5d} '
+          f'median={statistics.median(lags) * 1000:7.2f}ms '
+          f'max={lags[-1] * 1000:8.2f}ms')
+
+
+async def main() -> None:
+    with use_temp_data_path():
+        for tg_chat_id in (1, 2):
+            group = Group.create_group(tg_chat_id, '')
+            populate_poll(group, tg_poll_id=1, bets=BETS)
+            group.close()
+
+        blocking_group = Group(tg_chat_id=1)
+
+        async def settle_blocking():
+            blocking_group.close_poll(1, 0)
+
+        storage = Storage()
+
+        async def settle_async():
+            await storage.group(2).close_poll(1, 0)
+
+        print(f'Loop lag while settling a poll with {BETS} bets')
+        report('blocking', await run(settle_blocking))
+        report('storage', await run(settle_async))
+
+        blocking_group.close()
+        storage.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,79 @@
+import random
+import time
+
+from benchmarks.fixtures import use_temp_data_path
+from errors.bet_error import BetError
+from group import Group
+
+MEMBERS = 2000
+CACHE_SIZE = 512
+POLLS = 50
+BETS_PER_POLL = 200
+LOOKUPS = 20000
+
+
+def stale_members(group: Group) -> list[tuple[int, int, int]]:
+    stored = dict(group.connection.execute('SELECT tg_id, tokens FROM members WHERE group_id = ?', (group.group_id,)))
+
+    return [
+        (tg_id, member.tokens, stored[tg_id])
+        for tg_id, member in group.members._members.items()
+        if member.tokens != stored[tg_id]
+    ]
+
+
+def settle(group: Group, rng: random.Random) -> int:
+    stale = 0
+    for tg_poll_id in range(1, POLLS + 1):
+        group.store_poll(
+            {'text': f'Poll {tg_poll_id}', 'options': [{'text': f'Option {i}', 'rating': 1} for i in range(4)]},
+            tg_poll_id, tg_poll_id
+        )
+
+        for tg_id in rng.sample(range(1, MEMBERS + 1), BETS_PER_POLL):
+            try:
+                group.place_bet(tg_id, tg_poll_id, rng.randint(1, 3000))
+            except BetError:
+                continue
+            if rng.random() < 0.9:
+                group.select_option(tg_id, tg_poll_id, rng.randrange(4))
+
+        group.close_poll(tg_poll_id, rng.randrange(4))
+        stale += len(stale_members(group))
+
+    return stale
+
+
+def measure(group: Group, rng: random.Random, refresh: bool) -> float:
+    # Skewed towards a hot set of members, like the busy regulars of a chat.
+    tg_ids = [min(int(rng.paretovariate(1.2)), MEMBERS) for _ in range(LOOKUPS)]
+
+    start = time.perf_counter()
+    for tg_id in tg_ids:
+        group._member(tg_id, refresh=refresh)
+
+    return (time.perf_counter() - start) / LOOKUPS
+
+
+def main() -> None:
+    with use_temp_data_path():
+        Group.member_cache_size = CACHE_SIZE
+        rng = random.Random(0)
+
+        group = Group.create_group(1, '')
+        for tg_id in range(1, MEMBERS + 1):
+            group.add_member(tg_id, f'Member {tg_id}')
+
+        stale = settle(group, rng)
+        stats = group.members.stats()
+        print(f'{POLLS} polls settled: {stale} stale cached balances, '
+              f'hit rate {stats["hit_rate"]:.1%}, {stats["evictions"]} evictions')
+
+        uncached = measure(group, rng, refresh=True)
+        cached = measure(group, rng, refresh=False)
+        print(f'member lookup: {uncached * 1e6:7.2f}us uncached, {cached * 1e6:7.2f}us cached')
+        group.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+import tempfile
+import time
+
+from backends import FileBackend
+from database import PRAGMA_PROFILES
+from group import Group
+
+MEMBERS = 2000
+
+
+def main() -> None:
+    print(f'Committed writes per second ({MEMBERS} joins + {MEMBERS} bets, one commit each)')
+    for name, profile in PRAGMA_PROFILES.items():
+        with tempfile.TemporaryDirectory(prefix='druntoken-bench-') as data_path:
+            Group.backend = FileBackend(data_path, profile)
+            group = Group.create_group(1, '')
+            group.store_poll(
+                {'text': 'Poll', 'options': [{'text': 'a', 'rating': 1}, {'text': 'b', 'rating': 1}]}, 1, 1
+            )
+
+            start = time.perf_counter()
+            for tg_id in range(MEMBERS):
+                group.add_member(tg_id, f'Member {tg_id}')
+            for tg_id in range(MEMBERS):
+                group.place_bet(tg_id, 1, 10)
+            elapsed = time.perf_counter() - start
+
+            print(f'{name:>8}: {2 * MEMBERS / elapsed:9.0f} writes/s')
+            group.close()
+
+
+if __name__ == '__main__':
+    main()
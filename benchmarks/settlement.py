@@ -0,0 +1,30 @@
+import time
+
+from benchmarks.fixtures import populate_poll, use_temp_data_path
+from group import Group
+
+SIZES = (10, 1_000, 100_000)
+
+
+def main() -> None:
+    with use_temp_data_path():
+        print('close_poll settlement time')
+        for tg_chat_id, bets in enumerate(SIZES, start=1):
+            group = Group.create_group(tg_chat_id, '')
+            populate_poll(group, tg_poll_id=1, bets=bets)
+            tokens_before = group.connection.execute(
+                'SELECT (SELECT SUM(tokens) FROM members) + (SELECT SUM(amount) FROM bets WHERE open = 1)'
+            ).fetchone()[0]
+
+            start = time.perf_counter()
+            results, _ = group.close_poll(1, 0)
+            elapsed = time.perf_counter() - start
+
+            tokens_after = group.connection.execute('SELECT SUM(tokens) FROM members').fetchone()[0]
+            print(f'{bets:>7} bets: {elapsed * 1000:9.2f}ms '
+                  f'({len(results)} results, token delta {tokens_after - tokens_before})')
+            group.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+import argparse
+import asyncio
+import os
+import time
+from logging import info, warning
+from sqlite3 import Error
+from typing import Awaitable, Callable
+
+from database import connect, enable_incremental_vacuum
+from group import Group
+from metrics import metrics
+from storage import Storage
+from tasks import cancel_task
+
+
+def parse_quiet_hours(hours: str) -> tuple[int, int] | None:
+    if hours.strip() == '':
+        return None
+
+    start, _, end = hours.partition('-')
+    quiet = int(start), int(end)
+    if not all(0 <= hour < 24 for hour in quiet):
+        raise ValueError(f'Invalid quiet hours \'{hours}\'')
+
+    return quiet
+
+
+class Compactor:
+    def __init__(
+            self,
+            storage: Storage,
+            list_groups: Callable[[], Awaitable[list[int]]],
+            max_age: float = 30 * 86400,
+            interval: float = 3600,
+            batch_size: int = 50,
+            pause: float = 0.2,
+            quiet_hours: tuple[int, int] | None = (3, 6),
+            vacuum_pages: int = 256,
+    ):
+        self.storage = storage
+        self.list_groups = list_groups
+        self.max_age = max_age
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+        self.quiet_hours = quiet_hours
+        self.vacuum_pages = vacuum_pages
+
+        self.archived = 0
+        self.pruned = 0
+        self.vacuumed = 0
+
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        await cancel_task(self._task)
+        self._task = None
+
+    def is_quiet(self, now: float | None = None) -> bool:
+        if self.quiet_hours is None:
+            return True
+
+        hour = time.localtime(now).tm_hour
+        start, end = self.quiet_hours
+        if start <= end:
+            return start <= hour < end
+
+        return hour >= start or hour < end
+
+    async def run_once(self) -> None:
+        closed_before = int(time.time() - self.max_age)
+        vacuum = self.is_quiet()
+
+        for tg_chat_id in await self.list_groups():
+            try:
+                await self._archive(tg_chat_id, closed_before)
+                if vacuum and self.is_quiet():
+                    await self._vacuum(lambda: self.storage.run_group(tg_chat_id, Group.vacuum, self.vacuum_pages))
+            except (Error, ValueError) as e:
+                warning(f'Could not compact group {tg_chat_id}: {e}')
+
+        if vacuum and self.is_quiet():
+            await self._vacuum(lambda: self.storage.polls.vacuum(self.vacuum_pages))
+
+    async def _archive(self, tg_chat_id: int, closed_before: int) -> None:
+        while True:
+            tg_poll_ids = await self.storage.run_group(
+                tg_chat_id, Group.archive_polls, closed_before, self.batch_size)
+            if len(tg_poll_ids) == 0:
+                return
+
+            pruned = await self.storage.polls.prune(tg_poll_ids)
+            self.archived += len(tg_poll_ids)
+            self.pruned += pruned
+            metrics.inc('compaction_archived_polls_total', len(tg_poll_ids))
+            metrics.inc('compaction_pruned_routes_total', pruned)
+
+            await asyncio.sleep(self.pause)
+            if len(tg_poll_ids) < self.batch_size:
+                return
+
+    async def _vacuum(self, step: Callable[[], Awaitable[int]]) -> None:
+        while self.is_quiet():
+            pages = await step()
+            self.vacuumed += pages
+            metrics.inc('compaction_vacuumed_pages_total', pages)
+
+            await asyncio.sleep(self.pause)
+            if pages < self.vacuum_pages:
+                return
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+
+            start = time.monotonic()
+            archived, pruned, vacuumed = self.archived, self.pruned, self.vacuumed
+            await self.run_once()
+            info(f'Compaction archived {self.archived - archived} polls, pruned {self.pruned - pruned} routes '
+                 f'and reclaimed {self.vacuumed - vacuumed} pages in {time.monotonic() - start:.1f}s')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Switch the bot databases to incremental auto-vacuum, with the bot stopped.')
+    parser.add_argument('data_path')
+    args = parser.parse_args()
+
+    for name in sorted(os.listdir(args.data_path)):
+        if not name.endswith('.db'):
+            continue
+
+        connection = connect(os.path.join(args.data_path, name))
+        try:
+            start = time.monotonic()
+            if enable_incremental_vacuum(connection):
+                print(f'{name}: switched in {time.monotonic() - start:.1f}s')
+            else:
+                print(f'{name}: already incremental, skipping')
+        finally:
+            connection.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+import sqlite3
+from contextlib import contextmanager
+from sqlite3 import Connection
+from typing import Iterator
+
+from metrics import InstrumentedConnection
+
+PragmaProfile = dict[str, str | int]
+
+PRAGMA_PROFILES: dict[str, PragmaProfile] = {
+    'default': {},
+    'wal': {
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'busy_timeout': 5000,
+    },
+    'fast': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'cache_size': -16000,
+        'mmap_size': 268435456,
+        'temp_store': 'MEMORY',
+    },
+}
+
+
+def connect(db_path: str, profile: PragmaProfile | None = None, check_same_thread: bool = True) -> Connection:
+    connection = sqlite3.connect(db_path, check_same_thread=check_same_thread, factory=InstrumentedConnection)
+    connection.execute('PRAGMA auto_vacuum = INCREMENTAL')
+
+    for name, value in (profile or {}).items():
+        connection.execute(f'PRAGMA {name} = {value}')
+
+    return connection
+
+
+def pragma_profile(name: str, overrides: str = '') -> PragmaProfile:
+    if name not in PRAGMA_PROFILES:
+        raise ValueError(f'Unknown pragma profile \'{name}\'')
+
+    profile = dict(PRAGMA_PROFILES[name])
+    for override in filter(None, (o.strip() for o in overrides.split(','))):
+        pragma, _, value = override.partition('=')
+        if not pragma.strip().isidentifier() or not value.strip():
+            raise ValueError(f'Invalid pragma override \'{override}\'')
+        profile[pragma.strip()] = value.strip()
+
+    return profile
+
+
+def uses_wal(profile: PragmaProfile) -> bool:
+    return str(profile.get('journal_mode', '')).upper() == 'WAL'
+
+
+def checkpoint(connection: Connection, mode: str = 'PASSIVE') -> tuple[int, int, int]:
+    return connection.execute(f'PRAGMA wal_checkpoint({mode})').fetchone()
+
+
+def incremental_vacuum(connection: Connection, pages: int) -> int:
+    if connection.in_transaction:
+        connection.commit()
+
+    if connection.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        return 0
+
+    free = connection.execute('PRAGMA freelist_count').fetchone()[0]
+    connection.execute(f'PRAGMA incremental_vacuum({int(pages)})').fetchall()
+
+    return min(free, pages)
+
+
+def enable_incremental_vacuum(connection: Connection) -> bool:
+    if connection.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+        return False
+
+    connection.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    connection.execute('VACUUM')
+
+    return True
+
+
+@contextmanager
+def transaction(connection: Connection, mode: str = 'IMMEDIATE') -> Iterator[Connection]:
+    if connection.in_transaction:
+        connection.commit()
+
+    connection.execute(f'BEGIN {mode}')
+    try:
+        yield connection
+    except BaseException:
+        connection.rollback()
+        raise
+    else:
+        connection.commit()
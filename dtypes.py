@@ -12,3 +12,13 @@ class BetResult(TypedDict):
     member_name: str
     win: int
     tokens: int
+
+
+class MemberStats(TypedDict):
+    member_name: str
+    played: int
+    won: int
+    lost: int
+    net: int
+    biggest_win: int
+    streak: int
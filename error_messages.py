@@ -0,0 +1,147 @@
+import asyncio
+import time
+from collections import deque
+from logging import warning
+from typing import Awaitable, Callable
+
+from errors.bet_error import BetError
+from tasks import cancel_task, wait_event
+
+NON_NUMERIC = 'non_numeric'
+NON_POSITIVE = 'non_positive'
+EARLY_ANSWER = 'early_answer'
+
+ERROR_KINDS: dict[str, tuple[str, str]] = {
+    NON_NUMERIC: (
+        'Inserendo un valore non numerico',
+        'Quello non è un numero. Riprova con una quantità valida.',
+    ),
+    NON_POSITIVE: (
+        'Inserendo un minore o uguale a zero',
+        'La scommessa deve essere maggiore di zero.',
+    ),
+    EARLY_ANSWER: (
+        'Non piazzando una scommessa prima di selezionare l\'opzione, per l\'ennesima volta',
+        'Prima piazza una scommessa con /bet, poi seleziona l\'opzione.',
+    ),
+    BetError.NOT_MEMBER: (
+        'Please join to place a bet',
+        'Non sei ancora un membro del gruppo.',
+    ),
+    BetError.NO_SUCH_POLL: (
+        'No such poll',
+        'Questo sondaggio non esiste.',
+    ),
+    BetError.INSUFFICIENT_TOKENS: (
+        'Insufficient tokens',
+        'Non hai abbastanza token per questa scommessa.',
+    ),
+    BetError.DUPLICATE_BET: (
+        'You already placed a bet for this poll!',
+        'Hai già scommesso su questo sondaggio.',
+    ),
+    BetError.INVALID_OPTION: (
+        'Invalid poll or option. Make sure you placed your bet.',
+        'Sondaggio o opzione non validi.',
+    ),
+    BetError.NO_OPEN_BET: (
+        'You have no bets open for this poll!',
+        'Non hai scommesse aperte su questo sondaggio.',
+    ),
+    BetError.POLL_CLOSED: (
+        'Scommettendo su un sondaggio già scaduto',
+        'Questo sondaggio è già chiuso.',
+    ),
+    BetError.GENERIC: (
+        'Facendo qualcosa di non previsto',
+        'Qualcosa è andato storto.',
+    ),
+}
+
+
+class ErrorMessagePool:
+    def __init__(
+            self,
+            generate: Callable[[str], Awaitable[str]],
+            size: int = 5,
+            ttl: float = 3600,
+            max_uses: int = 3,
+            refill_interval: float = 60,
+    ):
+        self.generate = generate
+        self.size = size
+        self.ttl = ttl
+        self.max_uses = max_uses
+        self.refill_interval = refill_interval
+
+        self.hits = 0
+        self.fallbacks = 0
+
+        self._pools: dict[str, deque[list]] = {kind: deque() for kind in ERROR_KINDS}
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def get(self, kind: str) -> str:
+        if kind not in ERROR_KINDS:
+            kind = BetError.GENERIC
+
+        pool = self._pools[kind]
+        self._expire(pool)
+
+        if not pool:
+            self.fallbacks += 1
+            self._wakeup.set()
+            return ERROR_KINDS[kind][1]
+
+        self.hits += 1
+        entry = pool.popleft()
+        entry[2] += 1
+        if entry[2] < self.max_uses:
+            pool.append(entry)
+        if len(pool) < self.size:
+            self._wakeup.set()
+
+        return entry[0]
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        await cancel_task(self._task)
+        self._task = None
+
+    async def refill(self) -> int:
+        missing = []
+        for kind, pool in self._pools.items():
+            self._expire(pool)
+            missing += [kind] * (self.size - len(pool))
+
+        replies = await asyncio.gather(*(self._generate(kind) for kind in missing))
+
+        for kind, reply in zip(missing, replies):
+            if reply:
+                self._pools[kind].append([reply, time.monotonic(), 0])
+
+        return replies.count(None)
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            if await self.refill() > 0:
+                await asyncio.sleep(self.refill_interval)
+                continue
+            await wait_event(self._wakeup, self.refill_interval)
+
+    async def _generate(self, kind: str) -> str | None:
+        try:
+            return await self.generate(ERROR_KINDS[kind][0])
+        except Exception as e:
+            warning(f'Could not generate error message for \'{kind}\': {e}')
+            return None
+
+    def _expire(self, pool: deque[list]) -> None:
+        now = time.monotonic()
+        for entry in list(pool):
+            if now - entry[1] >= self.ttl:
+                pool.remove(entry)
@@ -1,2 +1,13 @@
 class BetError(Exception):
-    pass
+    NOT_MEMBER = 'not_member'
+    NO_SUCH_POLL = 'no_such_poll'
+    INSUFFICIENT_TOKENS = 'insufficient_tokens'
+    DUPLICATE_BET = 'duplicate_bet'
+    INVALID_OPTION = 'invalid_option'
+    NO_OPEN_BET = 'no_open_bet'
+    POLL_CLOSED = 'poll_closed'
+    GENERIC = 'generic'
+
+    def __init__(self, message, kind: str = GENERIC):
+        super().__init__(message)
+        self.kind = kind
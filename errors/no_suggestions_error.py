@@ -0,0 +1,2 @@
+class NoSuggestionsError(Exception):
+    pass
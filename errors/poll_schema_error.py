@@ -0,0 +1,11 @@
+class PollSchemaError(Exception):
+    NOT_JSON = 'not_json'
+    NOT_OBJECT = 'not_object'
+    MISSING_TEXT = 'missing_text'
+    MISSING_OPTIONS = 'missing_options'
+    TOO_FEW_OPTIONS = 'too_few_options'
+    INVALID_RATING = 'invalid_rating'
+
+    def __init__(self, message, kind: str):
+        super().__init__(message)
+        self.kind = kind
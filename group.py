@@ -1,172 +1,233 @@
-import math
-import os
-from os import path
-from sqlite3 import Connection, connect
+import time
+from random import randrange
+from sqlite3 import Connection, DatabaseError, IntegrityError
+from typing import TYPE_CHECKING, Collection
 
+from database import incremental_vacuum, transaction
 from errors.bet_error import BetError
-from dtypes import GroupInfo, BetResult
+from member_cache import CachedMember, MemberCache
+from dtypes import GroupInfo, BetResult, MemberStats
+from migrations import GROUP_MIGRATIONS, migrate
+from settlement import split_pot
+from suggestions import normalize
+
+if TYPE_CHECKING:
+    from backends import StorageBackend
+
+GRANT = 'grant'
+RESERVE = 'reserve'
+PAYOUT = 'payout'
+REFUND = 'refund'
 
 
 class Group:
-    data_path: str
+    backend: 'StorageBackend'
+    member_cache_size: int = 1024
 
     def __init__(
             self,
-            tg_chat_id: int | None = None,
+            tg_chat_id: int,
             connection: Connection | None = None,
     ):
 
         if connection is None:
-            if tg_chat_id is None:
-                raise ValueError('You must provide either a database connection or a chat id')
-            db_path = path.abspath(path.join(Group.data_path, f'{tg_chat_id}.db'))
-            if not os.access(db_path, os.R_OK):
-                raise ValueError(f'Group does not exist.')
-            connection = connect(db_path)
+            connection = Group.backend.open_group(tg_chat_id)
 
-        group_info = connection.execute('SELECT id, tg_id, description FROM group_info').fetchone()
+        migrate(connection, GROUP_MIGRATIONS)
+
+        group_info = connection.execute(
+            'SELECT id, tg_id, description FROM group_info WHERE tg_id = ?',
+            (tg_chat_id,)
+        ).fetchone()
+
+        if group_info is None:
+            raise ValueError(f'Group does not exist.')
 
         self.connection = connection
+        self.group_id: int = group_info[0]
         self.group_info: GroupInfo = {
             'group_id': group_info[0],
             'tg_chat_id': group_info[1],
             'description': group_info[2],
         }
+        self.members = MemberCache(Group.member_cache_size)
 
     @staticmethod
     def create_group(chat_id: int, description: str) -> 'Group':
-        db_path = path.join(Group.data_path, f'{chat_id}.db')
-
-        if path.exists(db_path):
-            raise ValueError(f'Path \'{db_path}\' already exists')
-
-        connection = connect(db_path)
-        Group._init_database(connection, chat_id, description)
+        return Group(chat_id, Group.backend.create_group(chat_id, description))
 
-        return Group(connection=connection)
+    def close(self) -> None:
+        Group.backend.release(self.connection)
 
     def add_member(self, tg_id: int, name: str, tokens: int = 10000) -> bool:
-        if self.has_member(tg_id):
+        if self.members.get(tg_id) is not None:
             return False
 
-        self.connection.execute(
-            'INSERT INTO members (tg_id, name, tokens) VALUES (?, ?, ?)',
-            (tg_id, name, tokens))
-        self.connection.commit()
+        with transaction(self.connection):
+            cursor = self.connection.execute(
+                'INSERT OR IGNORE INTO members (group_id, tg_id, name, tokens) VALUES (?, ?, ?, ?)',
+                (self.group_id, tg_id, name, tokens))
+            if cursor.rowcount == 1:
+                self._append_ledger([(cursor.lastrowid, None, GRANT, tokens)])
+
+        if cursor.rowcount == 1:
+            self.members.put(tg_id, CachedMember(cursor.lastrowid, name, tokens))
 
-        return True
+        return cursor.rowcount == 1
 
     def all_in(self, tg_user_id: int) -> int:
         return self.get_tokens(tg_user_id)
 
     def get_tokens(self, tg_id: int) -> int | None:
-        member = self.connection.execute(
-            'SELECT tokens FROM members WHERE tg_id = ?',
-            (tg_id,)
-        ).fetchone()
+        member = self._member(tg_id)
 
         if member is None:
             return None
 
-        return int(member[0])
+        return member.tokens
 
-    def suggest(self, suggestion: str) -> None:
-        self.connection.execute("INSERT INTO suggestions (text) VALUES (?)", (suggestion,))
+    def suggest(self, suggestion: str) -> bool:
+        cursor = self.connection.execute(
+            "INSERT OR IGNORE INTO suggestions (group_id, text, normalized) VALUES (?, ?, ?)",
+            (self.group_id, suggestion, normalize(suggestion))
+        )
         self.connection.commit()
 
+        return cursor.rowcount == 1
+
     def get_suggestions(self) -> list[str]:
-        suggestions = self.connection.execute('SELECT text FROM suggestions').fetchall()
+        suggestions = self.connection.execute(
+            'SELECT text FROM suggestions WHERE group_id = ?', (self.group_id,)).fetchall()
         return [s[0] for s in suggestions]
 
-    def has_member(self, tg_id: int) -> bool:
-        return (self.connection
-                .execute('SELECT * FROM members WHERE tg_id = ?', (tg_id,))
-                .fetchone() is not None)
-
-    def place_bet(self, member_tg_id: int, tg_message_id: int, amount: int) -> int:
-        member = self.connection.execute(
-            'SELECT id, tokens FROM members WHERE tg_id = ?',
-            (member_tg_id,)
+    def sample_suggestion(self, exclude: Collection[int] = ()) -> tuple[int, str] | None:
+        # uniform within the least used tier, skipping suggestions already waiting in a prefetch queue
+        candidates = f'FROM suggestions WHERE group_id = ? AND id NOT IN ({", ".join("?" * len(exclude))})'
+        least_used = self.connection.execute(
+            f'SELECT uses, COUNT(*) {candidates} GROUP BY uses ORDER BY uses LIMIT 1',
+            (self.group_id, *exclude)
         ).fetchone()
 
-        if member is None:
-            raise BetError('Please join to place a bet')
+        if least_used is None:
+            return self.sample_suggestion() if exclude else None
 
-        poll = self.connection.execute(
-            'SELECT id FROM polls WHERE tg_message_id = ?',
-            (tg_message_id,)
+        uses, count = least_used
+        return self.connection.execute(
+            f'SELECT id, text {candidates} AND uses = ? ORDER BY id LIMIT 1 OFFSET ?',
+            (self.group_id, *exclude, uses, randrange(count))
         ).fetchone()
 
-        if poll is None:
-            raise BetError('No such poll')
+    def use_suggestion(self, suggestion_id: int) -> None:
+        self.connection.execute(
+            'UPDATE suggestions SET uses = uses + 1, last_used_at = ? WHERE id = ? AND group_id = ?',
+            (int(time.time()), suggestion_id, self.group_id)
+        )
+        self.connection.commit()
 
-        poll_id, = poll
+    def has_member(self, tg_id: int) -> bool:
+        return self._member(tg_id) is not None
 
-        tokens = int(member[1])
-        if tokens < amount:
-            raise BetError(f'Insufficient tokens ({tokens})')
+    def place_bet(self, member_tg_id: int, tg_message_id: int, amount: int) -> int:
+        try:
+            with transaction(self.connection):
+                member = self._member(member_tg_id)
+
+                if member is None:
+                    raise BetError('Please join to place a bet', BetError.NOT_MEMBER)
+
+                poll = self.connection.execute(
+                    'SELECT id, stopped_at, closed_at FROM polls WHERE group_id = ? AND tg_message_id = ?',
+                    (self.group_id, tg_message_id)
+                ).fetchone()
+
+                if poll is None:
+                    raise BetError('No such poll', BetError.NO_SUCH_POLL)
+
+                poll_id, stopped_at, closed_at = poll
+                if stopped_at is not None or closed_at is not None:
+                    raise BetError('This poll is closed', BetError.POLL_CLOSED)
+
+                if member.tokens < amount:
+                    member = self._member(member_tg_id, refresh=True)
+                    if member.tokens < amount:
+                        raise BetError(f'Insufficient tokens ({member.tokens})', BetError.INSUFFICIENT_TOKENS)
+
+                self.connection.execute(
+                    'INSERT INTO bets (member_id, amount, poll_id) VALUES (?, ?, ?)',
+                    (member.member_id, amount, poll_id)
+                )
+                cursor = self.connection.execute(
+                    'UPDATE members SET tokens = tokens - ? WHERE id = ? AND tokens >= ?',
+                    (amount, member.member_id, amount)
+                )
+                if cursor.rowcount == 0:
+                    member = self._member(member_tg_id, refresh=True)
+                    raise BetError(f'Insufficient tokens ({member.tokens})', BetError.INSUFFICIENT_TOKENS)
+
+                self._append_ledger([(member.member_id, poll_id, RESERVE, -amount)])
+        except IntegrityError:
+            raise BetError('You already placed a bet for this poll!', BetError.DUPLICATE_BET)
+        except DatabaseError as e:
+            raise BetError(e)
 
-        cursor = self.connection.cursor()
-        bet = cursor.execute(
-            'SELECT id FROM bets WHERE member_id = ? AND poll_id = ?',
-            (member[0], poll_id)
-        ).fetchone()
-        if bet is not None:
-            raise BetError('You already placed a bet for this poll!')
+        self.members.adjust(member.member_id, -amount)
+
+        return member.tokens - amount
 
+    def select_option(self, member_tg_id: int, tg_poll_id: int, tg_index: int):
         try:
-            self.connection.execute(
-                'INSERT INTO bets (member_id, amount, poll_id) VALUES (?, ?, ?)',
-                (member[0], amount, poll_id)
-            )
-            new_member_tokens = tokens - amount
-        except Exception as e:
+            self._select_option(member_tg_id, tg_poll_id, tg_index)
+        except BetError:
             self.connection.rollback()
-            raise BetError(e)
-        else:
-            self.connection.commit()
+            raise
 
-        return new_member_tokens
+        self.connection.commit()
 
-    def select_option(self, member_tg_id: int, tg_poll_id: int, tg_index: int):
+    def select_options(self, selections: list[tuple[int, int, int]]) -> list[tuple[tuple[int, int, int], BetError]]:
+        failures = []
+
+        with transaction(self.connection):
+            for selection in selections:
+                try:
+                    self._select_option(*selection)
+                except BetError as e:
+                    failures.append((selection, e))
+
+        return failures
+
+    def _select_option(self, member_tg_id: int, tg_poll_id: int, tg_index: int) -> None:
         option = self.connection.execute(
             'SELECT poll_options.id, poll_options.tg_index, polls.id, polls.tg_poll_id as tg_poll_id '
             'FROM poll_options '
             'JOIN polls ON poll_options.poll_id = polls.id '
-            'WHERE tg_poll_id = ? AND poll_options.tg_index = ?',
-            (tg_poll_id, tg_index)
+            'WHERE polls.group_id = ? AND tg_poll_id = ? AND poll_options.tg_index = ?',
+            (self.group_id, tg_poll_id, tg_index)
         ).fetchone()
 
         if option is None:
-            raise BetError('Invalid poll or option. Make sure you placed your bet.')
+            raise BetError('Invalid poll or option. Make sure you placed your bet.', BetError.INVALID_OPTION)
 
-        member = self.connection.execute(
-            'SELECT id, tokens FROM members WHERE tg_id = ?',
-            (member_tg_id,)
-        ).fetchone()
+        member = self._member(member_tg_id)
 
         if member is None:
-            raise BetError('Please join to place a bet!')
+            raise BetError('Please join to place a bet!', BetError.NOT_MEMBER)
 
         cursor = self.connection.cursor()
         cursor.execute(
             'UPDATE bets SET poll_option_id = ? '
             'WHERE poll_id = ? AND member_id = ? ',
-            (option[0], option[2], member[0])
+            (option[0], option[2], member.member_id)
         )
 
         if cursor.rowcount == 0:
-            self.connection.rollback()
-            raise BetError('You have no bets open for this poll!')
-
-        self.connection.commit()
+            raise BetError('You have no bets open for this poll!', BetError.NO_OPEN_BET)
 
-    def store_poll(self, poll: dict, tg_poll_id: int, tg_message_id: int) -> int:
+    def store_poll(self, poll: dict, tg_poll_id: int, tg_message_id: int, deadline: int | None = None) -> int:
         cursor = self.connection.cursor()
 
         cursor.execute(
-            'INSERT INTO polls (tg_poll_id, tg_message_id, text) VALUES (?, ?, ?)',
-            (tg_poll_id, tg_message_id, poll['text'])
+            'INSERT INTO polls (group_id, tg_poll_id, tg_message_id, text, deadline) VALUES (?, ?, ?, ?, ?)',
+            (self.group_id, tg_poll_id, tg_message_id, poll['text'], deadline)
         )
         poll_id = cursor.lastrowid
 
@@ -182,109 +243,267 @@ class Group:
         return cursor.lastrowid
 
     def close_poll(self, tg_poll_id: int, correct_tg_index: int) -> (list[BetResult], str):
-        bets = self.connection.execute(
-            'SELECT amount, member_id, polls.tg_poll_id as tg_poll_id, poll_options.tg_index as tg_index, '
-            'members.name as member_name, members.tokens as tokens, polls.id as poll_id '
-            'FROM bets '
-            'JOIN poll_options ON bets.poll_option_id = poll_options.id '
-            'JOIN polls ON poll_options.poll_id = polls.id '
-            'JOIN members ON bets.member_id = members.id '
-            'WHERE tg_poll_id = ?',
-            (tg_poll_id,)
-        ).fetchall()
-
-        correct, wrong = [], []
-        winnable, total_bet = 0, 0
+        credits: list[tuple[int, int]] = []
+        try:
+            result = self._close_poll(tg_poll_id, correct_tg_index, credits)
+        except DatabaseError as e:
+            raise BetError(e)
 
-        if len(bets) > 0:
-            poll_id = bets[0][6]
-        else:
-            return [], "Nessuna scommessa piazzata"
+        for member_id, amount in credits:
+            self.members.adjust(member_id, amount)
 
-        for bet in bets:
-            if int(bet[3]) == correct_tg_index:
-                correct.append(bet)
-                total_bet += bet[0]
-            else:
-                wrong.append(bet)
-                winnable += bet[0]
+        return result
 
-        if winnable == 0:
-            self.connection.execute('UPDATE bets SET open = 0 WHERE poll_id = ?', (poll_id, ))
-            self.connection.commit()
-            return [], "Non c'è nulla da vincere"
+    def _close_poll(
+            self,
+            tg_poll_id: int,
+            correct_tg_index: int,
+            credits: list[tuple[int, int]],
+    ) -> (list[BetResult], str):
+        with transaction(self.connection):
+            poll = self.connection.execute(
+                'SELECT id, closed_at FROM polls WHERE group_id = ? AND tg_poll_id = ?',
+                (self.group_id, tg_poll_id)
+            ).fetchone()
+
+            if poll is None:
+                return [], "Nessuna scommessa piazzata"
+
+            poll_id, closed_at = poll
+            if closed_at is not None:
+                return [], "Il sondaggio è già stato chiuso"
 
-        feedback: list[BetResult] = []
-        cursor = self.connection.cursor()
-        try:
-            for bet in correct:
-                win_factor = int(bet[0]) / total_bet
-                win = math.floor(win_factor * winnable)
-                new_tokens = int(bet[5]) + win
-                cursor.execute('UPDATE members SET tokens = ? WHERE id = ?', (new_tokens, bet[1]))
-                feedback.append({
-                    'member_id': bet[1],
-                    'member_name': bet[4],
-                    'win': win,
-                    'tokens': new_tokens
-                })
-            for bet in wrong:
-                new_tokens = int(bet[5]) - int(bet[0])
-                cursor.execute('UPDATE members SET tokens = ? WHERE id = ?', (new_tokens, bet[1]))
-                feedback.append({
+            self.connection.execute(
+                'UPDATE polls SET closed_at = ? WHERE id = ?', (int(time.time()), poll_id))
+            credits += self._refund_unselected(poll_id)
+
+            bets = self.connection.execute(
+                'SELECT amount, member_id, poll_options.tg_index as tg_index, '
+                'members.name as member_name, members.tokens as tokens '
+                'FROM bets '
+                'JOIN poll_options ON bets.poll_option_id = poll_options.id '
+                'JOIN members ON bets.member_id = members.id '
+                'WHERE bets.poll_id = ? AND bets.open = 1 '
+                'ORDER BY bets.id',
+                (poll_id,)
+            ).fetchall()
+
+            if len(bets) == 0:
+                return [], "Nessuna scommessa piazzata"
+
+            correct = [bet for bet in bets if int(bet[2]) == correct_tg_index]
+            wrong = [bet for bet in bets if int(bet[2]) != correct_tg_index]
+            winnable = sum(int(bet[0]) for bet in wrong)
+
+            self.connection.execute('UPDATE bets SET open = 0 WHERE poll_id = ?', (poll_id,))
+
+            if winnable == 0:
+                credits += self._credit(poll_id, [(bet[1], int(bet[0])) for bet in correct], REFUND)
+                self._record_stats([(bet[1], None, 0) for bet in correct])
+                return [], "Non c'è nulla da vincere"
+
+            wins = split_pot([int(bet[0]) for bet in correct], winnable)
+            deltas = wins + [-int(bet[0]) for bet in wrong]
+            payouts = [int(bet[0]) + win for bet, win in zip(correct, wins)] + [0] * len(wrong)
+            self._record_stats([
+                (bet[1], i < len(correct), delta)
+                for i, (bet, delta) in enumerate(zip(correct + wrong, deltas))
+            ])
+
+            feedback: list[BetResult] = [
+                {
                     'member_id': bet[1],
-                    'member_name': bet[4],
-                    'win': -int(bet[0]),
-                    'tokens': new_tokens
-                })
+                    'member_name': bet[3],
+                    'win': delta,
+                    'tokens': int(bet[4]) + payout,
+                }
+                for bet, delta, payout in zip(correct + wrong, deltas, payouts)
+            ]
 
-            cursor.execute('UPDATE bets SET open = 0 WHERE poll_id = ?', (poll_id, ))
-        except Exception as e:
-            self.connection.rollback()
-            raise BetError(e)
-        else:
-            self.connection.commit()
+            credits += self._credit(poll_id, [(bet[1], payout) for bet, payout in zip(correct, payouts)], PAYOUT)
 
         return feedback, "All good"
 
-    @staticmethod
-    def _init_database(connection: Connection, chat_id: int, description: str) -> None:
-        connection.execute('CREATE TABLE IF NOT EXISTS group_info ('
-                           'id INTEGER PRIMARY KEY,'
-                           'description TEXT,'
-                           'tg_id INTEGER)')
-        connection.execute('CREATE TABLE IF NOT EXISTS members('
-                           'id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,'
-                           'tg_id INTEGER NOT NULL,'
-                           'name TEXT,'
-                           'tokens INTEGER NOT NULL)')
-        connection.execute('CREATE TABLE IF NOT EXISTS suggestions('
-                           'id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,'
-                           'text TEXT NOT NULL)')
-        connection.execute('CREATE TABLE IF NOT EXISTS polls('
-                           'id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,'
-                           'tg_poll_id INTEGER NOT NULL,'
-                           'tg_message_id INTEGER NOT NULL,'
-                           'text TEXT NOT NULL,'
-                           'open TINYINT NOT NULL DEFAULT 1)')
-        connection.execute('CREATE TABLE IF NOT EXISTS poll_options('
-                           'id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,'
-                           'tg_index INTEGER NOT NULL,'
-                           'text TEXT NOT NULL,'
-                           'rating INTEGER NOT NULL,'
-                           'poll_id INTEGER NOT NULL,'
-                           'FOREIGN KEY (poll_id) REFERENCES polls(id))')
-        connection.execute('CREATE TABLE IF NOT EXISTS bets('
-                           'id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,'
-                           'amount INTEGER NOT NULL,'
-                           'open TINYINT NOT NULL DEFAULT 1,'
-                           'member_id INTEGER NOT NULL,'
-                           'poll_id INTEGER NOT NULL,'
-                           'poll_option_id INTEGER NULLABLE,'
-                           'FOREIGN KEY (member_id) REFERENCES members(id),'
-                           'FOREIGN KEY (poll_id) REFERENCES polls(id),'
-                           'FOREIGN KEY (poll_option_id) REFERENCES poll_options(id))')
-
-        connection.execute('INSERT INTO group_info (id, tg_id, description) VALUES (0, ?, ?)',
-                           (chat_id,description))
-        connection.commit()
+    def leaderboard(self, n: int = 10) -> list[MemberStats]:
+        rows = self.connection.execute(
+            'SELECT members.name, played, won, lost, net, biggest_win, streak '
+            'FROM member_stats '
+            'JOIN members ON member_stats.member_id = members.id '
+            'WHERE member_stats.group_id = ? '
+            'ORDER BY net DESC, member_stats.id '
+            'LIMIT ?',
+            (self.group_id, n)
+        ).fetchall()
+
+        return [
+            {
+                'member_name': row[0],
+                'played': row[1],
+                'won': row[2],
+                'lost': row[3],
+                'net': row[4],
+                'biggest_win': row[5],
+                'streak': row[6],
+            }
+            for row in rows
+        ]
+
+    def _record_stats(self, outcomes: list[tuple[int, bool | None, int]]) -> None:
+        self.connection.executemany(
+            'INSERT INTO member_stats (group_id, member_id, played, won, lost, net, biggest_win, streak) '
+            'VALUES (?, ?, 1, ?, ?, ?, MAX(?, 0), ?) '
+            'ON CONFLICT(member_id) DO UPDATE SET '
+            'played = played + 1, '
+            'won = won + excluded.won, '
+            'lost = lost + excluded.lost, '
+            'net = net + excluded.net, '
+            'biggest_win = MAX(biggest_win, excluded.biggest_win), '
+            'streak = CASE WHEN excluded.won = 1 THEN MAX(streak, 0) + 1 '
+            'WHEN excluded.lost = 1 THEN MIN(streak, 0) - 1 ELSE streak END',
+            [
+                (self.group_id, member_id, int(won is True), int(won is False), delta, delta,
+                 0 if won is None else 1 if won else -1)
+                for member_id, won, delta in outcomes
+            ]
+        )
+
+    def set_resolution(self, tg_message_id: int, tg_index: int) -> bool:
+        cursor = self.connection.execute(
+            'UPDATE polls SET resolution = ? '
+            'WHERE group_id = ? AND tg_message_id = ? AND deadline IS NOT NULL AND closed_at IS NULL',
+            (tg_index, self.group_id, tg_message_id)
+        )
+        self.connection.commit()
+
+        return cursor.rowcount == 1
+
+    def pending_deadlines(self) -> list[tuple[int, int]]:
+        return self.connection.execute(
+            'SELECT tg_poll_id, deadline FROM polls '
+            'WHERE group_id = ? AND deadline IS NOT NULL AND stopped_at IS NULL AND closed_at IS NULL',
+            (self.group_id,)
+        ).fetchall()
+
+    def expire_poll(self, tg_poll_id: int) -> tuple[int, int | None] | None:
+        with transaction(self.connection):
+            poll = self.connection.execute(
+                'SELECT id, tg_message_id, resolution FROM polls '
+                'WHERE group_id = ? AND tg_poll_id = ? AND stopped_at IS NULL AND closed_at IS NULL',
+                (self.group_id, tg_poll_id)
+            ).fetchone()
+
+            if poll is None:
+                return None
+
+            self.connection.execute('UPDATE polls SET stopped_at = ? WHERE id = ?', (int(time.time()), poll[0]))
+
+        return poll[1], poll[2]
+
+    def check_ledger(self) -> int:
+        with transaction(self.connection):
+            mismatches = self.connection.execute(
+                'SELECT members.id, members.checkpoint_tokens + COALESCE(SUM(ledger.amount), 0) AS expected '
+                'FROM members '
+                'LEFT JOIN ledger ON ledger.member_id = members.id AND ledger.id > members.checkpoint_ledger_id '
+                'WHERE members.group_id = ? '
+                'GROUP BY members.id '
+                'HAVING members.tokens != expected',
+                (self.group_id,)
+            ).fetchall()
+
+            self.connection.executemany(
+                'UPDATE members SET tokens = ? WHERE id = ?',
+                [(expected, member_id) for member_id, expected in mismatches]
+            )
+            self.connection.execute(
+                'UPDATE members SET checkpoint_tokens = tokens, '
+                'checkpoint_ledger_id = (SELECT COALESCE(MAX(id), 0) FROM ledger) '
+                'WHERE group_id = ?',
+                (self.group_id,)
+            )
+
+        if len(mismatches) > 0:
+            self.members.clear()
+
+        return len(mismatches)
+
+    def archive_polls(self, closed_before: int, limit: int = 100) -> list[int]:
+        with transaction(self.connection):
+            polls = self.connection.execute(
+                'SELECT id, tg_poll_id FROM polls WHERE group_id = ? AND closed_at < ? ORDER BY closed_at LIMIT ?',
+                (self.group_id, closed_before, limit)
+            ).fetchall()
+
+            if len(polls) == 0:
+                return []
+
+            poll_ids = [poll[0] for poll in polls]
+            placeholders = ', '.join('?' * len(poll_ids))
+
+            for table, key in (('polls', 'id'), ('poll_options', 'poll_id'), ('bets', 'poll_id')):
+                columns = ', '.join(self._archive_columns(table))
+                self.connection.execute(
+                    f'INSERT INTO archived_{table} ({columns}) '
+                    f'SELECT {columns} FROM {table} WHERE {key} IN ({placeholders})',
+                    poll_ids
+                )
+
+            for table, key in (('bets', 'poll_id'), ('poll_options', 'poll_id'), ('polls', 'id')):
+                self.connection.execute(f'DELETE FROM {table} WHERE {key} IN ({placeholders})', poll_ids)
+
+        return [poll[1] for poll in polls]
+
+    def vacuum(self, pages: int = 256) -> int:
+        return incremental_vacuum(self.connection, pages)
+
+    def _archive_columns(self, table: str) -> list[str]:
+        archived = {row[1] for row in self.connection.execute(f'PRAGMA table_info(archived_{table})')}
+
+        return [row[1] for row in self.connection.execute(f'PRAGMA table_info({table})') if row[1] in archived]
+
+    def _member(self, tg_id: int, refresh: bool = False) -> CachedMember | None:
+        member = None if refresh else self.members.get(tg_id)
+        if member is not None:
+            return member
+
+        row = self.connection.execute(
+            'SELECT id, name, tokens FROM members WHERE group_id = ? AND tg_id = ?',
+            (self.group_id, tg_id)
+        ).fetchone()
+
+        if row is None:
+            self.members.discard(tg_id)
+            return None
+
+        member = CachedMember(row[0], row[1], int(row[2]))
+        self.members.put(tg_id, member)
+
+        return member
+
+    def _refund_unselected(self, poll_id: int) -> list[tuple[int, int]]:
+        unselected = self.connection.execute(
+            'SELECT member_id, amount FROM bets WHERE poll_id = ? AND poll_option_id IS NULL AND open = 1',
+            (poll_id,)
+        ).fetchall()
+        self.connection.execute(
+            'UPDATE bets SET open = 0 WHERE poll_id = ? AND poll_option_id IS NULL AND open = 1', (poll_id,))
+
+        return self._credit(poll_id, [(member_id, int(amount)) for member_id, amount in unselected], REFUND)
+
+    def _credit(self, poll_id: int, credits: list[tuple[int, int]], kind: str) -> list[tuple[int, int]]:
+        credits = [(member_id, amount) for member_id, amount in credits if amount != 0]
+
+        self.connection.executemany(
+            'UPDATE members SET tokens = tokens + ? WHERE id = ?',
+            [(amount, member_id) for member_id, amount in credits]
+        )
+        self._append_ledger([(member_id, poll_id, kind, amount) for member_id, amount in credits])
+
+        return credits
+
+    def _append_ledger(self, entries: list[tuple[int, int | None, str, int]]) -> None:
+        now = int(time.time())
+        self.connection.executemany(
+            'INSERT INTO ledger (group_id, member_id, poll_id, kind, amount, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+            [(self.group_id, member_id, poll_id, kind, amount, now) for member_id, poll_id, kind, amount in entries]
+        )
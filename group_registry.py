@@ -0,0 +1,138 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable
+
+from group import Group
+
+
+class GroupRegistry:
+    def __init__(
+            self,
+            max_size: int = 128,
+            idle_timeout: float = 600,
+            on_evict: Callable[[Group], None] | None = None,
+    ):
+        if max_size < 1:
+            raise ValueError('max_size must be at least 1')
+
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.on_evict = on_evict if on_evict is not None else Group.close
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._groups: OrderedDict[int, tuple[Group, float]] = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, tg_chat_id: int) -> Group:
+        with self._lock:
+            entry = self._groups.get(tg_chat_id)
+            if entry is not None:
+                self.hits += 1
+                return self._touch(tg_chat_id, entry[0])
+
+            self.misses += 1
+
+        opened = Group(tg_chat_id=tg_chat_id)
+
+        with self._lock:
+            entry = self._groups.get(tg_chat_id)
+            group = entry[0] if entry is not None else opened
+            self._touch(tg_chat_id, group)
+            evicted = self._collect(time.monotonic())
+
+        if group is not opened:
+            self.on_evict(opened)
+        self._evict(evicted)
+
+        return group
+
+    def peek(self, tg_chat_id: int) -> Group | None:
+        with self._lock:
+            entry = self._groups.get(tg_chat_id)
+
+        return entry[0] if entry is not None else None
+
+    def put(self, group: Group) -> None:
+        now = time.monotonic()
+        tg_chat_id = group.group_info['tg_chat_id']
+
+        with self._lock:
+            previous = self._groups.pop(tg_chat_id, None)
+            self._groups[tg_chat_id] = (group, now)
+            evicted = self._collect(now)
+
+        if previous is not None and previous[0] is not group:
+            evicted.append(previous[0])
+
+        self._evict(evicted)
+
+    def remove(self, tg_chat_id: int) -> None:
+        with self._lock:
+            entry = self._groups.pop(tg_chat_id, None)
+
+        if entry is not None:
+            self._evict([entry[0]])
+
+    def evict_idle(self) -> int:
+        with self._lock:
+            evicted = self._collect(time.monotonic())
+
+        self._evict(evicted)
+
+        return len(evicted)
+
+    def close(self) -> None:
+        with self._lock:
+            evicted = [group for group, _ in self._groups.values()]
+            self._groups.clear()
+
+        self._evict(evicted)
+
+    def groups(self) -> list[Group]:
+        with self._lock:
+            return [group for group, _ in self._groups.values()]
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = len(self._groups)
+
+        return {
+            'size': size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def __len__(self) -> int:
+        return len(self._groups)
+
+    def _touch(self, tg_chat_id: int, group: Group) -> Group:
+        self._groups[tg_chat_id] = (group, time.monotonic())
+        self._groups.move_to_end(tg_chat_id)
+
+        return group
+
+    def _collect(self, now: float) -> list[Group]:
+        evicted = []
+
+        while len(self._groups) > self.max_size:
+            _, (group, _) = self._groups.popitem(last=False)
+            evicted.append(group)
+
+        while self._groups:
+            tg_chat_id, (group, last_used) = next(iter(self._groups.items()))
+            if now - last_used < self.idle_timeout:
+                break
+            del self._groups[tg_chat_id]
+            evicted.append(group)
+
+        return evicted
+
+    def _evict(self, groups: list[Group]) -> None:
+        for group in groups:
+            self.evictions += 1
+            self.on_evict(group)
@@ -0,0 +1,147 @@
+import asyncio
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+import httpx
+from openai import (APIConnectionError, AsyncOpenAI, DefaultAsyncHttpxClient, InternalServerError,
+                    RateLimitError)
+from openai.types.chat import ChatCompletion
+
+from metrics import context_labels, metrics
+
+
+class LLMClient:
+    _retryable = (APIConnectionError, RateLimitError, InternalServerError)
+
+    def __init__(
+            self,
+            model: str = 'gpt-3.5-turbo-0125',
+            max_connections: int = 20,
+            max_concurrency: int = 10,
+            max_concurrency_per_chat: int = 2,
+            timeout: float = 30.0,
+            max_retries: int = 2,
+            backoff: float = 0.5,
+            client: AsyncOpenAI | None = None,
+    ):
+        self.model = model
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.client = client if client is not None else AsyncOpenAI(
+            timeout=timeout,
+            max_retries=0,
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=max_connections,
+                    max_keepalive_connections=max_connections,
+                ),
+            ),
+        )
+
+        self.max_concurrency_per_chat = max_concurrency_per_chat
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._chat_semaphores: dict[int, list] = {}
+
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.retries = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    async def complete(self, messages: list[dict], chat_id: int | None = None, **kwargs) -> ChatCompletion:
+        async with self._chat_slot(chat_id), self._semaphore:
+            return await self._create(messages, chat_id, **kwargs)
+
+    async def stream(self, messages: list[dict], chat_id: int | None = None, **kwargs) -> AsyncIterator[str]:
+        async with self._chat_slot(chat_id), self._semaphore:
+            response = await self._create(
+                messages, chat_id, stream=True, stream_options={'include_usage': True}, **kwargs)
+            start = time.perf_counter()
+            try:
+                async for chunk in response:
+                    if chunk.usage is not None:
+                        self._record_usage(chunk.usage, chat_id)
+                    for choice in chunk.choices:
+                        if choice.delta.content:
+                            yield choice.delta.content
+            finally:
+                metrics.observe('llm_stream_seconds', time.perf_counter() - start, **self._labels(chat_id))
+                await response.close()
+
+    async def _create(self, messages: list[dict], chat_id: int | None, **kwargs):
+        kwargs.setdefault('model', self.model)
+
+        attempt = 0
+        while True:
+            try:
+                return await self._timed(self.client.chat.completions.create(messages=messages, **kwargs), chat_id)
+            except self._retryable:
+                if attempt >= self.max_retries:
+                    raise
+                self.retries += 1
+                await asyncio.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+                attempt += 1
+
+    async def close(self) -> None:
+        await self.client.close()
+
+    def stats(self) -> dict:
+        return {
+            'in_flight': self.in_flight,
+            'requests': self.requests,
+            'failures': self.failures,
+            'retries': self.retries,
+            'latency_avg': self.latency_total / self.requests if self.requests else 0.0,
+            'latency_max': self.latency_max,
+        }
+
+    async def _timed(self, request, chat_id: int | None):
+        self.in_flight += 1
+        self.requests += 1
+        start = time.perf_counter()
+        try:
+            response = await request
+        except Exception:
+            self.failures += 1
+            metrics.inc('llm_errors_total', **self._labels(chat_id))
+            raise
+        finally:
+            latency = time.perf_counter() - start
+            self.in_flight -= 1
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+            metrics.observe('llm_seconds', latency, **self._labels(chat_id))
+
+        usage = getattr(response, 'usage', None)
+        if usage is not None:
+            self._record_usage(usage, chat_id)
+
+        return response
+
+    def _record_usage(self, usage, chat_id: int | None) -> None:
+        labels = self._labels(chat_id)
+        metrics.inc('llm_tokens_total', usage.prompt_tokens, kind='prompt', **labels)
+        metrics.inc('llm_tokens_total', usage.completion_tokens, kind='completion', **labels)
+
+    @staticmethod
+    def _labels(chat_id: int | None) -> dict[str, str]:
+        return {**context_labels(), 'chat': metrics.chat_label(chat_id)}
+
+    @asynccontextmanager
+    async def _chat_slot(self, chat_id: int | None) -> AsyncIterator[None]:
+        if chat_id is None:
+            yield
+            return
+
+        slot = self._chat_semaphores.setdefault(chat_id, [asyncio.Semaphore(self.max_concurrency_per_chat), 0])
+        slot[1] += 1
+        try:
+            async with slot[0]:
+                yield
+        finally:
+            slot[1] -= 1
+            if slot[1] == 0:
+                del self._chat_semaphores[chat_id]
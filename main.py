@@ -1,30 +1,167 @@
+import asyncio
+import functools
 import math
+import os
 from logging import warning
 from os import environ
 
-from openai import AsyncOpenAI
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Bot, Message, Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import TelegramError
 from dotenv import load_dotenv
 from telegram.ext import Application, CommandHandler, CallbackContext, CallbackQueryHandler, PollAnswerHandler
+from telegram.request import BaseRequest
 
+from error_messages import EARLY_ANSWER, NON_NUMERIC, NON_POSITIVE, ErrorMessagePool
 from errors.bet_error import BetError
+from errors.no_suggestions_error import NoSuggestionsError
+from errors.poll_schema_error import PollSchemaError
+from backends import FileBackend, MultiTenantBackend
+from backup import Backup, PeriodicBackup
+from compaction import Compactor, parse_quiet_hours
+from database import pragma_profile, uses_wal
+from dtypes import BetResult
 from group import Group
+from llm_client import LLMClient
+from metrics import MetricsServer, instrument_handler, metrics
 from poll import Poll
 from poll_generator import PollGenerator
+from scheduler import DeadlineScheduler, parse_deadline
+from sharding import ShardRouter, run_sharded, shard_of
+from storage import Checkpointer, IdleSweeper, Storage
+from streaming import BackgroundStreams, stream_into
+from update_processor import ChatOrderedUpdateProcessor
+from webhook import WebhookServer, run_webhook
+from write_behind import SelectionBuffer
 
 load_dotenv()
 
 DATA_PATH = environ.get('DATA_PATH')
 BOT_TOKEN = environ.get('BOT_TOKEN')
+STORAGE_BACKEND = environ.get('STORAGE_BACKEND', 'file')
+SQLITE_PROFILE = environ.get('SQLITE_PROFILE', 'fast')
+SQLITE_PRAGMAS = environ.get('SQLITE_PRAGMAS', '')
+SQLITE_CHECKPOINT_INTERVAL = float(environ.get('SQLITE_CHECKPOINT_INTERVAL', 60))
+GROUP_CACHE_SIZE = int(environ.get('GROUP_CACHE_SIZE', 128))
+GROUP_IDLE_TIMEOUT = float(environ.get('GROUP_IDLE_TIMEOUT', 600))
+GROUP_SWEEP_INTERVAL = float(environ.get('GROUP_SWEEP_INTERVAL', 60))
+MEMBER_CACHE_SIZE = int(environ.get('MEMBER_CACHE_SIZE', 1024))
+STORAGE_WORKERS = int(environ.get('STORAGE_WORKERS', 4))
+POLL_ROUTES_SIZE = int(environ.get('POLL_ROUTES_SIZE', 10000))
+OPENAI_MAX_CONNECTIONS = int(environ.get('OPENAI_MAX_CONNECTIONS', 20))
+OPENAI_MAX_CONCURRENCY = int(environ.get('OPENAI_MAX_CONCURRENCY', 10))
+OPENAI_MAX_CONCURRENCY_PER_CHAT = int(environ.get('OPENAI_MAX_CONCURRENCY_PER_CHAT', 2))
+OPENAI_TIMEOUT = float(environ.get('OPENAI_TIMEOUT', 30))
+OPENAI_MAX_RETRIES = int(environ.get('OPENAI_MAX_RETRIES', 2))
+ERROR_POOL_SIZE = int(environ.get('ERROR_POOL_SIZE', 5))
+ERROR_POOL_TTL = float(environ.get('ERROR_POOL_TTL', 3600))
+POLL_PREFETCH_SIZE = int(environ.get('POLL_PREFETCH_SIZE', 2))
+POLL_PREFETCH_CONCURRENCY = int(environ.get('POLL_PREFETCH_CONCURRENCY', 2))
+POLL_PREFETCH_IDLE_TIMEOUT = float(environ.get('POLL_PREFETCH_IDLE_TIMEOUT', 1800))
+POLL_GENERATION_ATTEMPTS = int(environ.get('POLL_GENERATION_ATTEMPTS', 2))
+WRITE_BEHIND = environ.get('WRITE_BEHIND', '0') == '1'
+WRITE_BEHIND_INTERVAL_MS = int(environ.get('WRITE_BEHIND_INTERVAL_MS', 200))
+WRITE_BEHIND_MAX_ENTRIES = int(environ.get('WRITE_BEHIND_MAX_ENTRIES', 100))
+UPDATE_WORKERS = int(environ.get('UPDATE_WORKERS', 32))
+WEBHOOK_URL = environ.get('WEBHOOK_URL')
+WEBHOOK_SECRET = environ.get('WEBHOOK_SECRET', '')
+WEBHOOK_HOST = environ.get('WEBHOOK_HOST', '127.0.0.1')
+WEBHOOK_PORT = int(environ.get('WEBHOOK_PORT', 8443))
+WEBHOOK_PATH = environ.get('WEBHOOK_PATH', '/telegram')
+WEBHOOK_MAX_PENDING = int(environ.get('WEBHOOK_MAX_PENDING', 1024))
+CLOSE_EDIT_INTERVAL = float(environ.get('CLOSE_EDIT_INTERVAL', 3))
+CLOSE_STREAM_TIMEOUT = float(environ.get('CLOSE_STREAM_TIMEOUT', 30))
+DEADLINE_CONCURRENCY = int(environ.get('DEADLINE_CONCURRENCY', 8))
+BACKUP_PATH = environ.get('BACKUP_PATH')
+BACKUP_INTERVAL = float(environ.get('BACKUP_INTERVAL', 3600))
+BACKUP_KEEP = int(environ.get('BACKUP_KEEP', 24))
+SHARD_WORKERS = int(environ.get('SHARD_WORKERS', 0))
+SHARD_INDEX = int(environ.get('SHARD_INDEX', 0))
+SHARD_COUNT = int(environ.get('SHARD_COUNT', 1))
+SHARD_STOP_TIMEOUT = float(environ.get('SHARD_STOP_TIMEOUT', 30))
+COMPACTION_INTERVAL = float(environ.get('COMPACTION_INTERVAL', 3600))
+COMPACTION_MAX_AGE_DAYS = float(environ.get('COMPACTION_MAX_AGE_DAYS', 30))
+COMPACTION_BATCH_SIZE = int(environ.get('COMPACTION_BATCH_SIZE', 50))
+COMPACTION_PAUSE = float(environ.get('COMPACTION_PAUSE', 0.2))
+COMPACTION_QUIET_HOURS = environ.get('COMPACTION_QUIET_HOURS', '3-6')
+COMPACTION_VACUUM_PAGES = int(environ.get('COMPACTION_VACUUM_PAGES', 256))
+LEADERBOARD_SIZE = int(environ.get('LEADERBOARD_SIZE', 10))
+METRICS_HOST = environ.get('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(environ.get('METRICS_PORT', 0))
+METRICS_LOG_INTERVAL = float(environ.get('METRICS_LOG_INTERVAL', 300))
+METRICS_MAX_CHATS = int(environ.get('METRICS_MAX_CHATS', 100))
 
 COMMANDS = {
     'close': 'close'
 }
 
-Group.data_path = DATA_PATH
-Poll.data_path = DATA_PATH
+BACKENDS = {
+    'file': FileBackend,
+    'multi-tenant': MultiTenantBackend,
+}
 
-poll_handler = Poll()
+backend: FileBackend | MultiTenantBackend
+storage: Storage
+checkpointer: Checkpointer | None
+sweeper: IdleSweeper
+backups: PeriodicBackup | None
+llm: LLMClient
+error_messages: ErrorMessagePool
+poll_generator: PollGenerator
+scheduler: DeadlineScheduler
+compactor: Compactor | None
+metrics_server: MetricsServer
+streams: BackgroundStreams
+
+
+def configure() -> None:
+    global backend, storage, checkpointer, sweeper, backups, llm, error_messages, poll_generator, scheduler, \
+        compactor, metrics_server, streams
+
+    sqlite_profile = pragma_profile(SQLITE_PROFILE, SQLITE_PRAGMAS)
+    backend = BACKENDS[STORAGE_BACKEND](DATA_PATH, sqlite_profile)
+    Group.backend = backend
+    Group.member_cache_size = MEMBER_CACHE_SIZE
+    Poll.backend = backend
+
+    storage = Storage(STORAGE_WORKERS, GROUP_CACHE_SIZE, GROUP_IDLE_TIMEOUT, POLL_ROUTES_SIZE)
+    checkpointer = Checkpointer(storage, SQLITE_CHECKPOINT_INTERVAL) if uses_wal(sqlite_profile) else None
+    sweeper = IdleSweeper(storage, GROUP_SWEEP_INTERVAL)
+    backups = PeriodicBackup(Backup(DATA_PATH, BACKUP_PATH, keep=BACKUP_KEEP), BACKUP_INTERVAL) if BACKUP_PATH else None
+    if WRITE_BEHIND:
+        storage.selections = SelectionBuffer(storage, WRITE_BEHIND_INTERVAL_MS / 1000, WRITE_BEHIND_MAX_ENTRIES)
+    llm = LLMClient(
+        max_connections=OPENAI_MAX_CONNECTIONS,
+        max_concurrency=OPENAI_MAX_CONCURRENCY,
+        max_concurrency_per_chat=OPENAI_MAX_CONCURRENCY_PER_CHAT,
+        timeout=OPENAI_TIMEOUT,
+        max_retries=OPENAI_MAX_RETRIES,
+    )
+    error_messages = ErrorMessagePool(
+        lambda error: generate_error_message(llm, error),
+        size=ERROR_POOL_SIZE,
+        ttl=ERROR_POOL_TTL,
+    )
+    poll_generator = PollGenerator(
+        llm,
+        queue_size=POLL_PREFETCH_SIZE,
+        max_concurrency=POLL_PREFETCH_CONCURRENCY,
+        idle_timeout=POLL_PREFETCH_IDLE_TIMEOUT,
+        max_attempts=POLL_GENERATION_ATTEMPTS,
+    )
+    scheduler = DeadlineScheduler(max_concurrency=DEADLINE_CONCURRENCY)
+    compactor = Compactor(
+        storage,
+        owned_groups,
+        max_age=COMPACTION_MAX_AGE_DAYS * 86400,
+        interval=COMPACTION_INTERVAL,
+        batch_size=COMPACTION_BATCH_SIZE,
+        pause=COMPACTION_PAUSE,
+        quiet_hours=parse_quiet_hours(COMPACTION_QUIET_HOURS),
+        vacuum_pages=COMPACTION_VACUUM_PAGES,
+    ) if COMPACTION_INTERVAL > 0 else None
+    metrics.max_chats = METRICS_MAX_CHATS
+    metrics_server = MetricsServer(METRICS_HOST, METRICS_PORT, METRICS_LOG_INTERVAL)
+    streams = BackgroundStreams()
 
 
 def join_button() -> InlineKeyboardMarkup:
@@ -35,7 +172,7 @@ def join_button() -> InlineKeyboardMarkup:
 
 async def create(update: Update, _: CallbackContext):
     try:
-        Group.create_group(update.effective_chat.id, '')
+        await storage.create_group(update.effective_chat.id, '')
     except ValueError as e:
         await update.message.reply_text(f'Errore durante la creazione del gruppo: {e}')
         return
@@ -45,11 +182,11 @@ async def create(update: Update, _: CallbackContext):
 
 async def join(update: Update, _: CallbackContext):
     query = update.callback_query
-    group = Group(tg_chat_id=int(update.effective_chat.id))
+    group = storage.group(int(update.effective_chat.id))
     user_id = int(query.from_user.id)
     user_name = query.from_user.full_name
 
-    if not group.add_member(user_id, user_name):
+    if not await group.add_member(user_id, user_name):
         message = f'{user_name} è già un membro.'
     else:
         message = f'{user_name} aggiunto correttamente!'
@@ -58,20 +195,23 @@ async def join(update: Update, _: CallbackContext):
 
 
 async def suggest(update: Update, _: CallbackContext) -> None:
-    group = Group(tg_chat_id=update.effective_chat.id)
+    group = storage.group(update.effective_chat.id)
     suggestion = update.message.text.replace("/suggest", "").strip("")
     if suggestion == "":
         await update.message.reply_text('Nessun suggerimento ricevuto. Utilizzo: /suggest {suggerimento}')
         return
 
-    group.suggest(suggestion)
+    if not await group.suggest(suggestion):
+        await update.message.reply_text('Questo suggerimento è già presente')
+        return
 
+    poll_generator.suggestion_added(group)
     await update.message.reply_text('Ok! Ho aggiunto il suggerimento')
 
 
 async def tokens(update: Update, _: CallbackContext) -> None:
-    group = Group(tg_chat_id=update.effective_chat.id)
-    tokens_ = group.get_tokens(update.effective_user.id)
+    group = storage.group(update.effective_chat.id)
+    tokens_ = await group.get_tokens(update.effective_user.id)
 
     if tokens_ is None:
         await update.message.reply_text('Non sei ancora un membro', reply_markup=join_button())
@@ -79,17 +219,40 @@ async def tokens(update: Update, _: CallbackContext) -> None:
         await update.message.reply_text(f'Hai ancora {tokens_} token')
 
 
+async def leaderboard(update: Update, _: CallbackContext) -> None:
+    group = storage.group(update.effective_chat.id)
+    top = await group.leaderboard(LEADERBOARD_SIZE)
+
+    if len(top) == 0:
+        await update.message.reply_text('Nessuna scommessa ancora chiusa')
+        return
+
+    msg = ''
+    for position, stats in enumerate(top, start=1):
+        msg += (f'{position}. {stats["member_name"]}: {stats["net"]:+} token, '
+                f'{stats["won"]}/{stats["played"]} vinte, serie {stats["streak"]:+}\n')
+
+    await update.message.reply_text(msg)
+
+
 async def generate(update: Update, context: CallbackContext) -> None:
     chat_id = update.effective_chat.id
 
-    group = Group(tg_chat_id=chat_id)
-    generator = PollGenerator(group)
+    group = storage.group(chat_id)
 
-    suggestion = update.message.text.replace("/generate ", "").strip()
+    suggestion, deadline = parse_deadline(' '.join(context.args or []))
     if suggestion == "":
         suggestion = None
 
-    generated = await generator.generate(AsyncOpenAI(), suggestion)
+    try:
+        generated = await poll_generator.generate(group, suggestion)
+    except NoSuggestionsError:
+        await update.message.reply_text('Nessun suggerimento disponibile. Aggiungine uno con /suggest')
+        return
+    except PollSchemaError:
+        await update.message.reply_text('Non sono riuscito a generare un sondaggio valido, riprova.')
+        return
+
     message = await context.bot.send_poll(
         is_anonymous=False,
         chat_id=chat_id,
@@ -97,32 +260,29 @@ async def generate(update: Update, context: CallbackContext) -> None:
         options=[option['text'] for option in generated['options']],
     )
 
-    group.store_poll(generated, int(message.poll.id), message.id)
-    poll_handler.store(int(message.poll.id), chat_id)
+    await group.store_poll(generated, int(message.poll.id), message.id, deadline)
+    await storage.polls.store(int(message.poll.id), chat_id)
+    if deadline is not None:
+        scheduler.schedule(deadline, chat_id, int(message.poll.id))
 
 
-async def generate_error_message(client: AsyncOpenAI, error: str) -> str:
-    response = await client.chat.completions.create(
-        messages=[{
+async def generate_error_message(client: LLMClient, error: str, chat_id: int | None = None) -> str:
+    response = await client.complete(
+        [{
             'role': 'system',
             'content': f'Un utente ha provato a rompere l\'applicativo nel seguente modo: {error}. Sgridalo in modo ridicolo e fagli capire l\'errore. Accusalo in modo esagerato di razzismo, fascimo, misoginia o simili.',
         }],
-        model="gpt-3.5-turbo-0125",
+        chat_id=chat_id,
     )
 
     return response.choices[0].message.content
 
 
-async def generate_poll_message(client: AsyncOpenAI, result: str, feedback: str) -> str:
-    response = await client.chat.completions.create(
-        messages=[{
-            'role': 'system',
-            'content': f'Lo stato di chiusura del sondaggio è andato così: {result}. Questi sono i risultati: {feedback}. Riporta il risultato in modo idiota ma preciso.',
-        }],
-        model="gpt-3.5-turbo-0125",
-    )
-
-    return response.choices[0].message.content
+def poll_message_prompt(result: str, feedback: str) -> list[dict]:
+    return [{
+        'role': 'system',
+        'content': f'Lo stato di chiusura del sondaggio è andato così: {result}. Questi sono i risultati: {feedback}. Riporta il risultato in modo idiota ma preciso.',
+    }]
 
 
 async def bet(update: Update, _: CallbackContext) -> None:
@@ -133,27 +293,25 @@ async def bet(update: Update, _: CallbackContext) -> None:
         return
 
     tg_message_id = poll_message.id
-    group = Group(tg_chat_id=tg_chat_id)
+    group = storage.group(tg_chat_id)
     try:
         amount_str = update.effective_message.text.replace('/bet', '').strip()
         if amount_str == 'all-in':
-            amount = group.all_in(update.effective_user.id)
+            amount = await group.all_in(update.effective_user.id)
         else:
             amount = int(amount_str)
     except:
-        await update.message.reply_text(
-            await generate_error_message(AsyncOpenAI(), 'Inserendo un valore non numerico'))
+        await update.message.reply_text(error_messages.get(NON_NUMERIC))
         return
 
     if amount <= 0:
-        await update.message.reply_text(
-            await generate_error_message(AsyncOpenAI(), 'Inserendo un minore o uguale a zero'))
+        await update.message.reply_text(error_messages.get(NON_POSITIVE))
         return
 
     try:
-        tokens_ = group.place_bet(update.effective_user.id, int(tg_message_id), amount)
+        tokens_ = await group.place_bet(update.effective_user.id, int(tg_message_id), amount)
     except BetError as e:
-        await update.message.reply_text(await generate_error_message(AsyncOpenAI(), str(e)))
+        await update.message.reply_text(error_messages.get(e.kind))
     else:
         await update.message.reply_text(
             f'Scommessa piazzata correttamente!'
@@ -163,22 +321,22 @@ async def bet(update: Update, _: CallbackContext) -> None:
 
 async def select_option(update: Update, context: CallbackContext) -> None:
     tg_poll_id = int(update.poll_answer.poll_id)
-    tg_chat_id = poll_handler.get_tg_chat_id(tg_poll_id)
+    tg_chat_id = await storage.polls.get_tg_chat_id(tg_poll_id)
     if tg_chat_id is None:
         return warning(f'Received poll id \'{tg_poll_id}\' with no corresponding group, ignoring')
 
-    group = Group(tg_chat_id=tg_chat_id)
+    group = storage.group(tg_chat_id)
 
     try:
-        group.select_option(
+        await group.select_option(
             update.poll_answer.user.id,
             tg_poll_id,
             update.poll_answer.option_ids[0]
         )
     except BetError:
         await context.bot.send_message(
-            group.group_info['tg_chat_id'],
-            await generate_error_message(AsyncOpenAI(), 'Non piazzando una scommessa prima di selezionare l\'opzione, per l\'ennesima volta'),
+            tg_chat_id,
+            error_messages.get(EARLY_ANSWER),
         )
 
 
@@ -192,11 +350,71 @@ async def close(update: Update, _: CallbackContext) -> None:
         await update.message.reply_text('Please select a poll.')
         return
 
-    group = Group(tg_chat_id=tg_chat_id)
+    group = storage.group(tg_chat_id)
     tg_poll_id = int(poll_message.poll.id)
     # await context.bot.stop_poll(tg_chat_id, poll_message.id)
-    result, message = group.close_poll(tg_poll_id, int(correct_option_index))
+    result, message = await group.close_poll(tg_poll_id, int(correct_option_index))
 
+    msg = format_results(result)
+    header = msg or message
+    reply = await update.message.reply_text(header)
+    stream_results(reply, header, result, msg, tg_chat_id)
+
+
+async def resolve(update: Update, _: CallbackContext) -> None:
+    poll_message = update.effective_message.reply_to_message
+    if poll_message is None:
+        await update.message.reply_text('Per favore seleziona un sondaggio.')
+        return
+
+    try:
+        tg_index = int(update.effective_message.text.replace('/resolve', '').strip())
+    except ValueError:
+        await update.message.reply_text(error_messages.get(NON_NUMERIC))
+        return
+
+    group = storage.group(update.effective_chat.id)
+    if await group.set_resolution(poll_message.id, tg_index):
+        await update.message.reply_text(f'Il sondaggio verrà chiuso alla scadenza con l\'opzione {tg_index}.')
+    else:
+        await update.message.reply_text('Questo sondaggio non ha una scadenza o è già chiuso.')
+
+
+async def expire_poll(bot: Bot, tg_chat_id: int, tg_poll_id: int) -> None:
+    group = storage.group(tg_chat_id)
+    expired = await group.expire_poll(tg_poll_id)
+    if expired is None:
+        return
+
+    tg_message_id, resolution = expired
+    try:
+        await bot.stop_poll(tg_chat_id, tg_message_id)
+    except TelegramError as e:
+        warning(f'Could not stop poll {tg_poll_id} in group {tg_chat_id}: {e}')
+
+    if resolution is None:
+        await bot.send_message(tg_chat_id, 'Tempo scaduto! Chiudi il sondaggio con /close <opzione>.',
+                               reply_to_message_id=tg_message_id)
+        return
+
+    result, message = await group.close_poll(tg_poll_id, resolution)
+    msg = format_results(result)
+    header = msg or message
+    reply = await bot.send_message(tg_chat_id, header, reply_to_message_id=tg_message_id)
+    stream_results(reply, header, result, msg, tg_chat_id)
+
+
+def stream_results(reply: Message, header: str, result: list[BetResult], msg: str, tg_chat_id: int) -> None:
+    streams.start(stream_into(
+        reply,
+        header,
+        llm.stream(poll_message_prompt(result, msg), chat_id=tg_chat_id),
+        interval=CLOSE_EDIT_INTERVAL,
+        timeout=CLOSE_STREAM_TIMEOUT,
+    ))
+
+
+def format_results(result: list[BetResult]) -> str:
     msg = ''
     for res in result:
         win = res['win']
@@ -204,40 +422,182 @@ async def close(update: Update, _: CallbackContext) -> None:
         verb = 'ha vinto' if res['win'] > 0 else 'ha perso'
         msg += f'{res["member_name"]} {verb} {math.fabs(win):0} token. {tk} tokens rimanenti.\n'
 
-    await update.message.reply_text(await generate_poll_message(AsyncOpenAI(), result, msg))
+    return msg
 
 
 async def instructions(update: Update, _) -> None:
     await update.message.reply_text(
         '/create create a new group\n'
         '/tokens print the amount of tokens in your possession\n'
+        '/leaderboard print the members with the highest net winnings\n'
         '/suggest <suggerimento> create new poll suggestion\n'
-        '/generate generate a new poll\n'
+        '/generate generate a new poll, optionally ending with @<n>m|h|d to set a deadline\n'
+        '/resolve <opzione> set the option a poll with a deadline will be closed with\n'
         '/bet <quantità> place a bet on a given poll\n'
         '/close close the given poll'
     )
 
 
+async def resolve_chat(update: object) -> int | None:
+    if not isinstance(update, Update):
+        return None
+
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+
+    if update.poll_answer is not None:
+        return await storage.polls.get_tg_chat_id(int(update.poll_answer.poll_id))
+
+    return None
+
+
+async def startup(app: Application) -> None:
+    await metrics_server.start()
+    await recover_groups()
+    scheduler.on_expire = functools.partial(expire_poll, app.bot)
+    scheduler.start()
+    error_messages.start()
+    poll_generator.start()
+    sweeper.start()
+    if checkpointer is not None:
+        checkpointer.start()
+    if backups is not None:
+        os.makedirs(BACKUP_PATH, exist_ok=True)
+        backups.start()
+    if compactor is not None:
+        compactor.start()
+
+    if storage.selections is not None:
+        async def selection_failed(tg_chat_id: int, _: int, __: BetError) -> None:
+            await app.bot.send_message(tg_chat_id, error_messages.get(EARLY_ANSWER))
+
+        storage.selections.on_error = selection_failed
+        storage.selections.start()
+
+
+async def recover_groups() -> None:
+    async def recover(tg_chat_id: int) -> None:
+        group = storage.group(tg_chat_id)
+
+        repaired = await group.check_ledger()
+        if repaired:
+            warning(f'Repaired {repaired} token balances from the ledger in group {tg_chat_id}')
+
+        for tg_poll_id, deadline in await group.pending_deadlines():
+            scheduler.schedule(deadline, tg_chat_id, tg_poll_id)
+
+    tg_chat_ids = await owned_groups()
+    results = await asyncio.gather(*(recover(tg_chat_id) for tg_chat_id in tg_chat_ids), return_exceptions=True)
+    for tg_chat_id, result in zip(tg_chat_ids, results):
+        if isinstance(result, Exception):
+            warning(f'Could not recover group {tg_chat_id}: {result!r}')
+
+
+async def owned_groups() -> list[int]:
+    return [
+        tg_chat_id for tg_chat_id in await asyncio.to_thread(backend.list_groups)
+        if shard_of(tg_chat_id, SHARD_COUNT) == SHARD_INDEX
+    ]
+
+
+async def shutdown(_: Application) -> None:
+    await scheduler.stop()
+    if compactor is not None:
+        await compactor.stop()
+    await streams.stop()
+    await error_messages.stop()
+    await poll_generator.stop()
+    if storage.selections is not None:
+        await storage.selections.stop()
+    await sweeper.stop()
+    if checkpointer is not None:
+        await checkpointer.stop()
+    if backups is not None:
+        await backups.stop()
+    await llm.close()
+    storage.close()
+    backend.close()
+    await metrics_server.stop()
+
+
+def instrumented(handler):
+    return instrument_handler(handler.__name__, handler, resolve_chat)
+
+
+def build_application(updater: bool = True, request: BaseRequest | None = None) -> Application:
+    builder = (Application.builder()
+               .token(BOT_TOKEN)
+               .concurrent_updates(ChatOrderedUpdateProcessor(resolve_chat, UPDATE_WORKERS))
+               .post_init(startup)
+               .post_shutdown(shutdown))
+    if not updater:
+        builder = builder.updater(None)
+    if request is not None:
+        builder = builder.request(request)
+
+    app = builder.build()
+
+    app.add_handler(CommandHandler('help', instrumented(instructions)))
+    app.add_handler(CommandHandler('create', instrumented(create)))
+    app.add_handler(CommandHandler('tokens', instrumented(tokens)))
+    app.add_handler(CommandHandler('leaderboard', instrumented(leaderboard)))
+    app.add_handler(CommandHandler('suggest', instrumented(suggest)))
+    app.add_handler(CommandHandler('generate', instrumented(generate)))
+    app.add_handler(CommandHandler('bet', instrumented(bet)))
+
+    app.add_handler(CommandHandler('close', instrumented(close)))
+    app.add_handler(CommandHandler('resolve', instrumented(resolve)))
+
+    app.add_handler(PollAnswerHandler(instrumented(select_option)))
+
+    app.add_handler(CallbackQueryHandler(instrumented(join), 'join'))
+
+    return app
+
+
+async def run_front() -> None:
+    router = ShardRouter(SHARD_WORKERS, storage.polls.get_tg_chat_id, SHARD_STOP_TIMEOUT)
+    incoming = asyncio.Queue()
+    server = WebhookServer(
+        incoming, lambda data: data, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH,
+        max_pending=WEBHOOK_MAX_PENDING, backlog=router.backlog,
+    ) if WEBHOOK_URL else None
+
+    await metrics_server.start()
+    if backups is not None:
+        os.makedirs(BACKUP_PATH, exist_ok=True)
+        backups.start()
+    try:
+        await run_sharded(Application.builder().token(BOT_TOKEN).updater(None).build(), router, incoming,
+                          server, WEBHOOK_URL)
+    finally:
+        if backups is not None:
+            await backups.stop()
+        await metrics_server.stop()
+        storage.close()
+        backend.close()
+
+
 def main():
     # todo: validate data path
     # todo: error handler
 
-    app = Application.builder().token(BOT_TOKEN).build()
+    if WEBHOOK_URL and WEBHOOK_SECRET == '':
+        raise ValueError('WEBHOOK_SECRET is required in webhook mode')
 
-    app.add_handler(CommandHandler('help', instructions))
-    app.add_handler(CommandHandler('create', create))
-    app.add_handler(CommandHandler('tokens', tokens))
-    app.add_handler(CommandHandler('suggest', suggest))
-    app.add_handler(CommandHandler('generate', generate))
-    app.add_handler(CommandHandler('bet', bet))
+    configure()
 
-    app.add_handler(CommandHandler('close', close))
-
-    app.add_handler(PollAnswerHandler(select_option))
+    if SHARD_WORKERS > 0:
+        asyncio.run(run_front())
+        return
 
-    app.add_handler(CallbackQueryHandler(join, 'join'))
+    app = build_application(updater=not WEBHOOK_URL)
 
-    app.run_polling()
+    if WEBHOOK_URL:
+        asyncio.run(run_webhook(
+            app, WEBHOOK_URL, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_MAX_PENDING))
+    else:
+        app.run_polling()
 
 
 if __name__ == "__main__":
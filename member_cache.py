@@ -0,0 +1,77 @@
+from collections import OrderedDict
+from typing import NamedTuple
+
+from metrics import metrics
+
+
+class CachedMember(NamedTuple):
+    member_id: int
+    name: str
+    tokens: int
+
+
+class MemberCache:
+    def __init__(self, max_size: int = 1024):
+        if max_size < 1:
+            raise ValueError('max_size must be at least 1')
+
+        self.max_size = max_size
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._members: OrderedDict[int, CachedMember] = OrderedDict()
+        self._tg_ids: dict[int, int] = {}
+
+    def get(self, tg_id: int) -> CachedMember | None:
+        member = self._members.get(tg_id)
+        if member is None:
+            self.misses += 1
+            metrics.inc('member_cache_misses_total')
+            return None
+
+        self.hits += 1
+        metrics.inc('member_cache_hits_total')
+        self._members.move_to_end(tg_id)
+
+        return member
+
+    def put(self, tg_id: int, member: CachedMember) -> None:
+        self._members[tg_id] = member
+        self._members.move_to_end(tg_id)
+        self._tg_ids[member.member_id] = tg_id
+
+        while len(self._members) > self.max_size:
+            _, evicted = self._members.popitem(last=False)
+            del self._tg_ids[evicted.member_id]
+            self.evictions += 1
+            metrics.inc('member_cache_evictions_total')
+
+    def adjust(self, member_id: int, delta: int) -> None:
+        tg_id = self._tg_ids.get(member_id)
+        if tg_id is not None:
+            self._members[tg_id] = self._members[tg_id]._replace(tokens=self._members[tg_id].tokens + delta)
+
+    def discard(self, tg_id: int) -> None:
+        member = self._members.pop(tg_id, None)
+        if member is not None:
+            del self._tg_ids[member.member_id]
+
+    def clear(self) -> None:
+        self._members.clear()
+        self._tg_ids.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+
+        return {
+            'size': len(self._members),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+    def __len__(self) -> int:
+        return len(self._members)
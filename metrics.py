@@ -0,0 +1,270 @@
+import asyncio
+import re
+import sqlite3
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from functools import lru_cache, wraps
+from logging import info
+from threading import Lock
+from typing import Any, Awaitable, Callable
+
+from tasks import cancel_task
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+current_handler: ContextVar[str] = ContextVar('current_handler', default='')
+
+Labels = tuple[tuple[str, str], ...]
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    def __init__(self, namespace: str = 'druntoken', max_chats: int = 100):
+        self.namespace = namespace
+        self.max_chats = max_chats
+
+        self._chats: set[str] = set()
+        self._histograms: dict[str, dict[Labels, Histogram]] = {}
+        self._counters: dict[str, dict[Labels, float]] = {}
+        self._gauges: dict[str, dict[Labels, float]] = {}
+        self._lock = Lock()
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name: str, amount: float = 1, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def chat_label(self, tg_chat_id: int | None) -> str:
+        if tg_chat_id is None:
+            return ''
+
+        chat = str(tg_chat_id)
+        with self._lock:
+            if chat in self._chats:
+                return chat
+            if len(self._chats) < self.max_chats:
+                self._chats.add(chat)
+                return chat
+
+        return 'other'
+
+    def set(self, name: str, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._gauges.setdefault(name, {})[key] = value
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._histograms.items()):
+                metric = f'{self.namespace}_{name}'
+                lines.append(f'# TYPE {metric} histogram')
+                for labels, histogram in series.items():
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + (float('inf'),), histogram.counts):
+                        cumulative += count
+                        le = '+Inf' if bound == float('inf') else repr(bound)
+                        lines.append(f'{metric}_bucket{_format(labels + (("le", le),))} {cumulative}')
+                    lines.append(f'{metric}_sum{_format(labels)} {histogram.sum}')
+                    lines.append(f'{metric}_count{_format(labels)} {histogram.count}')
+
+            for kind, families in (('counter', self._counters), ('gauge', self._gauges)):
+                for name, series in sorted(families.items()):
+                    metric = f'{self.namespace}_{name}'
+                    lines.append(f'# TYPE {metric} {kind}')
+                    for labels, value in series.items():
+                        lines.append(f'{metric}{_format(labels)} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+    def summary(self, name: str, by: str) -> dict[str, tuple[int, float]]:
+        totals: dict[str, list] = {}
+        with self._lock:
+            for labels, histogram in self._histograms.get(name, {}).items():
+                total = totals.setdefault(dict(labels).get(by, ''), [0, 0.0])
+                total[0] += histogram.count
+                total[1] += histogram.sum
+
+        return {key: (count, total / count if count else 0.0) for key, (count, total) in totals.items()}
+
+    def counter_totals(self, name: str, by: str) -> dict[str, float]:
+        totals: dict[str, float] = {}
+        with self._lock:
+            for labels, value in self._counters.get(name, {}).items():
+                key = dict(labels).get(by, '')
+                totals[key] = totals.get(key, 0) + value
+
+        return totals
+
+
+def _format(labels: Labels) -> str:
+    if not labels:
+        return ''
+
+    escaped = (f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+               for name, value in labels)
+
+    return '{' + ','.join(escaped) + '}'
+
+
+metrics = Metrics()
+
+
+def context_labels() -> dict[str, str]:
+    return {'handler': current_handler.get()}
+
+
+def instrument_handler(
+        name: str,
+        handler: Callable[..., Awaitable[Any]],
+        resolve_chat: Callable[[Any], Awaitable[int | None]],
+) -> Callable[..., Awaitable[Any]]:
+    @wraps(handler)
+    async def instrumented(update, context):
+        tg_chat_id = await resolve_chat(update)
+        handler_token = current_handler.set(name)
+        chat = metrics.chat_label(tg_chat_id)
+        start = time.perf_counter()
+        try:
+            return await handler(update, context)
+        except Exception:
+            metrics.inc('handler_errors_total', chat=chat, **context_labels())
+            raise
+        finally:
+            metrics.observe('handler_seconds', time.perf_counter() - start, chat=chat, **context_labels())
+            current_handler.reset(handler_token)
+
+    return instrumented
+
+
+_operation = re.compile(r'\b(?:FROM|INTO|UPDATE|JOIN|TABLE|ON)\s+(?:IF NOT EXISTS\s+)?(\w+)', re.IGNORECASE)
+
+
+@lru_cache(maxsize=512)
+def sql_operation(sql: str) -> str:
+    verb = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ''
+    table = _operation.search(sql)
+
+    return f'{verb} {table.group(1)}' if table is not None and verb != 'PRAGMA' else verb
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    def execute(self, sql: str, parameters=()):
+        return _timed_sql(sql, super().execute, sql, parameters)
+
+    def executemany(self, sql: str, seq_of_parameters):
+        return _timed_sql(sql, super().executemany, sql, seq_of_parameters)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql: str, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql: str, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def _timed_sql(sql: str, execute: Callable, *args):
+    start = time.perf_counter()
+    try:
+        return execute(*args)
+    except sqlite3.Error:
+        metrics.inc('sql_errors_total', operation=sql_operation(sql), **context_labels())
+        raise
+    finally:
+        metrics.observe('sql_seconds', time.perf_counter() - start, operation=sql_operation(sql), **context_labels())
+
+
+class MetricsServer:
+    def __init__(self, host: str = '127.0.0.1', port: int = 9464, log_interval: float = 300):
+        self.host = host
+        self.port = port
+        self.log_interval = log_interval
+
+        self._server: asyncio.AbstractServer | None = None
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        if self.port:
+            self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        if self.log_interval:
+            self._task = asyncio.create_task(self._log_summaries())
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+        await cancel_task(self._task)
+        self._task = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line = await reader.readline()
+            while await reader.readline() not in (b'\r\n', b'\n', b''):
+                pass
+
+            if request_line.split(b' ')[1:2] == [b'/metrics']:
+                body = metrics.render().encode()
+                status = '200 OK'
+            else:
+                body = b''
+                status = '404 Not Found'
+
+            writer.write(f'HTTP/1.1 {status}\r\n'
+                         f'Content-Type: text/plain; version=0.0.4\r\n'
+                         f'Content-Length: {len(body)}\r\n'
+                         f'Connection: close\r\n\r\n'.encode() + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _log_summaries(self) -> None:
+        while True:
+            await asyncio.sleep(self.log_interval)
+
+            errors = metrics.counter_totals('handler_errors_total', 'handler')
+            for handler, (count, mean) in sorted(metrics.summary('handler_seconds', 'handler').items()):
+                info(f'handler {handler}: {count} calls, {mean * 1000:.1f}ms avg, {errors.get(handler, 0):.0f} errors')
+
+            sql_count, sql_mean = _total(metrics.summary('sql_seconds', 'handler'))
+            llm_count, llm_mean = _total(metrics.summary('llm_seconds', 'handler'))
+            llm_tokens = sum(metrics.counter_totals('llm_tokens_total', 'handler').values())
+            info(f'sql: {sql_count} statements, {sql_mean * 1000:.2f}ms avg; '
+                 f'llm: {llm_count} calls, {llm_mean * 1000:.0f}ms avg, {llm_tokens:.0f} tokens')
+
+
+def _total(summary: dict[str, tuple[int, float]]) -> tuple[int, float]:
+    count = sum(c for c, _ in summary.values())
+    total = sum(c * mean for c, mean in summary.values())
+
+    return count, total / count if count else 0.0
@@ -0,0 +1,101 @@
+import argparse
+from sqlite3 import Connection
+
+from backends import FileBackend, MultiTenantBackend
+from database import transaction
+from group import Group
+
+TABLES: dict[str, dict[str, str]] = {
+    'members': {'checkpoint_ledger_id': 'ledger'},
+    'suggestions': {},
+    'polls': {},
+    'poll_options': {'poll_id': 'polls'},
+    'bets': {'member_id': 'members', 'poll_id': 'polls', 'poll_option_id': 'poll_options'},
+    'member_stats': {'member_id': 'members'},
+    'ledger': {'member_id': 'members', 'poll_id': 'polls'},
+    'archived_polls': {},
+    'archived_poll_options': {'poll_id': 'polls'},
+    'archived_bets': {'member_id': 'members', 'poll_id': 'polls', 'poll_option_id': 'poll_options'},
+}
+
+# archived rows keep their original ids, so they share the id offset of the live table
+ID_SPACES: dict[str, str] = {
+    'archived_polls': 'polls',
+    'archived_poll_options': 'poll_options',
+    'archived_bets': 'bets',
+}
+
+
+def copy_group(source: Group, target: Connection) -> int:
+    with transaction(target):
+        cursor = target.execute(
+            'INSERT INTO group_info (tg_id, description) VALUES (?, ?)',
+            (source.group_info['tg_chat_id'], source.group_info['description'])
+        )
+        group_id = cursor.lastrowid
+
+        offsets: dict[str, int] = {}
+        for table in TABLES:
+            space = ID_SPACES.get(table, table)
+            offsets[space] = max(
+                offsets.get(space, 0),
+                target.execute(f'SELECT COALESCE(MAX(id), 0) FROM {table}').fetchone()[0],
+            )
+
+        for table, references in TABLES.items():
+            source_columns = {row[1] for row in source.connection.execute(f'PRAGMA table_info({table})')}
+            target_columns = [row[1] for row in target.execute(f'PRAGMA table_info({table})')]
+            columns = [column for column in target_columns if column in source_columns]
+
+            selected = []
+            params = []
+            for column in columns:
+                if column == 'id':
+                    selected.append('id + ?')
+                    params.append(offsets[ID_SPACES.get(table, table)])
+                elif column == 'group_id':
+                    selected.append('?')
+                    params.append(group_id)
+                elif column in references:
+                    selected.append(f'{column} + ?')
+                    params.append(offsets[references[column]])
+                else:
+                    selected.append(column)
+
+            rows = source.connection.execute(
+                f'SELECT {", ".join(selected)} FROM {table} ORDER BY id', params).fetchall()
+            target.executemany(
+                f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})',
+                rows
+            )
+
+    return group_id
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Copy per-chat group databases into a multi-tenant database.')
+    parser.add_argument('data_path', help='directory holding the {tg_chat_id}.db files')
+    parser.add_argument('--target', default='groups.db', help='multi-tenant database file name inside data_path')
+    args = parser.parse_args()
+
+    source = FileBackend(args.data_path)
+    target = MultiTenantBackend(args.data_path, filename=args.target)
+    Group.backend = source
+
+    existing = set(target.list_groups())
+
+    for tg_chat_id in source.list_groups():
+        if tg_chat_id in existing:
+            print(f'{tg_chat_id}: already migrated, skipping')
+            continue
+
+        group = Group(tg_chat_id)
+        group_id = copy_group(group, target.connection())
+        group.close()
+        print(f'{tg_chat_id}: copied as group {group_id}')
+
+    target.close()
+
+
+if __name__ == '__main__':
+    main()
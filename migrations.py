@@ -0,0 +1,237 @@
+import time
+from logging import warning
+from sqlite3 import Connection
+from typing import Callable
+
+from database import transaction
+from suggestions import normalize
+
+Migration = Callable[[Connection], None]
+
+
+def migrate(connection: Connection, migrations: list[Migration]) -> int:
+    target = len(migrations)
+    if schema_version(connection) >= target:
+        return target
+
+    with transaction(connection):
+        version = schema_version(connection)
+        for migration in migrations[version:]:
+            migration(connection)
+        connection.execute(f'PRAGMA user_version = {max(version, target)}')
+
+    return target
+
+
+def schema_version(connection: Connection) -> int:
+    return connection.execute('PRAGMA user_version').fetchone()[0]
+
+
+def create_schema(connection: Connection) -> None:
+    connection.execute('CREATE TABLE IF NOT EXISTS group_info ('
+                       'id INTEGER PRIMARY KEY,'
+                       'description TEXT,'
+                       'tg_id INTEGER)')
+    connection.execute('CREATE TABLE IF NOT EXISTS members('
+                       'id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,'
+                       'tg_id INTEGER NOT NULL,'
+                       'name TEXT,'
+                       'tokens INTEGER NOT NULL)')
+    connection.execute('CREATE TABLE IF NOT EXISTS suggestions('
+                       'id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,'
+                       'text TEXT NOT NULL)')
+    connection.execute('CREATE TABLE IF NOT EXISTS polls('
+                       'id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,'
+                       'tg_poll_id INTEGER NOT NULL,'
+                       'tg_message_id INTEGER NOT NULL,'
+                       'text TEXT NOT NULL,'
+                       'open TINYINT NOT NULL DEFAULT 1)')
+    connection.execute('CREATE TABLE IF NOT EXISTS poll_options('
+                       'id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,'
+                       'tg_index INTEGER NOT NULL,'
+                       'text TEXT NOT NULL,'
+                       'rating INTEGER NOT NULL,'
+                       'poll_id INTEGER NOT NULL,'
+                       'FOREIGN KEY (poll_id) REFERENCES polls(id))')
+    connection.execute('CREATE TABLE IF NOT EXISTS bets('
+                       'id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,'
+                       'amount INTEGER NOT NULL,'
+                       'open TINYINT NOT NULL DEFAULT 1,'
+                       'member_id INTEGER NOT NULL,'
+                       'poll_id INTEGER NOT NULL,'
+                       'poll_option_id INTEGER NULLABLE,'
+                       'FOREIGN KEY (member_id) REFERENCES members(id),'
+                       'FOREIGN KEY (poll_id) REFERENCES polls(id),'
+                       'FOREIGN KEY (poll_option_id) REFERENCES poll_options(id))')
+
+
+def _group_hot_path_indexes(connection: Connection) -> None:
+    connection.execute(
+        'UPDATE bets SET member_id = ('
+        '  SELECT MIN(m2.id) FROM members m1 JOIN members m2 ON m1.tg_id = m2.tg_id WHERE m1.id = bets.member_id'
+        ') WHERE member_id IN (SELECT id FROM members) '
+        'AND member_id NOT IN (SELECT MIN(id) FROM members GROUP BY tg_id)')
+    members = connection.execute(
+        'DELETE FROM members WHERE id NOT IN (SELECT MIN(id) FROM members GROUP BY tg_id)'
+    ).rowcount
+
+    # a member betting twice on a poll paid both stakes, so they are merged into the first bet
+    connection.execute(
+        'UPDATE bets SET '
+        'amount = (SELECT SUM(b.amount) FROM bets b WHERE b.member_id = bets.member_id AND b.poll_id = bets.poll_id),'
+        'poll_option_id = COALESCE(poll_option_id, ('
+        '  SELECT b.poll_option_id FROM bets b WHERE b.member_id = bets.member_id AND b.poll_id = bets.poll_id '
+        '  AND b.poll_option_id IS NOT NULL ORDER BY b.id LIMIT 1'
+        ')) '
+        'WHERE id IN (SELECT MIN(id) FROM bets GROUP BY member_id, poll_id HAVING COUNT(*) > 1)')
+    bets = connection.execute(
+        'DELETE FROM bets WHERE id NOT IN (SELECT MIN(id) FROM bets GROUP BY member_id, poll_id)'
+    ).rowcount
+
+    if members or bets:
+        warning(f'Removed {members} duplicate members and merged {bets} duplicate bets')
+
+    connection.execute('CREATE UNIQUE INDEX IF NOT EXISTS members_tg_id ON members(tg_id)')
+    connection.execute('CREATE INDEX IF NOT EXISTS polls_tg_message_id ON polls(tg_message_id)')
+    connection.execute('CREATE INDEX IF NOT EXISTS polls_tg_poll_id ON polls(tg_poll_id)')
+    connection.execute('CREATE UNIQUE INDEX IF NOT EXISTS bets_member_poll ON bets(member_id, poll_id)')
+    connection.execute('CREATE INDEX IF NOT EXISTS bets_poll ON bets(poll_id)')
+    connection.execute('CREATE INDEX IF NOT EXISTS poll_options_poll_tg_index ON poll_options(poll_id, tg_index)')
+
+
+def _suggestion_usage(connection: Connection) -> None:
+    connection.execute('ALTER TABLE suggestions ADD COLUMN normalized TEXT')
+    connection.execute('ALTER TABLE suggestions ADD COLUMN uses INTEGER NOT NULL DEFAULT 0')
+    connection.execute('ALTER TABLE suggestions ADD COLUMN last_used_at INTEGER')
+
+    connection.executemany(
+        'UPDATE suggestions SET normalized = ? WHERE id = ?',
+        [(normalize(text), id_) for id_, text in connection.execute('SELECT id, text FROM suggestions')]
+    )
+    connection.execute('DELETE FROM suggestions WHERE id NOT IN (SELECT MIN(id) FROM suggestions GROUP BY normalized)')
+
+    connection.execute('CREATE UNIQUE INDEX IF NOT EXISTS suggestions_normalized ON suggestions(normalized)')
+    connection.execute('CREATE INDEX IF NOT EXISTS suggestions_uses ON suggestions(uses, id)')
+
+
+def _group_tenant_keys(connection: Connection) -> None:
+    for table in ('members', 'suggestions', 'polls'):
+        connection.execute(f'ALTER TABLE {table} ADD COLUMN group_id INTEGER NOT NULL DEFAULT 0')
+
+    for index in ('members_tg_id', 'polls_tg_message_id', 'polls_tg_poll_id',
+                  'suggestions_normalized', 'suggestions_uses'):
+        connection.execute(f'DROP INDEX IF EXISTS {index}')
+
+    connection.execute('CREATE UNIQUE INDEX IF NOT EXISTS group_info_tg_id ON group_info(tg_id)')
+    connection.execute('CREATE UNIQUE INDEX IF NOT EXISTS members_group_tg_id ON members(group_id, tg_id)')
+    connection.execute('CREATE INDEX IF NOT EXISTS polls_group_tg_message_id ON polls(group_id, tg_message_id)')
+    connection.execute('CREATE INDEX IF NOT EXISTS polls_group_tg_poll_id ON polls(group_id, tg_poll_id)')
+    connection.execute(
+        'CREATE UNIQUE INDEX IF NOT EXISTS suggestions_group_normalized ON suggestions(group_id, normalized)')
+    connection.execute('CREATE INDEX IF NOT EXISTS suggestions_group_uses ON suggestions(group_id, uses, id)')
+
+
+def _member_stats(connection: Connection) -> None:
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS member_stats ('
+        'id INTEGER PRIMARY KEY, '
+        'group_id INTEGER NOT NULL, '
+        'member_id INTEGER NOT NULL UNIQUE REFERENCES members(id), '
+        'played INTEGER NOT NULL DEFAULT 0, '
+        'won INTEGER NOT NULL DEFAULT 0, '
+        'lost INTEGER NOT NULL DEFAULT 0, '
+        'net INTEGER NOT NULL DEFAULT 0, '
+        'biggest_win INTEGER NOT NULL DEFAULT 0, '
+        'streak INTEGER NOT NULL DEFAULT 0)'
+    )
+    connection.execute('CREATE INDEX IF NOT EXISTS member_stats_group_net ON member_stats(group_id, net DESC, id)')
+
+
+def _poll_deadlines(connection: Connection) -> None:
+    for column in ('deadline', 'resolution', 'stopped_at', 'closed_at'):
+        connection.execute(f'ALTER TABLE polls ADD COLUMN {column} INTEGER')
+
+    connection.execute('CREATE INDEX IF NOT EXISTS polls_group_deadline ON polls(group_id, deadline) '
+                       'WHERE deadline IS NOT NULL AND stopped_at IS NULL AND closed_at IS NULL')
+
+
+def _token_ledger(connection: Connection) -> None:
+    now = int(time.time())
+
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS ledger ('
+        'id INTEGER PRIMARY KEY, '
+        'group_id INTEGER NOT NULL, '
+        'member_id INTEGER NOT NULL REFERENCES members(id), '
+        'poll_id INTEGER REFERENCES polls(id), '
+        'kind TEXT NOT NULL, '
+        'amount INTEGER NOT NULL, '
+        'created_at INTEGER NOT NULL)'
+    )
+    connection.execute('CREATE INDEX IF NOT EXISTS ledger_member ON ledger(member_id, id)')
+    connection.execute('ALTER TABLE members ADD COLUMN checkpoint_tokens INTEGER NOT NULL DEFAULT 0')
+    connection.execute('ALTER TABLE members ADD COLUMN checkpoint_ledger_id INTEGER NOT NULL DEFAULT 0')
+
+    connection.execute(
+        'INSERT INTO ledger (group_id, member_id, kind, amount, created_at) '
+        'SELECT group_id, id, \'opening\', tokens, ? FROM members ORDER BY id',
+        (now,)
+    )
+    connection.execute(
+        'INSERT INTO ledger (group_id, member_id, poll_id, kind, amount, created_at) '
+        'SELECT members.group_id, bets.member_id, bets.poll_id, \'reserve\', -bets.amount, ? '
+        'FROM bets JOIN members ON bets.member_id = members.id '
+        'WHERE bets.open = 1 ORDER BY bets.id',
+        (now,)
+    )
+    connection.execute(
+        'UPDATE members SET tokens = tokens - '
+        '(SELECT COALESCE(SUM(amount), 0) FROM bets WHERE bets.member_id = members.id AND bets.open = 1)'
+    )
+    connection.execute(
+        'UPDATE members SET checkpoint_tokens = tokens, '
+        'checkpoint_ledger_id = (SELECT COALESCE(MAX(id), 0) FROM ledger)'
+    )
+
+
+def _poll_archive(connection: Connection) -> None:
+    for table in ('polls', 'poll_options', 'bets'):
+        connection.execute(f'CREATE TABLE IF NOT EXISTS archived_{table} AS SELECT * FROM {table} WHERE 0')
+
+    connection.execute('CREATE INDEX IF NOT EXISTS polls_group_closed_at ON polls(group_id, closed_at) '
+                       'WHERE closed_at IS NOT NULL')
+
+
+def _settled_polls(connection: Connection) -> None:
+    connection.execute(
+        'UPDATE polls SET closed_at = ? '
+        'WHERE closed_at IS NULL '
+        'AND EXISTS (SELECT 1 FROM bets WHERE bets.poll_id = polls.id) '
+        'AND NOT EXISTS (SELECT 1 FROM bets WHERE bets.poll_id = polls.id AND bets.open = 1)',
+        (int(time.time()),)
+    )
+
+
+def _poll_routes(connection: Connection) -> None:
+    connection.execute('CREATE INDEX IF NOT EXISTS polls_tg_poll_id ON polls(tg_poll_id)')
+
+
+def _poll_tg_poll_id_index(connection: Connection) -> None:
+    connection.execute('CREATE INDEX IF NOT EXISTS polls_tg_poll_id ON polls(tg_poll_id)')
+
+
+GROUP_MIGRATIONS: list[Migration] = [
+    _group_hot_path_indexes,
+    _suggestion_usage,
+    _group_tenant_keys,
+    _member_stats,
+    _poll_deadlines,
+    _token_ledger,
+    _poll_archive,
+    _settled_polls,
+    _poll_routes,
+]
+
+POLL_MIGRATIONS: list[Migration] = [
+    _poll_tg_poll_id_index,
+]
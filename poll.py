@@ -1,31 +1,106 @@
-from os import path
-from sqlite3 import connect
-from typing import Optional
+from collections import OrderedDict
+from threading import Lock
+from typing import TYPE_CHECKING, Optional
+
+from database import incremental_vacuum
+from migrations import POLL_MIGRATIONS, migrate
+
+if TYPE_CHECKING:
+    from backends import StorageBackend
 
 
 class Poll:
-    data_path: str
+    backend: 'StorageBackend'
+
+    def __init__(self, max_routes: int = 10000):
+        self.connection = Poll.backend.open_polls()
+        self.in_groups = Poll.backend.polls_in_groups
+        if not self.in_groups:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS polls('
+                                    'id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,'
+                                    'tg_poll_id INTEGER NOT NULL,'
+                                    'tg_chat_id INTEGER NOT NULL)')
+            self.connection.commit()
+            migrate(self.connection, POLL_MIGRATIONS)
 
-    def __init__(self):
-        self.connection = connect(path.join(Poll.data_path, 'polls.db'))
-        self.connection.execute('CREATE TABLE IF NOT EXISTS polls('
-                                'id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,'
-                                'tg_poll_id INTEGER NOT NULL,'
-                                'tg_chat_id INTEGER NOT NULL)')
-        self.connection.commit()
+        self.max_routes = max_routes
+        self._routes: OrderedDict[int, int] = OrderedDict()
+        self._routes_lock = Lock()
+        self._warm_routes()
 
     def store(self, tg_poll_id: int, tg_chat_id: int) -> None:
-        self.connection.execute(
-            'INSERT INTO polls (tg_poll_id, tg_chat_id) VALUES (?, ?)',
-            (tg_poll_id, tg_chat_id)
-        )
-        self.connection.commit()
+        if not self.in_groups:
+            self.connection.execute(
+                'INSERT INTO polls (tg_poll_id, tg_chat_id) VALUES (?, ?)',
+                (tg_poll_id, tg_chat_id)
+            )
+            self.connection.commit()
+        self._remember(tg_poll_id, tg_chat_id)
 
     def get_tg_chat_id(self, tg_poll_id: int) -> Optional[int]:
-        res = self.connection.execute(
-            'SELECT tg_chat_id FROM polls WHERE tg_poll_id=?',
-            (tg_poll_id,)
-        ).fetchone()
+        tg_chat_id = self.cached_tg_chat_id(tg_poll_id)
+        if tg_chat_id is not None:
+            return tg_chat_id
+
+        res = self.connection.execute(f'SELECT tg_chat_id {self._routes_query()} WHERE tg_poll_id=?',
+                                      (tg_poll_id,)).fetchone()
+
+        if res is None:
+            return None
+
+        self._remember(tg_poll_id, res[0])
+
+        return res[0]
+
+    def prune(self, tg_poll_ids: list[int]) -> int:
+        if self.in_groups:
+            # archiving the group's polls already removed their routes
+            pruned = len(tg_poll_ids)
+        else:
+            cursor = self.connection.executemany('DELETE FROM polls WHERE tg_poll_id = ?', [(i,) for i in tg_poll_ids])
+            self.connection.commit()
+            pruned = cursor.rowcount
+
+        with self._routes_lock:
+            for tg_poll_id in tg_poll_ids:
+                self._routes.pop(tg_poll_id, None)
+
+        return pruned
+
+    def vacuum(self, pages: int = 256) -> int:
+        if self.in_groups:
+            return 0
+
+        return incremental_vacuum(self.connection, pages)
+
+    def cached_tg_chat_id(self, tg_poll_id: int) -> Optional[int]:
+        with self._routes_lock:
+            tg_chat_id = self._routes.get(tg_poll_id)
+            if tg_chat_id is not None:
+                self._routes.move_to_end(tg_poll_id)
+
+        return tg_chat_id
+
+    def _remember(self, tg_poll_id: int, tg_chat_id: int) -> None:
+        with self._routes_lock:
+            self._routes[tg_poll_id] = tg_chat_id
+            self._routes.move_to_end(tg_poll_id)
+            while len(self._routes) > self.max_routes:
+                self._routes.popitem(last=False)
+
+    def _warm_routes(self) -> None:
+        routes = self.connection.execute(
+            f'SELECT tg_poll_id, tg_chat_id {self._routes_query()} ORDER BY id DESC LIMIT ?',
+            (self.max_routes,)
+        ).fetchall()
+
+        with self._routes_lock:
+            for tg_poll_id, tg_chat_id in reversed(routes):
+                self._routes[tg_poll_id] = tg_chat_id
 
-        return res[0] if res is not None else None
+    def _routes_query(self) -> str:
+        if self.in_groups:
+            return ('FROM (SELECT polls.id, polls.tg_poll_id, group_info.tg_id AS tg_chat_id '
+                    'FROM polls JOIN group_info ON group_info.id = polls.group_id)')
 
+        return 'FROM polls'
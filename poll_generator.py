@@ -1,9 +1,15 @@
-import json
-from random import choice
+import asyncio
+import time
+from collections import deque
+from logging import warning
 
-from openai import AsyncOpenAI
-
-from group import Group
+from errors.no_suggestions_error import NoSuggestionsError
+from errors.poll_schema_error import PollSchemaError
+from llm_client import LLMClient
+from metrics import metrics
+from poll_schema import parse_poll
+from storage import AsyncGroup
+from tasks import cancel_task, wait_event
 
 
 class PollGenerator:
@@ -12,17 +18,58 @@ class PollGenerator:
                'Questo è l\'argomento suggerito per il sondaggio: {suggestion}. '
                'Utilizza il suggerimento per formulare un sondaggio creativo. Aggiungi del pepe al suggerimento. '
                'Il sondaggio suggerito dovrebbe essere l\'unico testo che generi. '
+               'Il sondaggio deve avere tra 2 e 10 opzioni. '
                'Il sondaggio deve essere espresso in json, nel formato seguente: {'
-               '"text": "testo del sondaggio", "options": [{"rating": "(numero) in base al rischio del sondaggio", '
+               '"text": "testo del sondaggio", "options": [{"rating": numero in base al rischio del sondaggio, '
                '"text": "Testo dell\'opzione"}]'
                '}')
 
-    def __init__(self, group: Group):
-        self.group = group
+    def __init__(
+            self,
+            llm: LLMClient,
+            queue_size: int = 2,
+            max_concurrency: int = 2,
+            idle_timeout: float = 1800,
+            refill_interval: float = 30,
+            max_attempts: int = 2,
+    ):
+        if max_attempts < 1:
+            raise ValueError('max_attempts must be at least 1')
+
+        self.llm = llm
+        self.max_attempts = max_attempts
+        self.queue_size = queue_size
+        self.idle_timeout = idle_timeout
+        self.refill_interval = refill_interval
+
+        self.prefetch_hits = 0
+        self.prefetch_misses = 0
+        self.validation_failures: dict[str, int] = {}
+        self.repairs: dict[str, int] = {}
 
-    async def generate(self, open_ai: AsyncOpenAI, suggestion: str | None = None, test: bool = False) -> dict:
+        self._queues: dict[int, deque[tuple[int, dict]]] = {}
+        self._groups: dict[int, tuple[AsyncGroup, float]] = {}
+        self._refilling: set[int] = set()
+        # groups without suggestions wait for one to be added instead of retrying every interval
+        self._starved: set[int] = set()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    async def generate(self, group: AsyncGroup, suggestion: str | None = None, test: bool = False) -> dict:
         if suggestion is None:
-            suggestion = choice(self.group.get_suggestions())
+            self._touch(group)
+            queue = self._queues.get(group.tg_chat_id)
+            if queue:
+                self.prefetch_hits += 1
+                suggestion_id, poll = queue.popleft()
+                await group.use_suggestion(suggestion_id)
+                return poll
+
+            self.prefetch_misses += 1
+            suggestion_id, suggestion = await self._sample_suggestion(group)
+            self._starved.discard(group.tg_chat_id)
+            await group.use_suggestion(suggestion_id)
 
         if test:
             return {
@@ -33,19 +80,106 @@ class PollGenerator:
                 ]
             }
 
-        return await self._generate_from_prompt(open_ai, suggestion)
+        return await self._generate_from_prompt(group, suggestion)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        await cancel_task(self._task)
+        self._task = None
+
+    def suggestion_added(self, group: AsyncGroup) -> None:
+        if group.tg_chat_id in self._starved:
+            self._starved.discard(group.tg_chat_id)
+            self._wakeup.set()
+
+    def _touch(self, group: AsyncGroup) -> None:
+        self._groups[group.tg_chat_id] = (group, time.monotonic())
+        self._wakeup.set()
+
+    async def _run(self) -> None:
+        refills: set[asyncio.Task] = set()
+        try:
+            while True:
+                self._wakeup.clear()
+                now = time.monotonic()
+
+                for tg_chat_id, (group, last_used) in list(self._groups.items()):
+                    if now - last_used >= self.idle_timeout:
+                        del self._groups[tg_chat_id]
+                        self._queues.pop(tg_chat_id, None)
+                        self._starved.discard(tg_chat_id)
+                    elif tg_chat_id in self._starved:
+                        continue
+                    elif tg_chat_id not in self._refilling and len(self._queues.get(tg_chat_id, ())) < self.queue_size:
+                        self._refilling.add(tg_chat_id)
+                        task = asyncio.create_task(self._refill(group))
+                        refills.add(task)
+                        task.add_done_callback(refills.discard)
 
-    async def _generate_from_prompt(self, open_ai: AsyncOpenAI, suggestion: str) -> dict:
+                await wait_event(self._wakeup, self.refill_interval)
+        finally:
+            for task in refills:
+                task.cancel()
+
+    async def _refill(self, group: AsyncGroup) -> None:
+        queue = self._queues.setdefault(group.tg_chat_id, deque())
+        try:
+            for _ in range(2 * self.queue_size):
+                if len(queue) >= self.queue_size or group.tg_chat_id not in self._groups:
+                    break
+
+                async with self._semaphore:
+                    # uses are only counted once a prefetched poll is served
+                    suggestion_id, suggestion = await self._sample_suggestion(group, [id_ for id_, _ in queue])
+                    poll = await self._generate_from_prompt(group, suggestion)
+
+                queue.append((suggestion_id, poll))
+        except NoSuggestionsError:
+            self._starved.add(group.tg_chat_id)
+        except Exception as e:
+            warning(f'Could not prefetch poll for group {group.tg_chat_id}: {e}')
+        finally:
+            self._refilling.discard(group.tg_chat_id)
+
+    @staticmethod
+    async def _sample_suggestion(group: AsyncGroup, exclude: list[int] | None = None) -> tuple[int, str]:
+        suggestion = await group.sample_suggestion(exclude or ())
+        if suggestion is None:
+            raise NoSuggestionsError('No suggestions available')
+
+        return suggestion
+
+    async def _generate_from_prompt(self, group: AsyncGroup, suggestion: str) -> dict:
         prompt = self._prompt.replace('{suggestion}', suggestion)
 
-        response = await open_ai.chat.completions.create(
-            messages=[{
-                'role': 'system',
-                'content': prompt,
-            }],
-            model="gpt-3.5-turbo-0125",
-        )
-
-        return (json.decoder
-                .JSONDecoder()
-                .decode(response.choices[0].message.content))
+        for attempt in range(1, self.max_attempts + 1):
+            response = await self.llm.complete(
+                [{
+                    'role': 'system',
+                    'content': prompt,
+                }],
+                chat_id=group.tg_chat_id,
+                response_format={'type': 'json_object'},
+            )
+
+            try:
+                poll, repairs = parse_poll(response.choices[0].message.content or '')
+            except PollSchemaError as e:
+                self._count(self.validation_failures, 'poll_validation_failures_total', e.kind)
+                if attempt == self.max_attempts:
+                    raise
+                warning(f'Generated poll for group {group.tg_chat_id} is invalid ({e.kind}), retrying')
+                continue
+
+            for repair in repairs:
+                self._count(self.repairs, 'poll_repairs_total', repair)
+
+            return poll
+
+    @staticmethod
+    def _count(counts: dict[str, int], metric: str, kind: str) -> None:
+        counts[kind] = counts.get(kind, 0) + 1
+        metrics.inc(metric, kind=kind)
@@ -0,0 +1,109 @@
+import json
+import re
+
+from errors.poll_schema_error import PollSchemaError
+
+MIN_OPTIONS = 2
+MAX_OPTIONS = 10
+MAX_TEXT_LENGTH = 300
+MAX_OPTION_LENGTH = 100
+
+FENCED = 'fenced'
+SURROUNDING_PROSE = 'surrounding_prose'
+TEXT_TOO_LONG = 'text_too_long'
+OPTION_TOO_LONG = 'option_too_long'
+TOO_MANY_OPTIONS = 'too_many_options'
+DUPLICATE_OPTION = 'duplicate_option'
+EMPTY_OPTION = 'empty_option'
+STRING_RATING = 'string_rating'
+MISSING_RATING = 'missing_rating'
+
+DEFAULT_RATING = 1.0
+
+_fence = re.compile(r'^\s*```[\w-]*\s*\n?(.*?)\n?\s*```\s*$', re.DOTALL)
+_number = re.compile(r'-?\d+(?:[.,]\d+)?')
+
+
+def parse_poll(content: str) -> tuple[dict, list[str]]:
+    repairs = []
+
+    fenced = _fence.match(content)
+    if fenced is not None:
+        content = fenced.group(1)
+        repairs.append(FENCED)
+
+    try:
+        data = json.loads(content)
+    except json.JSONDecodeError:
+        start, end = content.find('{'), content.rfind('}')
+        try:
+            data = json.loads(content[start:end + 1]) if 0 <= start < end else None
+        except json.JSONDecodeError:
+            data = None
+        if data is None:
+            raise PollSchemaError('Output is not valid JSON', PollSchemaError.NOT_JSON)
+        repairs.append(SURROUNDING_PROSE)
+
+    if not isinstance(data, dict):
+        raise PollSchemaError('Output is not a JSON object', PollSchemaError.NOT_OBJECT)
+
+    text = data.get('text')
+    if not isinstance(text, str) or text.strip() == '':
+        raise PollSchemaError('Poll has no text', PollSchemaError.MISSING_TEXT)
+    text = _truncate(text.strip(), MAX_TEXT_LENGTH, TEXT_TOO_LONG, repairs)
+
+    raw_options = data.get('options')
+    if not isinstance(raw_options, list):
+        raise PollSchemaError('Poll has no options', PollSchemaError.MISSING_OPTIONS)
+
+    options = []
+    seen = set()
+    for raw in raw_options:
+        option_text = raw.get('text') if isinstance(raw, dict) else None
+        if not isinstance(option_text, str) or option_text.strip() == '':
+            repairs.append(EMPTY_OPTION)
+            continue
+
+        option_text = _truncate(option_text.strip(), MAX_OPTION_LENGTH, OPTION_TOO_LONG, repairs)
+        if option_text.casefold() in seen:
+            repairs.append(DUPLICATE_OPTION)
+            continue
+        seen.add(option_text.casefold())
+
+        options.append({'text': option_text, 'rating': _rating(raw.get('rating'), repairs)})
+
+    if len(options) < MIN_OPTIONS:
+        raise PollSchemaError(f'Poll has {len(options)} usable options', PollSchemaError.TOO_FEW_OPTIONS)
+
+    if len(options) > MAX_OPTIONS:
+        options = options[:MAX_OPTIONS]
+        repairs.append(TOO_MANY_OPTIONS)
+
+    return {'text': text, 'options': options}, repairs
+
+
+def _truncate(text: str, limit: int, kind: str, repairs: list[str]) -> str:
+    if len(text) <= limit:
+        return text
+
+    repairs.append(kind)
+    return text[:limit - 1].rstrip() + '…'
+
+
+def _rating(rating, repairs: list[str]) -> float:
+    if isinstance(rating, bool):
+        raise PollSchemaError(f'Invalid rating {rating!r}', PollSchemaError.INVALID_RATING)
+
+    if isinstance(rating, (int, float)):
+        return float(rating)
+
+    if rating is None:
+        repairs.append(MISSING_RATING)
+        return DEFAULT_RATING
+
+    number = _number.search(rating) if isinstance(rating, str) else None
+    if number is None:
+        raise PollSchemaError(f'Invalid rating {rating!r}', PollSchemaError.INVALID_RATING)
+
+    repairs.append(STRING_RATING)
+    return float(number.group(0).replace(',', '.'))
@@ -0,0 +1,83 @@
+import asyncio
+import heapq
+import re
+import time
+from logging import warning
+from typing import Awaitable, Callable
+
+from tasks import cancel_task, wait_event
+
+_duration = re.compile(r'(?:^|\s)@(\d+)([smhd])\s*$')
+_units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_deadline(text: str, now: float | None = None) -> tuple[str, int | None]:
+    match = _duration.search(text)
+    if match is None:
+        return text, None
+
+    seconds = int(match.group(1)) * _units[match.group(2)]
+    deadline = int((time.time() if now is None else now) + seconds)
+
+    return text[:match.start()].strip(), deadline
+
+
+class DeadlineScheduler:
+    def __init__(
+            self,
+            on_expire: Callable[[int, int], Awaitable[None]] | None = None,
+            max_concurrency: int = 8,
+    ):
+        self.on_expire = on_expire
+
+        self.scheduled = 0
+        self.fired = 0
+
+        self._heap: list[tuple[int, int, int]] = []
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def schedule(self, deadline: int, tg_chat_id: int, tg_poll_id: int) -> None:
+        heapq.heappush(self._heap, (deadline, tg_chat_id, tg_poll_id))
+        self.scheduled += 1
+        if self._heap[0][0] == deadline:
+            self._wakeup.set()
+
+    def pending(self) -> int:
+        return len(self._heap)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        await cancel_task(self._task)
+        self._task = None
+
+    async def _run(self) -> None:
+        expirations: set[asyncio.Task] = set()
+        try:
+            while True:
+                self._wakeup.clear()
+                now = time.time()
+
+                while self._heap and self._heap[0][0] <= now:
+                    _, tg_chat_id, tg_poll_id = heapq.heappop(self._heap)
+                    task = asyncio.create_task(self._expire(tg_chat_id, tg_poll_id))
+                    expirations.add(task)
+                    task.add_done_callback(expirations.discard)
+
+                timeout = self._heap[0][0] - now if self._heap else 3600
+                await wait_event(self._wakeup, timeout)
+        finally:
+            for task in expirations:
+                task.cancel()
+
+    async def _expire(self, tg_chat_id: int, tg_poll_id: int) -> None:
+        async with self._semaphore:
+            self.fired += 1
+            try:
+                await self.on_expire(tg_chat_id, tg_poll_id)
+            except Exception as e:
+                warning(f'Could not expire poll {tg_poll_id} in group {tg_chat_id}: {e}')
@@ -0,0 +1,17 @@
+def split_pot(stakes: list[int], pot: int) -> list[int]:
+    total = sum(stakes)
+    if total == 0:
+        return [0 for _ in stakes]
+
+    shares = [stake * pot // total for stake in stakes]
+    remainder = pot - sum(shares)
+
+    if remainder > 0:
+        order = sorted(
+            range(len(stakes)),
+            key=lambda i: (-(stakes[i] * pot % total), -stakes[i], i)
+        )
+        for i in order[:remainder]:
+            shares[i] += 1
+
+    return shares
@@ -0,0 +1,338 @@
+import asyncio
+import multiprocessing
+import os
+import queue
+import signal
+import time
+import zlib
+from logging import info, warning
+from multiprocessing.process import BaseProcess
+from typing import Awaitable, Callable
+
+from metrics import metrics
+from tasks import cancel_task, wait_event
+from webhook import WebhookServer
+
+_CHAT_PATHS = (
+    ('message', 'chat'),
+    ('edited_message', 'chat'),
+    ('channel_post', 'chat'),
+    ('edited_channel_post', 'chat'),
+    ('callback_query', 'message', 'chat'),
+    ('my_chat_member', 'chat'),
+    ('chat_member', 'chat'),
+    ('chat_join_request', 'chat'),
+)
+
+
+def shard_of(tg_chat_id: int, shards: int) -> int:
+    return zlib.crc32(str(tg_chat_id).encode()) % shards
+
+
+def chat_of(data: dict) -> int | None:
+    for keys in _CHAT_PATHS:
+        value = data
+        for key in keys:
+            value = value.get(key) if isinstance(value, dict) else None
+        if isinstance(value, dict) and isinstance(value.get('id'), int):
+            return value['id']
+
+    return None
+
+
+class Worker:
+    def __init__(self, index: int, context: multiprocessing.context.BaseContext, status: multiprocessing.Queue):
+        self.index = index
+        self.context = context
+        self.status = status
+        self.inbox: multiprocessing.Queue = context.Queue()
+
+        self.routed = 0
+        self.restarts = 0
+        self.stats: dict = {}
+
+        self.process: BaseProcess | None = None
+
+    def start(self, shards: int) -> None:
+        self.process = self.context.Process(
+            target=run_worker,
+            args=(self.index, shards, self.inbox, self.status),
+            name=f'druntoken-worker-{self.index}',
+            daemon=False,
+        )
+        self.process.start()
+
+    def send(self, data: dict) -> None:
+        self.inbox.put(data)
+        self.routed += 1
+
+    def backlog(self) -> int:
+        try:
+            return self.inbox.qsize()
+        except NotImplementedError:
+            return 0
+
+    async def stop(self, timeout: float) -> None:
+        if self.process is None:
+            return
+
+        self.inbox.put(None)
+        await asyncio.to_thread(self.process.join, timeout)
+        if self.process.is_alive():
+            warning(f'Worker {self.index} did not stop within {timeout}s, killing it')
+            self.process.kill()
+            await asyncio.to_thread(self.process.join)
+
+
+class ShardRouter:
+    def __init__(
+            self,
+            shards: int,
+            resolve_poll: Callable[[int], Awaitable[int | None]],
+            stop_timeout: float = 30,
+            stats_interval: float = 5,
+            poll_retry_delay: float = 0.5,
+    ):
+        self.shards = shards
+        self.resolve_poll = resolve_poll
+        self.stop_timeout = stop_timeout
+        self.poll_retry_delay = poll_retry_delay
+        self.stats_interval = stats_interval
+
+        self.unroutable = 0
+
+        self._context = multiprocessing.get_context('spawn')
+        self._status: multiprocessing.Queue = self._context.Queue()
+        self.workers = [Worker(index, self._context, self._status) for index in range(shards)]
+
+        self._stopping = False
+        self._restarting = asyncio.Lock()
+        self._tasks: list[asyncio.Task] = []
+        self._retries: set[asyncio.Task] = set()
+
+    def start(self) -> None:
+        for worker in self.workers:
+            worker.start(self.shards)
+
+        self._tasks = [asyncio.create_task(self._supervise()), asyncio.create_task(self._read_status())]
+
+    async def stop(self) -> None:
+        self._stopping = True
+        if self._retries:
+            await asyncio.gather(*self._retries, return_exceptions=True)
+
+        async with self._restarting:
+            await asyncio.gather(*(worker.stop(self.stop_timeout) for worker in self.workers))
+
+        for task in self._tasks:
+            await cancel_task(task)
+        self._tasks = []
+
+    async def route(self, data: dict) -> None:
+        tg_chat_id = chat_of(data)
+
+        poll_answer = data.get('poll_answer')
+        if tg_chat_id is None and isinstance(poll_answer, dict):
+            tg_poll_id = int(poll_answer['poll_id'])
+            tg_chat_id = await self.resolve_poll(tg_poll_id)
+            if tg_chat_id is None and self.poll_retry_delay > 0:
+                # the owning worker may still be storing the route of a poll it has just sent
+                task = asyncio.create_task(self._retry(data, tg_poll_id))
+                self._retries.add(task)
+                task.add_done_callback(self._retries.discard)
+                return
+
+        self._send(data, tg_chat_id)
+
+    def backlog(self) -> int:
+        return len(self._retries) + sum(worker.backlog() for worker in self.workers)
+
+    async def _retry(self, data: dict, tg_poll_id: int) -> None:
+        await asyncio.sleep(self.poll_retry_delay)
+        try:
+            tg_chat_id = await self.resolve_poll(tg_poll_id)
+        except Exception as e:
+            warning(f'Could not resolve poll {tg_poll_id}: {e}')
+            tg_chat_id = None
+
+        self._send(data, tg_chat_id)
+
+    def _send(self, data: dict, tg_chat_id: int | None) -> None:
+        if tg_chat_id is None:
+            self.unroutable += 1
+            shard = data.get('update_id', 0) % self.shards
+        else:
+            shard = shard_of(tg_chat_id, self.shards)
+
+        worker = self.workers[shard]
+        worker.send(data)
+        metrics.inc('shard_routed_total', worker=str(shard))
+
+    async def restart(self) -> None:
+        async with self._restarting:
+            for worker in self.workers:
+                if self._stopping:
+                    return
+
+                info(f'Restarting worker {worker.index}')
+                await worker.stop(self.stop_timeout)
+                worker.start(self.shards)
+                worker.restarts += 1
+                metrics.inc('shard_restarts_total', worker=str(worker.index), reason='rolling')
+
+    async def _supervise(self) -> None:
+        while True:
+            await asyncio.sleep(1)
+            if self._restarting.locked():
+                continue
+
+            for worker in self.workers:
+                if self._stopping or worker.process is None or worker.process.is_alive():
+                    continue
+
+                warning(f'Worker {worker.index} exited with code {worker.process.exitcode}, restarting it')
+                worker.start(self.shards)
+                worker.restarts += 1
+                metrics.inc('shard_restarts_total', worker=str(worker.index), reason='crash')
+
+    async def _read_status(self) -> None:
+        while True:
+            try:
+                index, stats = await asyncio.to_thread(self._status.get, True, self.stats_interval)
+            except queue.Empty:
+                continue
+
+            worker = self.workers[index]
+            worker.stats = stats
+            for name, value in stats.items():
+                metrics.set(f'shard_{name}', value, worker=str(index))
+            metrics.set('shard_backlog', worker.backlog(), worker=str(index))
+
+
+def run_worker(index: int, shards: int, inbox: multiprocessing.Queue, status: multiprocessing.Queue) -> None:
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    os.environ['SHARD_INDEX'] = str(index)
+    os.environ['SHARD_COUNT'] = str(shards)
+    os.environ['BACKUP_PATH'] = ''
+    if int(os.environ.get('METRICS_PORT', 0)):
+        os.environ['METRICS_PORT'] = str(int(os.environ['METRICS_PORT']) + 1 + index)
+
+    import main
+
+    main.configure()
+    asyncio.run(serve_worker(main.build_application(updater=False), index, inbox, status))
+
+
+async def serve_worker(app, index: int, inbox: multiprocessing.Queue, status: multiprocessing.Queue) -> None:
+    from telegram import Update
+
+    received = 0
+    stopped = asyncio.Event()
+
+    async def report() -> None:
+        while not await wait_event(stopped, 5):
+            status.put((index, {
+                'received': received,
+                'pid': os.getpid(),
+                'uptime': time.monotonic() - started,
+                **app.update_processor.stats(),
+            }))
+
+    started = time.monotonic()
+    async with app:
+        if app.post_init is not None:
+            await app.post_init(app)
+        await app.start()
+        reporter = asyncio.create_task(report())
+
+        while True:
+            # leave updates in the inbox while the worker is saturated, so the front sees the backlog
+            while app.update_processor.in_flight >= app.update_processor.max_concurrent_updates:
+                await asyncio.sleep(0.01)
+
+            data = await asyncio.to_thread(inbox.get)
+            if data is None:
+                break
+
+            received += 1
+            try:
+                update = Update.de_json(data, app.bot)
+            except Exception as e:
+                warning(f'Worker {index} discarding undecodable update: {e}')
+                continue
+            await app.update_queue.put(update)
+
+        while app.update_queue.qsize() > 0:
+            await asyncio.sleep(0.05)
+
+        stopped.set()
+        await cancel_task(reporter)
+        await app.stop()
+        if app.post_stop is not None:
+            await app.post_stop(app)
+
+    if app.post_shutdown is not None:
+        await app.post_shutdown(app)
+
+
+async def run_sharded(
+        app,
+        router: ShardRouter,
+        incoming: asyncio.Queue,
+        server: WebhookServer | None = None,
+        webhook_url: str | None = None,
+) -> None:
+    from telegram import Update
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.ensure_future(router.restart()))
+
+    async def forward() -> None:
+        while True:
+            data = await incoming.get()
+            try:
+                await router.route(data)
+            except Exception as e:
+                warning(f'Could not route update {data.get("update_id")}: {e}')
+            finally:
+                incoming.task_done()
+
+    async def poll() -> None:
+        offset = None
+        await app.bot.delete_webhook()
+        while True:
+            try:
+                updates = await app.bot.get_updates(offset=offset, timeout=30, allowed_updates=Update.ALL_TYPES)
+            except Exception as e:
+                warning(f'Polling failed: {e}')
+                await asyncio.sleep(1)
+                continue
+
+            for update in updates:
+                await incoming.put(update.to_dict())
+                offset = update.update_id + 1
+
+    router.start()
+    async with app:
+        if server is not None:
+            await app.bot.set_webhook(webhook_url, secret_token=server.secret_token, allowed_updates=Update.ALL_TYPES)
+            await server.start()
+            receiver = None
+        else:
+            receiver = asyncio.create_task(poll())
+        forwarder = asyncio.create_task(forward())
+
+        await stop.wait()
+
+        if server is not None:
+            await server.stop()
+        await cancel_task(receiver)
+        await incoming.join()
+        await cancel_task(forwarder)
+
+    await router.stop()
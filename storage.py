@@ -0,0 +1,248 @@
+import asyncio
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextvars import copy_context
+from logging import warning
+from sqlite3 import ProgrammingError
+from typing import TYPE_CHECKING, Any, Callable, Collection
+
+from database import checkpoint
+from dtypes import BetResult, GroupInfo, MemberStats
+from group import Group
+from group_registry import GroupRegistry
+from poll import Poll
+from tasks import cancel_task
+
+if TYPE_CHECKING:
+    from write_behind import SelectionBuffer
+
+
+class Storage:
+    def __init__(
+            self,
+            workers: int = 4,
+            max_groups: int = 128,
+            idle_timeout: float = 600,
+            max_poll_routes: int = 10000,
+    ):
+        if workers < 1:
+            raise ValueError('workers must be at least 1')
+
+        self._executors = [
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'storage-{i}')
+            for i in range(workers)
+        ]
+        self._poll_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='storage-polls')
+
+        self.registry = GroupRegistry(max_groups, idle_timeout, on_evict=self._close_group)
+        self.polls = AsyncPoll(self, Poll(max_poll_routes))
+        self.selections: 'SelectionBuffer | None' = None
+
+    def executor_for(self, tg_chat_id: int) -> Executor:
+        return self._executors[tg_chat_id % len(self._executors)]
+
+    def submit(self, tg_chat_id: int, fn: Callable, *args) -> asyncio.Future:
+        return asyncio.get_running_loop().run_in_executor(
+            self.executor_for(tg_chat_id), copy_context().run, fn, *args)
+
+    async def run(self, tg_chat_id: int, fn: Callable, *args) -> Any:
+        return await self.submit(tg_chat_id, fn, *args)
+
+    async def run_polls(self, fn: Callable, *args) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self._poll_executor, copy_context().run, fn, *args)
+
+    async def run_group(self, tg_chat_id: int, fn: Callable, *args) -> Any:
+        def call():
+            group = self.registry.peek(tg_chat_id)
+            if group is not None:
+                return fn(group, *args)
+
+            group = Group(tg_chat_id)
+            try:
+                return fn(group, *args)
+            finally:
+                group.close()
+
+        return await self.run(tg_chat_id, call)
+
+    def group(self, tg_chat_id: int) -> 'AsyncGroup':
+        return AsyncGroup(self, tg_chat_id)
+
+    async def create_group(self, tg_chat_id: int, description: str) -> 'AsyncGroup':
+        def create():
+            self.registry.put(Group.create_group(tg_chat_id, description))
+
+        await self.run(tg_chat_id, create)
+
+        return self.group(tg_chat_id)
+
+    async def checkpoint(self, mode: str = 'PASSIVE') -> None:
+        groups = {id(group.connection): group for group in self.registry.groups()}
+
+        results = await asyncio.gather(
+            *(self.run(group.group_info['tg_chat_id'], self._checkpoint, group, mode) for group in groups.values()),
+            self.run_polls(checkpoint, self.polls.poll.connection, mode),
+            return_exceptions=True
+        )
+
+        for result in results:
+            if isinstance(result, Exception):
+                warning(f'WAL checkpoint failed: {result}')
+
+    def close(self) -> None:
+        self.registry.close()
+
+        for executor in self._executors:
+            executor.shutdown(wait=True)
+
+        self._poll_executor.submit(self.polls.poll.connection.close)
+        self._poll_executor.shutdown(wait=True)
+
+    @staticmethod
+    def _checkpoint(group: Group, mode: str) -> None:
+        try:
+            checkpoint(group.connection, mode)
+        except ProgrammingError:
+            pass
+
+    def _close_group(self, group: Group) -> None:
+        self.executor_for(group.group_info['tg_chat_id']).submit(group.close)
+
+
+class AsyncGroup:
+    def __init__(self, storage: Storage, tg_chat_id: int):
+        self.storage = storage
+        self.tg_chat_id = tg_chat_id
+
+    async def group_info(self) -> GroupInfo:
+        return await self._call(lambda group: group.group_info)
+
+    async def add_member(self, tg_id: int, name: str, tokens: int = 10000) -> bool:
+        return await self._call(Group.add_member, tg_id, name, tokens)
+
+    async def all_in(self, tg_user_id: int) -> int:
+        return await self._call(Group.all_in, tg_user_id)
+
+    async def get_tokens(self, tg_id: int) -> int | None:
+        return await self._call(Group.get_tokens, tg_id)
+
+    async def suggest(self, suggestion: str) -> bool:
+        return await self._call(Group.suggest, suggestion)
+
+    async def get_suggestions(self) -> list[str]:
+        return await self._call(Group.get_suggestions)
+
+    async def sample_suggestion(self, exclude: Collection[int] = ()) -> tuple[int, str] | None:
+        return await self._call(Group.sample_suggestion, exclude)
+
+    async def use_suggestion(self, suggestion_id: int) -> None:
+        await self._call(Group.use_suggestion, suggestion_id)
+
+    async def has_member(self, tg_id: int) -> bool:
+        return await self._call(Group.has_member, tg_id)
+
+    async def place_bet(self, member_tg_id: int, tg_message_id: int, amount: int) -> int:
+        return await self._call(Group.place_bet, member_tg_id, tg_message_id, amount)
+
+    async def select_option(self, member_tg_id: int, tg_poll_id: int, tg_index: int) -> None:
+        if self.storage.selections is not None:
+            return self.storage.selections.add(self.tg_chat_id, member_tg_id, tg_poll_id, tg_index)
+
+        return await self._call(Group.select_option, member_tg_id, tg_poll_id, tg_index)
+
+    async def store_poll(self, poll: dict, tg_poll_id: int, tg_message_id: int, deadline: int | None = None) -> int:
+        return await self._call(Group.store_poll, poll, tg_poll_id, tg_message_id, deadline)
+
+    async def close_poll(self, tg_poll_id: int, correct_tg_index: int) -> (list[BetResult], str):
+        if self.storage.selections is not None:
+            await self.storage.selections.flush(self.tg_chat_id)
+
+        return await self._call(Group.close_poll, tg_poll_id, correct_tg_index)
+
+    async def leaderboard(self, n: int = 10) -> list[MemberStats]:
+        return await self._call(Group.leaderboard, n)
+
+    async def set_resolution(self, tg_message_id: int, tg_index: int) -> bool:
+        return await self._call(Group.set_resolution, tg_message_id, tg_index)
+
+    async def check_ledger(self) -> int:
+        return await self._call(Group.check_ledger)
+
+    async def pending_deadlines(self) -> list[tuple[int, int]]:
+        return await self._call(Group.pending_deadlines)
+
+    async def expire_poll(self, tg_poll_id: int) -> tuple[int, int | None] | None:
+        if self.storage.selections is not None:
+            await self.storage.selections.flush(self.tg_chat_id)
+
+        return await self._call(Group.expire_poll, tg_poll_id)
+
+    async def _call(self, method: Callable, *args) -> Any:
+        return await self.storage.run(
+            self.tg_chat_id,
+            lambda: method(self.storage.registry.get(self.tg_chat_id), *args)
+        )
+
+
+class AsyncPoll:
+    def __init__(self, storage: Storage, poll: Poll):
+        self.storage = storage
+        self.poll = poll
+
+    async def store(self, tg_poll_id: int, tg_chat_id: int) -> None:
+        return await self.storage.run_polls(self.poll.store, tg_poll_id, tg_chat_id)
+
+    async def get_tg_chat_id(self, tg_poll_id: int) -> int | None:
+        tg_chat_id = self.poll.cached_tg_chat_id(tg_poll_id)
+        if tg_chat_id is not None:
+            return tg_chat_id
+
+        return await self.storage.run_polls(self.poll.get_tg_chat_id, tg_poll_id)
+
+    async def prune(self, tg_poll_ids: list[int]) -> int:
+        return await self.storage.run_polls(self.poll.prune, tg_poll_ids)
+
+    async def vacuum(self, pages: int = 256) -> int:
+        return await self.storage.run_polls(self.poll.vacuum, pages)
+
+
+class Checkpointer:
+    def __init__(self, storage: Storage, interval: float = 60, mode: str = 'PASSIVE'):
+        self.storage = storage
+        self.interval = interval
+        self.mode = mode
+
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        await cancel_task(self._task)
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.storage.checkpoint(self.mode)
+
+
+class IdleSweeper:
+    def __init__(self, storage: Storage, interval: float = 60):
+        self.storage = storage
+        self.interval = interval
+
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        await cancel_task(self._task)
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            self.storage.registry.evict_idle()
@@ -0,0 +1,104 @@
+import asyncio
+from logging import warning
+from typing import AsyncGenerator, Awaitable
+
+from telegram import Message
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+from tasks import cancel_task
+
+MAX_MESSAGE_LENGTH = 4096
+
+
+async def stream_into(
+        message: Message,
+        header: str,
+        chunks: AsyncGenerator[str, None],
+        interval: float = 3.0,
+        timeout: float = 30.0,
+) -> bool:
+    editor = _Editor(message, header, interval)
+    task = asyncio.create_task(editor.consume(chunks))
+
+    try:
+        done, _ = await asyncio.wait({task}, timeout=timeout)
+    finally:
+        if not task.done():
+            await cancel_task(task)
+
+    if task in done and task.exception() is None:
+        await editor.edit(force=True)
+        return True
+
+    if task in done:
+        warning(f'Streaming into message {message.message_id} failed: {task.exception()!r}')
+    else:
+        warning(f'Streaming into message {message.message_id} timed out after {timeout}s')
+
+    editor.text = ''
+    await editor.edit(force=True)
+
+    return False
+
+
+class BackgroundStreams:
+    def __init__(self):
+        self._tasks: set[asyncio.Task] = set()
+
+    def start(self, stream: Awaitable[bool]) -> asyncio.Task:
+        task = asyncio.ensure_future(stream)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+        return task
+
+    async def stop(self) -> None:
+        for task in list(self._tasks):
+            await cancel_task(task)
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+
+class _Editor:
+    def __init__(self, message: Message, header: str, interval: float):
+        self.message = message
+        self.header = header
+        self.interval = interval
+        self.text = ''
+
+        self._shown = header
+        self._next_edit = asyncio.get_running_loop().time() + interval
+
+    async def consume(self, chunks: AsyncGenerator[str, None]) -> None:
+        try:
+            async for chunk in chunks:
+                self.text += chunk
+                await self.edit()
+        finally:
+            await chunks.aclose()
+
+    async def edit(self, force: bool = False) -> None:
+        loop = asyncio.get_running_loop()
+        content = f'{self.header}\n\n{self.text}' if self.text else self.header
+        content = content[:MAX_MESSAGE_LENGTH]
+
+        if content == self._shown or (not force and loop.time() < self._next_edit):
+            return
+
+        try:
+            await self.message.edit_text(content)
+            self._shown = content
+        except RetryAfter as e:
+            self._next_edit = loop.time() + float(e.retry_after)
+            if force:
+                await asyncio.sleep(float(e.retry_after))
+                await self.edit(force=True)
+            return
+        except BadRequest as e:
+            if 'not modified' not in str(e).lower():
+                warning(f'Could not edit message {self.message.message_id}: {e}')
+        except TelegramError as e:
+            warning(f'Could not edit message {self.message.message_id}: {e}')
+
+        self._next_edit = loop.time() + self.interval
@@ -0,0 +1,11 @@
+import re
+import unicodedata
+
+_non_word = re.compile(r'[\W_]+')
+
+
+def normalize(suggestion: str) -> str:
+    decomposed = unicodedata.normalize('NFKD', suggestion)
+    stripped = ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+    return _non_word.sub(' ', stripped.casefold()).strip()
@@ -0,0 +1,22 @@
+import asyncio
+
+
+async def wait_event(event: asyncio.Event, timeout: float) -> bool:
+    waiter = asyncio.ensure_future(event.wait())
+    try:
+        done, _ = await asyncio.wait({waiter}, timeout=timeout)
+    finally:
+        waiter.cancel()
+
+    return waiter in done
+
+
+async def cancel_task(task: asyncio.Task | None) -> None:
+    if task is None:
+        return
+
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
@@ -0,0 +1,30 @@
+import pytest
+
+from backends import FileBackend, MultiTenantBackend
+from group import Group
+from poll import Poll
+
+POLL = {
+    'text': 'Chi vince?',
+    'options': [{'text': f'Opzione {i}', 'rating': 1} for i in range(4)],
+}
+
+
+@pytest.fixture(params=[FileBackend, MultiTenantBackend], ids=['file', 'multi-tenant'])
+def backend(request, tmp_path, monkeypatch):
+    backend = request.param(str(tmp_path))
+    monkeypatch.setattr(Group, 'backend', backend, raising=False)
+    monkeypatch.setattr(Poll, 'backend', backend, raising=False)
+
+    yield backend
+
+    backend.close()
+
+
+@pytest.fixture
+def group(backend):
+    group = Group.create_group(-100, '')
+
+    yield group
+
+    group.close()
@@ -0,0 +1,210 @@
+import pytest
+
+from backends import FileBackend, MultiTenantBackend
+from errors.bet_error import BetError
+from group import Group
+from migrate_storage import copy_group
+from poll import Poll
+from tests.conftest import POLL
+
+
+def play(group: Group, tg_poll_id: int, bets: dict[int, tuple[int, int | None]], correct: int | None):
+    group.store_poll(POLL, tg_poll_id, tg_poll_id)
+    for tg_id, (amount, tg_index) in bets.items():
+        group.place_bet(tg_id, tg_poll_id, amount)
+        if tg_index is not None:
+            group.select_option(tg_id, tg_poll_id, tg_index)
+
+    if correct is not None:
+        return group.close_poll(tg_poll_id, correct)
+
+
+def balances(group: Group) -> dict[int, int]:
+    return dict(group.connection.execute(
+        'SELECT tg_id, tokens FROM members WHERE group_id = ? ORDER BY tg_id', (group.group_id,)))
+
+
+def test_create_join_bet_answer_close(group):
+    assert group.add_member(1, 'Anna')
+    assert group.add_member(2, 'Bruno')
+    assert group.add_member(3, 'Carla')
+    assert not group.add_member(1, 'Anna')
+
+    results, message = play(group, 1, {1: (300, 0), 2: (100, 0), 3: (200, 1)}, correct=0)
+
+    assert message == 'All good'
+    assert [(result['member_name'], result['win'], result['tokens']) for result in results] == [
+        ('Anna', 150, 10150),
+        ('Bruno', 50, 10050),
+        ('Carla', -200, 9800),
+    ]
+    assert balances(group) == {1: 10150, 2: 10050, 3: 9800}
+    assert group.close_poll(1, 0) == ([], 'Il sondaggio è già stato chiuso')
+    assert [entry['member_name'] for entry in group.leaderboard(2)] == ['Anna', 'Bruno']
+    assert group.check_ledger() == 0
+
+
+def test_bet_errors(group):
+    group.add_member(1, 'Anna', 100)
+    group.store_poll(POLL, 1, 1)
+
+    with pytest.raises(BetError) as error:
+        group.place_bet(2, 1, 10)
+    assert error.value.kind == BetError.NOT_MEMBER
+
+    with pytest.raises(BetError) as error:
+        group.place_bet(1, 1, 500)
+    assert error.value.kind == BetError.INSUFFICIENT_TOKENS
+
+    group.place_bet(1, 1, 40)
+    with pytest.raises(BetError) as error:
+        group.place_bet(1, 1, 40)
+    assert error.value.kind == BetError.DUPLICATE_BET
+    assert group.get_tokens(1) == 60
+
+
+def test_unanswered_bets_are_refunded(group):
+    group.add_member(1, 'Anna')
+    group.add_member(2, 'Bruno')
+
+    play(group, 1, {1: (300, 0), 2: (100, None)}, correct=0)
+
+    assert balances(group) == {1: 10000, 2: 10000}
+    assert group.check_ledger() == 0
+
+
+def test_unanswered_bets_are_closed_when_refunded(group):
+    group.add_member(1, 'Anna')
+    group.add_member(2, 'Bruno')
+
+    assert play(group, 1, {1: (300, None), 2: (100, None)}, correct=0) == ([], 'Nessuna scommessa piazzata')
+
+    assert balances(group) == {1: 10000, 2: 10000}
+    assert group.connection.execute('SELECT open, poll_option_id FROM bets ORDER BY id').fetchall() == [
+        (0, None),
+        (0, None),
+    ]
+    assert group.check_ledger() == 0
+
+
+def test_nothing_to_win_is_a_push(group):
+    group.add_member(1, 'Anna')
+    group.add_member(2, 'Bruno')
+    play(group, 1, {1: (300, 0), 2: (100, 1)}, correct=0)
+
+    assert play(group, 2, {1: (200, 0), 2: (100, 0)}, correct=0) == ([], "Non c'è nulla da vincere")
+
+    leaderboard = {entry['member_name']: entry for entry in group.leaderboard(10)}
+    assert (leaderboard['Anna']['played'], leaderboard['Anna']['won'], leaderboard['Anna']['streak']) == (2, 1, 1)
+    assert (leaderboard['Bruno']['played'], leaderboard['Bruno']['lost'], leaderboard['Bruno']['streak']) == (2, 1, -1)
+    assert leaderboard['Bruno']['won'] == 0
+    assert balances(group) == {1: 10100, 2: 9900}
+
+
+def test_groups_are_isolated(backend):
+    first = Group.create_group(-1, 'first')
+    second = Group.create_group(-2, 'second')
+    for group in (first, second):
+        group.add_member(1, 'Anna')
+        group.add_member(2, 'Bruno')
+
+    play(first, 1, {1: (500, 0), 2: (500, 1)}, correct=0)
+
+    assert balances(first) == {1: 10500, 2: 9500}
+    assert balances(second) == {1: 10000, 2: 10000}
+    assert second.close_poll(1, 0) == ([], 'Nessuna scommessa piazzata')
+    assert backend.list_groups() == [-2, -1]
+
+    with pytest.raises(ValueError):
+        Group.create_group(-1, 'again')
+
+    first.close()
+    second.close()
+
+
+def snapshot(group: Group) -> dict:
+    results, message = group.close_poll(3, 1)
+
+    return {
+        'info': (group.group_info['tg_chat_id'], group.group_info['description']),
+        'balances': balances(group),
+        'leaderboard': group.leaderboard(10),
+        'close': ([(r['member_name'], r['win'], r['tokens']) for r in results], message),
+        'repaired': group.check_ledger(),
+        'archived': group.connection.execute(
+            'SELECT archived_polls.tg_poll_id, members.tg_id, archived_poll_options.tg_index, archived_bets.amount '
+            'FROM archived_bets '
+            'JOIN archived_polls ON archived_bets.poll_id = archived_polls.id '
+            'JOIN archived_poll_options ON archived_bets.poll_option_id = archived_poll_options.id '
+            'JOIN members ON archived_bets.member_id = members.id '
+            'WHERE archived_polls.group_id = ? '
+            'ORDER BY archived_bets.id',
+            (group.group_id,)
+        ).fetchall(),
+    }
+
+
+def test_migrate_then_compare(tmp_path, monkeypatch):
+    source = FileBackend(str(tmp_path))
+    target = MultiTenantBackend(str(tmp_path))
+
+    monkeypatch.setattr(Group, 'backend', target, raising=False)
+    existing = Group.create_group(-9, 'already there')
+    existing.add_member(7, 'Zeno')
+    existing.add_member(8, 'Ugo')
+    play(existing, 1, {7: (100, 0), 8: (100, 1)}, correct=0)
+    play(existing, 2, {7: (100, 0), 8: (100, 1)}, correct=1)
+    existing.archive_polls(closed_before=2 ** 40, limit=1)
+
+    monkeypatch.setattr(Group, 'backend', source)
+    for tg_chat_id in (-1, -2):
+        group = Group.create_group(tg_chat_id, f'chat {tg_chat_id}')
+        for tg_id, name in ((1, 'Anna'), (2, 'Bruno'), (3, 'Carla')):
+            group.add_member(tg_id, name)
+        group.suggest('chi arriva ultimo')
+        play(group, 1, {1: (300, 0), 2: (100, 1), 3: (50, None)}, correct=0)
+        play(group, 2, {1: (200, 2), 3: (400, 1)}, correct=1)
+        play(group, 3, {1: (100, 1), 2: (250, 0)}, correct=None)
+        group.archive_polls(closed_before=2 ** 40, limit=1)
+        group.check_ledger()
+        group.close()
+
+    expected = {}
+    for tg_chat_id in source.list_groups():
+        group = Group(tg_chat_id)
+        copy_group(group, target.connection())
+        expected[tg_chat_id] = snapshot(group)
+        group.close()
+
+    monkeypatch.setattr(Group, 'backend', target)
+    for tg_chat_id, snapshot_before in expected.items():
+        assert snapshot_before['repaired'] == 0
+        assert snapshot_before['archived'] == [(1, 1, 0, 300), (1, 2, 1, 100)]
+        assert snapshot(Group(tg_chat_id)) == snapshot_before
+
+    assert balances(Group(-9)) == {7: 10000, 8: 10000}
+    assert target.list_groups() == [-9, -2, -1]
+
+    target.close()
+
+
+def test_poll_routes_survive_a_restart_and_archiving(backend, group, tmp_path):
+    other = Group.create_group(-200, '')
+    polls = Poll()
+    for tg_chat_id, chat, tg_poll_id in ((-100, group, 1), (-200, other, 2)):
+        chat.add_member(1, 'Anna')
+        play(chat, tg_poll_id, {1: (100, 0)}, correct=0)
+        polls.store(tg_poll_id, tg_chat_id)
+
+    restarted = Poll()
+    assert restarted.cached_tg_chat_id(2) == -200
+    restarted._routes.clear()
+    assert restarted.get_tg_chat_id(1) == -100
+    assert restarted.get_tg_chat_id(2) == -200
+    assert restarted.get_tg_chat_id(3) is None
+
+    archived = group.archive_polls(closed_before=2 ** 40)
+    assert restarted.prune(archived) == 1
+    assert Poll().get_tg_chat_id(1) is None
+    assert (tmp_path / 'polls.db').exists() == (not backend.polls_in_groups)
+    other.close()
@@ -0,0 +1,94 @@
+import random
+
+import pytest
+
+from errors.bet_error import BetError
+from group import Group
+from member_cache import CachedMember, MemberCache
+from tests.conftest import POLL
+
+MEMBERS = 40
+
+
+def stale_balances(group: Group) -> dict[int, tuple[int, int]]:
+    stored = dict(group.connection.execute('SELECT tg_id, tokens FROM members WHERE group_id = ?', (group.group_id,)))
+
+    stale = {}
+    for tg_id, tokens in stored.items():
+        cached = group.members.get(tg_id)
+        if cached is not None and cached.tokens != tokens:
+            stale[tg_id] = (cached.tokens, tokens)
+
+    return stale
+
+
+def test_lru_eviction():
+    cache = MemberCache(max_size=2)
+    for tg_id in (1, 2, 3):
+        cache.put(tg_id, CachedMember(tg_id * 10, f'Member {tg_id}', 100))
+
+    assert cache.get(1) is None
+    assert cache.get(3).member_id == 30
+    assert cache.stats()['evictions'] == 1
+
+    cache.adjust(10, 50)
+    cache.adjust(30, -40)
+    assert cache.get(3).tokens == 60
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_balances_never_stale_after_settlement(backend, monkeypatch, seed):
+    monkeypatch.setattr(Group, 'member_cache_size', 8)
+    rng = random.Random(seed)
+    group = Group.create_group(-100, '')
+
+    for tg_id in range(1, MEMBERS + 1):
+        group.add_member(tg_id, f'Member {tg_id}')
+
+    for tg_poll_id in range(1, 16):
+        group.store_poll(POLL, tg_poll_id, tg_poll_id)
+        for tg_id in rng.sample(range(1, MEMBERS + 1), 20):
+            try:
+                group.place_bet(tg_id, tg_poll_id, rng.randint(1, 4000))
+            except BetError:
+                continue
+            if rng.random() < 0.8:
+                group.select_option(tg_id, tg_poll_id, rng.randrange(2))
+
+        group.close_poll(tg_poll_id, rng.randrange(4))
+
+        assert stale_balances(group) == {}
+
+    assert group.members.stats()['evictions'] > 0
+    group.close()
+
+
+def test_stale_cache_cannot_overspend(group):
+    group.add_member(1, 'Member 1', 100)
+    group.store_poll(POLL, 1, 1)
+    cached = group.members.get(1)
+    group.members.put(1, cached._replace(tokens=1000))
+
+    with pytest.raises(BetError) as error:
+        group.place_bet(1, 1, 500)
+
+    assert error.value.kind == BetError.INSUFFICIENT_TOKENS
+    assert group.get_tokens(1) == 100
+    assert group.connection.execute('SELECT COUNT(*) FROM bets').fetchone()[0] == 0
+
+
+def test_stale_cache_does_not_reject_affordable_bet(group):
+    group.add_member(1, 'Member 1', 100)
+    group.store_poll(POLL, 1, 1)
+    cached = group.members.get(1)
+    group.members.put(1, cached._replace(tokens=0))
+
+    assert group.place_bet(1, 1, 60) == 40
+    assert group.get_tokens(1) == 40
+
+
+def test_join_is_answered_from_cache(group):
+    assert group.add_member(1, 'Member 1')
+    assert not group.add_member(1, 'Member 1')
+    assert group.has_member(1)
+    assert group.members.stats()['hits'] >= 2
@@ -0,0 +1,24 @@
+import sqlite3
+
+from migrations import GROUP_MIGRATIONS, create_schema, migrate
+
+
+def test_duplicate_bets_are_merged(caplog):
+    connection = sqlite3.connect(':memory:', isolation_level=None)
+    create_schema(connection)
+    connection.execute('INSERT INTO group_info (id, description, tg_id) VALUES (1, \'\', -1)')
+    connection.executemany('INSERT INTO members (id, tg_id, name, tokens) VALUES (?, ?, ?, ?)',
+                           [(1, 10, 'Anna', 700), (2, 10, 'Anna', 1000), (3, 20, 'Bruno', 900)])
+    connection.execute('INSERT INTO polls (id, tg_poll_id, tg_message_id, text) VALUES (1, 1, 1, \'poll\')')
+    connection.executemany('INSERT INTO poll_options (id, tg_index, text, rating, poll_id) VALUES (?, ?, ?, 1, 1)',
+                           [(1, 0, 'yes'), (2, 1, 'no')])
+    connection.executemany('INSERT INTO bets (amount, member_id, poll_id, poll_option_id) VALUES (?, ?, 1, ?)',
+                           [(100, 1, None), (200, 2, 2), (100, 3, 1)])
+
+    migrate(connection, GROUP_MIGRATIONS)
+
+    assert connection.execute('SELECT id, tg_id FROM members ORDER BY id').fetchall() == [(1, 10), (3, 20)]
+    assert connection.execute('SELECT member_id, amount, poll_option_id FROM bets ORDER BY id').fetchall() == [
+        (1, 300, 2), (3, 100, 1)
+    ]
+    assert 'Removed 1 duplicate members and merged 1 duplicate bets' in caplog.text
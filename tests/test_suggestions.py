@@ -0,0 +1,41 @@
+from collections import Counter
+
+
+def uses(group) -> dict[str, int]:
+    return dict(group.connection.execute(
+        'SELECT text, uses FROM suggestions WHERE group_id = ?', (group.group_id,)))
+
+
+def test_sampling_is_uniform_within_the_least_used_tier(group):
+    for text in ('uno', 'due', 'tre', 'quattro'):
+        group.suggest(text)
+
+    counts = Counter(group.sample_suggestion()[1] for _ in range(4000))
+
+    assert set(counts) == {'uno', 'due', 'tre', 'quattro'}
+    assert min(counts.values()) > 800
+    assert set(uses(group).values()) == {0}
+
+
+def test_uses_are_counted_when_a_suggestion_is_used(group):
+    group.suggest('uno')
+    group.suggest('due')
+
+    suggestion_id, text = group.sample_suggestion()
+    group.use_suggestion(suggestion_id)
+
+    assert uses(group)[text] == 1
+    assert {group.sample_suggestion()[1] for _ in range(50)} == {'uno', 'due'} - {text}
+
+
+def test_sampling_skips_excluded_suggestions_unless_nothing_is_left(group):
+    assert group.sample_suggestion() is None
+
+    group.suggest('uno')
+    group.suggest('due')
+    first_id, first = group.sample_suggestion()
+
+    assert {group.sample_suggestion([first_id])[1] for _ in range(50)} == {'uno', 'due'} - {first}
+
+    second_id, _ = group.sample_suggestion([first_id])
+    assert group.sample_suggestion([first_id, second_id]) is not None
@@ -0,0 +1,90 @@
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip('telegram')
+
+from telegram import Update  # noqa: E402
+from telegram.ext import Application, TypeHandler  # noqa: E402
+from telegram.request import BaseRequest  # noqa: E402
+
+from update_processor import ChatOrderedUpdateProcessor  # noqa: E402
+from webhook import application_server  # noqa: E402
+
+SECRET = 'secret'
+
+
+class FakeTelegram(BaseRequest):
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(self, *_, **__) -> tuple[int, bytes]:
+        return 200, json.dumps({'ok': True, 'result': {'id': 1, 'is_bot': True, 'first_name': 'Test'}}).encode()
+
+
+def update(update_id: int) -> bytes:
+    return json.dumps({'update_id': update_id, 'message': {
+        'message_id': update_id,
+        'date': 0,
+        'chat': {'id': -update_id, 'type': 'group'},
+        'text': 'ciao',
+    }}).encode()
+
+
+async def post(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, body: bytes) -> int:
+    writer.write(f'POST /telegram HTTP/1.1\r\nContent-Length: {len(body)}\r\n'
+                 f'X-Telegram-Bot-Api-Secret-Token: {SECRET}\r\n\r\n'.encode() + body)
+    await writer.drain()
+
+    status = int((await reader.readline()).split()[1])
+    while await reader.readline() not in (b'\r\n', b''):
+        pass
+
+    return status
+
+
+async def flood(max_pending: int, updates: int) -> tuple[list[int], int]:
+    async def resolve_chat(update: object) -> int | None:
+        return update.effective_chat.id if isinstance(update, Update) else None
+
+    release = asyncio.Event()
+    handled = []
+
+    async def handle(update: Update, _) -> None:
+        await release.wait()
+        handled.append(update.update_id)
+
+    app = (Application.builder().token('0:test').updater(None).request(FakeTelegram())
+           .concurrent_updates(ChatOrderedUpdateProcessor(resolve_chat, stats_interval=0)).build())
+    app.add_handler(TypeHandler(Update, handle))
+    server = application_server(app, SECRET, '127.0.0.1', 0, '/telegram', max_pending)
+
+    async with app:
+        await app.start()
+        await server.start()
+
+        reader, writer = await asyncio.open_connection('127.0.0.1', server.port)
+        statuses = []
+        for update_id in range(1, updates + 1):
+            statuses.append(await post(reader, writer, update(update_id)))
+            await asyncio.sleep(0.01)
+        writer.close()
+
+        release.set()
+        await server.stop()
+        while app.update_processor.in_flight > 0:
+            await asyncio.sleep(0.01)
+        await app.stop()
+
+    return statuses, len(handled)
+
+
+def test_flood_is_rejected_once_the_processor_is_saturated():
+    statuses, handled = asyncio.run(flood(max_pending=8, updates=20))
+
+    assert statuses == [200] * 8 + [503] * 12
+    assert handled == 8
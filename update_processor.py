@@ -0,0 +1,122 @@
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable
+
+from telegram.ext import BaseUpdateProcessor
+
+from metrics import metrics
+from tasks import cancel_task
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    def __init__(
+            self,
+            resolve_chat: Callable[[object], Awaitable[int | None]],
+            max_workers: int = 32,
+            max_pending: int = 4096,
+            stats_interval: float = 5,
+    ):
+        super().__init__(max_pending)
+        self.resolve_chat = resolve_chat
+        self.max_workers = max_workers
+        self.stats_interval = stats_interval
+
+        self.processed = 0
+        self.in_flight = 0
+        self.peak_depth = 0
+
+        self._workers = asyncio.Semaphore(max_workers)
+        self._chats: dict[int, deque[asyncio.Future]] = {}
+        self._registered: asyncio.Future | None = None
+        self._task: asyncio.Task | None = None
+
+    async def process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        # counts updates still waiting for a free slot too, which is the backlog webhooks push back on
+        self.in_flight += 1
+        try:
+            await super().process_update(update, coroutine)
+        finally:
+            self.in_flight -= 1
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        # updates queue up in arrival order, even while an earlier poll answer is still being resolved
+        previous = self._registered
+        registered = self._registered = asyncio.get_running_loop().create_future()
+        try:
+            try:
+                tg_chat_id = await self.resolve_chat(update)
+            except Exception:
+                tg_chat_id = None
+
+            if previous is not None:
+                await previous
+            turn = self._enqueue(tg_chat_id)
+        finally:
+            if not registered.done():
+                registered.set_result(None)
+
+        if turn is None:
+            async with self._workers:
+                await coroutine
+            self.processed += 1
+            return
+
+        try:
+            await turn
+            async with self._workers:
+                await coroutine
+            self.processed += 1
+        finally:
+            self._release(tg_chat_id, turn)
+
+    async def initialize(self) -> None:
+        if self._task is None and self.stats_interval > 0:
+            self._task = asyncio.create_task(self._report())
+
+    async def shutdown(self) -> None:
+        await cancel_task(self._task)
+        self._task = None
+
+    def queue_depths(self) -> dict[int, int]:
+        return {tg_chat_id: len(queue) for tg_chat_id, queue in self._chats.items()}
+
+    def stats(self) -> dict:
+        depths = self.queue_depths().values()
+
+        return {
+            'processed': self.processed,
+            'in_flight': self.in_flight,
+            'active_chats': len(depths),
+            'queued': sum(depths),
+            'max_depth': max(depths, default=0),
+            'peak_depth': self.peak_depth,
+        }
+
+    def _enqueue(self, tg_chat_id: int | None) -> asyncio.Future | None:
+        if tg_chat_id is None:
+            return None
+
+        queue = self._chats.setdefault(tg_chat_id, deque())
+        turn = asyncio.get_running_loop().create_future()
+        if not queue:
+            turn.set_result(None)
+        queue.append(turn)
+        self.peak_depth = max(self.peak_depth, len(queue))
+
+        return turn
+
+    def _release(self, tg_chat_id: int, turn: asyncio.Future) -> None:
+        queue = self._chats[tg_chat_id]
+        first = queue[0] is turn
+        queue.remove(turn)
+
+        if not queue:
+            del self._chats[tg_chat_id]
+        elif first and not queue[0].done():
+            queue[0].set_result(None)
+
+    async def _report(self) -> None:
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            for name, value in self.stats().items():
+                metrics.set(f'updates_{name}', value)
@@ -0,0 +1,197 @@
+import asyncio
+import hmac
+import json
+import signal
+from logging import warning
+from typing import Callable
+
+from tasks import cancel_task
+
+_REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    403: 'Forbidden',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    413: 'Payload Too Large',
+    503: 'Service Unavailable',
+}
+
+
+class WebhookServer:
+    def __init__(
+            self,
+            update_queue: asyncio.Queue,
+            decode: Callable[[dict], object],
+            secret_token: str,
+            host: str = '127.0.0.1',
+            port: int = 8443,
+            url_path: str = '/telegram',
+            batch_size: int = 64,
+            max_pending: int = 1024,
+            max_body: int = 1 << 20,
+            backlog: Callable[[], int] | None = None,
+    ):
+        self.update_queue = update_queue
+        self.decode = decode
+        self.secret_token = secret_token
+        self.host = host
+        self.port = port
+        self.url_path = url_path
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.max_body = max_body
+        self.backlog = backlog
+
+        self.received = 0
+        self.rejected = 0
+        self.invalid = 0
+        self.batches = 0
+
+        self._bodies: asyncio.Queue[bytes] = asyncio.Queue()
+        self._server: asyncio.AbstractServer | None = None
+        self._decoder: asyncio.Task | None = None
+
+    @property
+    def pending(self) -> int:
+        # the queue is drained as soon as updates are handed over, so the consumer reports the work it still holds
+        backlog = self.backlog() if self.backlog is not None else 0
+        return self._bodies.qsize() + self.update_queue.qsize() + backlog
+
+    async def start(self) -> None:
+        self._decoder = asyncio.create_task(self._decode_batches())
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+        while not self._bodies.empty():
+            await asyncio.sleep(0.01)
+        await cancel_task(self._decoder)
+        self._decoder = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                method, target, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get('content-length', 0))
+                if length > self.max_body:
+                    await self._respond(writer, 413, close=True)
+                    break
+
+                body = await reader.readexactly(length)
+                status = self._accept(method, target, headers, body)
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                await self._respond(writer, status, retry_after=status == 503, close=not keep_alive)
+
+                if not keep_alive:
+                    break
+        except (ValueError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def _accept(self, method: str, target: str, headers: dict[str, str], body: bytes) -> int:
+        if target.split('?', 1)[0] != self.url_path:
+            return 404
+
+        if method != 'POST':
+            return 405
+
+        token = headers.get('x-telegram-bot-api-secret-token', '')
+        if not hmac.compare_digest(token.encode(), self.secret_token.encode()):
+            return 403
+
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            return 503
+
+        self.received += 1
+        self._bodies.put_nowait(body)
+
+        return 200
+
+    async def _decode_batches(self) -> None:
+        while True:
+            batch = [await self._bodies.get()]
+            while len(batch) < self.batch_size and not self._bodies.empty():
+                batch.append(self._bodies.get_nowait())
+
+            self.batches += 1
+            for body in batch:
+                try:
+                    update = self.decode(json.loads(body))
+                except Exception as e:
+                    self.invalid += 1
+                    warning(f'Discarding undecodable webhook update: {e}')
+                    continue
+
+                await self.update_queue.put(update)
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: int, retry_after: bool = False, close: bool = False):
+        headers = [f'HTTP/1.1 {status} {_REASONS[status]}', 'Content-Length: 0']
+        if retry_after:
+            headers.append('Retry-After: 1')
+        if close:
+            headers.append('Connection: close')
+
+        writer.write(('\r\n'.join(headers) + '\r\n\r\n').encode('latin-1'))
+        await writer.drain()
+
+
+def application_server(app, secret_token: str, host: str, port: int, url_path: str, max_pending: int) -> WebhookServer:
+    from telegram import Update
+
+    return WebhookServer(
+        app.update_queue,
+        lambda data: Update.de_json(data, app.bot),
+        secret_token,
+        host=host,
+        port=port,
+        url_path=url_path,
+        max_pending=max_pending,
+        backlog=lambda: app.update_processor.in_flight,
+    )
+
+
+async def run_webhook(app, url: str, secret_token: str, host: str, port: int, url_path: str, max_pending: int):
+    from telegram import Update
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    server = application_server(app, secret_token, host, port, url_path, max_pending)
+
+    async with app:
+        if app.post_init is not None:
+            await app.post_init(app)
+
+        await app.bot.set_webhook(url, secret_token=secret_token, allowed_updates=Update.ALL_TYPES)
+        await app.start()
+        await server.start()
+
+        await stop.wait()
+
+        await server.stop()
+        await app.stop()
+        if app.post_stop is not None:
+            await app.post_stop(app)
+
+    if app.post_shutdown is not None:
+        await app.post_shutdown(app)
@@ -0,0 +1,56 @@
+import argparse
+import time
+import urllib.error
+import urllib.request
+
+
+def load_payloads(paths: list[str]) -> list[bytes]:
+    payloads = []
+    for file_path in paths:
+        with open(file_path, 'rb') as file:
+            if file_path.endswith('.jsonl'):
+                payloads += [line.strip() for line in file if line.strip()]
+            else:
+                payloads.append(file.read())
+
+    return payloads
+
+
+def post(url: str, secret_token: str, payload: bytes, retries: int = 10) -> int:
+    request = urllib.request.Request(url, data=payload, method='POST', headers={
+        'Content-Type': 'application/json',
+        'X-Telegram-Bot-Api-Secret-Token': secret_token,
+    })
+
+    for _ in range(retries):
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status
+        except urllib.error.HTTPError as e:
+            if e.code != 503:
+                return e.code
+            time.sleep(float(e.headers.get('Retry-After', 1)))
+
+    return 503
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Replay recorded Telegram Update payloads against the webhook.')
+    parser.add_argument('url', help='webhook url, e.g. http://127.0.0.1:8443/telegram')
+    parser.add_argument('secret_token')
+    parser.add_argument('payloads', nargs='+', help='.json files with one update or .jsonl files with one per line')
+    args = parser.parse_args()
+
+    statuses: dict[int, int] = {}
+    start = time.perf_counter()
+    payloads = load_payloads(args.payloads)
+    for payload in payloads:
+        status = post(args.url, args.secret_token, payload)
+        statuses[status] = statuses.get(status, 0) + 1
+    elapsed = time.perf_counter() - start
+
+    print(f'Posted {len(payloads)} updates in {elapsed:.2f}s: {statuses}')
+
+
+if __name__ == '__main__':
+    main()
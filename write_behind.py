@@ -0,0 +1,118 @@
+import asyncio
+from logging import warning
+from typing import TYPE_CHECKING, Awaitable, Callable
+
+from errors.bet_error import BetError
+from tasks import cancel_task
+
+if TYPE_CHECKING:
+    from storage import Storage
+
+
+class SelectionBuffer:
+    def __init__(
+            self,
+            storage: 'Storage',
+            flush_interval: float = 0.2,
+            max_entries: int = 100,
+            on_error: Callable[[int, int, BetError], Awaitable] | None = None,
+    ):
+        self.storage = storage
+        self.flush_interval = flush_interval
+        self.max_entries = max_entries
+        self.on_error = on_error
+
+        self.buffered = 0
+        self.coalesced = 0
+        self.flushes = 0
+
+        self._buffers: dict[int, dict[tuple[int, int], int]] = {}
+        self._flushing: set[asyncio.Task] = set()
+        self._pending: dict[int, set[asyncio.Future]] = {}
+        self._task: asyncio.Task | None = None
+
+    def add(self, tg_chat_id: int, member_tg_id: int, tg_poll_id: int, tg_index: int) -> None:
+        buffer = self._buffers.setdefault(tg_chat_id, {})
+        key = (member_tg_id, tg_poll_id)
+
+        if key in buffer:
+            self.coalesced += 1
+        else:
+            self.buffered += 1
+        buffer[key] = tg_index
+
+        if len(buffer) >= self.max_entries:
+            task = asyncio.create_task(self.flush(tg_chat_id))
+            self._flushing.add(task)
+            task.add_done_callback(self._flushing.discard)
+
+    async def flush(self, tg_chat_id: int) -> None:
+        buffer = self._buffers.pop(tg_chat_id, None)
+        pending = self._pending.setdefault(tg_chat_id, set())
+
+        write = None
+        if buffer:
+            selections = [
+                (member_tg_id, tg_poll_id, tg_index)
+                for (member_tg_id, tg_poll_id), tg_index in buffer.items()
+            ]
+
+            self.flushes += 1
+            write = self.storage.submit(
+                tg_chat_id,
+                lambda: self.storage.registry.get(tg_chat_id).select_options(selections)
+            )
+            pending.add(write)
+            write.add_done_callback(lambda _: self._settle(tg_chat_id, write))
+
+        if pending:
+            await asyncio.wait(set(pending))
+        else:
+            self._pending.pop(tg_chat_id, None)
+
+        if write is None:
+            return
+
+        try:
+            failures = write.result()
+        except Exception as e:
+            warning(f'Could not flush {len(selections)} poll answers for group {tg_chat_id}: {e}')
+            return
+
+        if self.on_error is None:
+            return
+
+        for (member_tg_id, _, _), error in failures:
+            try:
+                await self.on_error(tg_chat_id, member_tg_id, error)
+            except Exception as e:
+                warning(f'Could not report poll answer error for group {tg_chat_id}: {e}')
+
+    def _settle(self, tg_chat_id: int, write: asyncio.Future) -> None:
+        pending = self._pending.get(tg_chat_id)
+        if pending is None:
+            return
+
+        pending.discard(write)
+        if not pending:
+            del self._pending[tg_chat_id]
+
+    async def flush_all(self) -> None:
+        await asyncio.gather(*(self.flush(tg_chat_id) for tg_chat_id in list(self._buffers)))
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        await cancel_task(self._task)
+        self._task = None
+
+        if self._flushing:
+            await asyncio.gather(*self._flushing, return_exceptions=True)
+        await self.flush_all()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush_all()